@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Measure how much memory an inventory takes per entry.
+
+Writes a JSON Lines inventory of COUNT CA-signed certificates with
+realistic subjects and two subject alternative names each, then loads it
+as parsed description dicts, as CertificateInfo objects and as a columnar
+Inventory, and prints the bytes per entry that tracemalloc counts for each
+along with the load time.  Exits with status 1 if the Inventory takes more
+than --budget bytes per entry.
+
+    PYTHONPATH=src python benchmarks/bench_inventory.py
+    PYTHONPATH=src python benchmarks/bench_inventory.py -n 1000000 -o out.json
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from ssl_certificate_builder.inventory import (
+    Inventory, get_cert_infos, iter_entries)
+
+
+def write_inventory(path, count):
+    with open(path, 'w') as f:
+        for index in range(count):
+            f.write(json.dumps(dict(
+                basename='host-%07d' % index, C='DE', ST='Berlin',
+                O='Example Corp', OU='Team %d' % (index % 20),
+                CN='host-%07d.example.com' % index,
+                ca='ca-%d' % (index % 4),
+                subject_alt_names=['host-%07d.example.com' % index,
+                                   'host-%07d.internal' % index])))
+            f.write('\n')
+
+
+LOADERS = {
+    'dicts': lambda path: list(iter_entries(path)),
+    'objects': lambda path: list(get_cert_infos([path])),
+    'inventory': lambda path: Inventory.from_files([path]),
+}
+
+
+def measure(name, path, count):
+    '''Load the inventory with a loader and measure what it keeps.
+
+    The load is timed in a separate run, as tracing slows it down.
+    '''
+    start = time.perf_counter()
+    LOADERS[name](path)
+    seconds = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    loaded = LOADERS[name](path)
+    gc.collect()
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del loaded
+    return dict(name=name, count=count, bytes_per_entry=size / count,
+                peak_bytes_per_entry=peak / count, seconds=seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='\n'.join(__doc__.splitlines()[1:]))
+    parser.add_argument('-n', '--count', type=int, default=100000,
+                        help='number of entries')
+    parser.add_argument('--budget', type=float, default=250, metavar='BYTES',
+                        help='allowed bytes per entry of an Inventory '
+                             '(default: 250)')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write the results as JSON to FILE')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'certs.jsonl')
+        write_inventory(path, args.count)
+        results = [measure(name, path, args.count) for name in LOADERS]
+    print('%-10s %12s %12s %10s' % ('', 'bytes/entry', 'peak', 'load'))
+    for result in results:
+        print('%-10s %12.0f %12.0f %8.2f s' % (
+            result['name'], result['bytes_per_entry'],
+            result['peak_bytes_per_entry'], result['seconds']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(results=results, budget=args.budget), f,
+                      indent=1)
+    inventory = next(result for result in results
+                     if result['name'] == 'inventory')
+    if inventory['bytes_per_entry'] > args.budget:
+        print('the inventory takes more than %.0f bytes per entry'
+              % args.budget, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""Measure the cost of every issuance stage.
+
+Times config rendering, key generation per algorithm, request creation,
+self-signed and CA-signed signing and whole inventory runs for each
+backend.  Everything runs offline against the local openssl and the
+test/data/ca.* fixtures.  Results are printed as a table and can be written
+as JSON; two result files can be compared with --compare.
+
+    PYTHONPATH=src python benchmarks/bench_issuance.py -o before.json
+    PYTHONPATH=src python benchmarks/bench_issuance.py -o after.json
+    PYTHONPATH=src python benchmarks/bench_issuance.py \
+        --compare before.json after.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from ssl_certificate_builder.__main__ import generate_certificates
+from ssl_certificate_builder.backends import BACKENDS, get_backend
+from ssl_certificate_builder.builder import (
+    CertificateBuilder, CertificateInfo, render_config)
+from ssl_certificate_builder.inventory import get_cert_infos
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'test', 'data')
+
+KEY_ALGORITHMS = {
+    'rsa-2048': dict(key_type='rsa', key_size=2048),
+    'rsa-4096': dict(key_type='rsa', key_size=4096),
+    'ec-prime256v1': dict(key_type='ec', curve='prime256v1'),
+    'ec-secp384r1': dict(key_type='ec', curve='secp384r1'),
+    'ed25519': dict(key_type='ed25519'),
+}
+
+
+@contextlib.contextmanager
+def workspace():
+    '''A temporary directory that holds a copy of the test CA.'''
+    with tempfile.TemporaryDirectory() as tmpdir:
+        shutil.copy(os.path.join(DATA_DIR, 'ca.cert'), tmpdir)
+        shutil.copy(os.path.join(DATA_DIR, 'ca.key'), tmpdir)
+        yield tmpdir
+
+
+def measure(name, samples, **params):
+    '''Summarise a list of durations in seconds as a result record.'''
+    return dict(
+        name=name, count=len(samples),
+        mean=statistics.mean(samples),
+        median=statistics.median(samples),
+        min=min(samples), max=max(samples),
+        **params)
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def make_builder(tmpdir, backend, index, ca=None, **key_params):
+    cert_info = CertificateInfo(
+        'cert-%d' % index, C='DE', O='gen-ssl', CN='cert-%d' % index,
+        subject_alt_names=['cert-%d' % index, 'alt-%d' % index],
+        ca=ca, **key_params)
+    builder = CertificateBuilder(cert_info, base_dir=tmpdir, backend=backend)
+    builder.generate_config_file()
+    return builder
+
+
+def bench_config(repeat):
+    cert_info = CertificateInfo(
+        'cert', C='DE', ST='state', L='location', O='gen-ssl', OU='unit',
+        CN='cert', subject_alt_names=['cert', 'alt-1', 'alt-2'])
+
+    def render():
+        render_config.cache_clear()
+        cert_info.get_config_file()
+
+    yield measure('config', [timed(render) for _ in range(repeat)])
+    yield measure('config_cached', [timed(cert_info.get_config_file)
+                                    for _ in range(repeat)])
+
+
+def bench_stages(backend_name, repeat, algorithms):
+    backend = get_backend(backend_name)
+    with workspace() as tmpdir:
+        for algorithm in algorithms:
+            samples = [
+                timed(make_builder(tmpdir, backend, index,
+                                   **KEY_ALGORITHMS[algorithm])
+                      .generate_private_key)
+                for index in range(repeat)]
+            yield measure('keygen', samples, backend=backend_name,
+                          algorithm=algorithm)
+
+        request_samples = []
+        ca_signed_samples = []
+        self_signed_samples = []
+        for index in range(repeat):
+            builder = make_builder(tmpdir, backend, index, ca='ca',
+                                   **KEY_ALGORITHMS['ec-prime256v1'])
+            builder.generate_private_key()
+            request_samples.append(timed(builder.generate_certificate_request))
+            ca_signed_samples.append(
+                timed(builder.generate_ca_signed_certificate))
+            builder = make_builder(tmpdir, backend, index,
+                                   **KEY_ALGORITHMS['ec-prime256v1'])
+            builder.generate_private_key()
+            self_signed_samples.append(
+                timed(builder.generate_self_signed_certificate))
+        yield measure('request', request_samples, backend=backend_name)
+        yield measure('self_signed', self_signed_samples,
+                      backend=backend_name)
+        yield measure('ca_signed', ca_signed_samples, backend=backend_name)
+
+
+def bench_inventory(backend_name, size, jobs, algorithm):
+    backend = get_backend(backend_name)
+    key_params = dict(KEY_ALGORITHMS[algorithm])
+    with workspace() as tmpdir:
+        filename = os.path.join(tmpdir, 'inventory.jsonl')
+        with open(filename, 'w') as f:
+            for index in range(size):
+                entry = dict(basename='cert-%d' % index, CN='cert-%d' % index,
+                             ca='ca', **key_params)
+                f.write(json.dumps(entry) + '\n')
+        failed = []
+        elapsed = timed(lambda: failed.extend(generate_certificates(
+            get_cert_infos([filename]), jobs=jobs, backend=backend)))
+    # Failed entries cost next to nothing, so the time would be too low.
+    if failed:
+        raise RuntimeError('%d of %d inventory entries failed with the %s '
+                           'backend' % (len(failed), size, backend_name))
+    yield measure('inventory', [elapsed / size], backend=backend_name,
+                  entries=size, jobs=jobs, algorithm=algorithm,
+                  total=elapsed)
+
+
+def environment():
+    openssl = subprocess.run(['openssl', 'version'], stdout=subprocess.PIPE,
+                             universal_newlines=True).stdout.strip()
+    return dict(python=sys.version.split()[0], platform=platform.platform(),
+                openssl=openssl, cpus=os.cpu_count())
+
+
+def describe(result):
+    params = ', '.join(
+        '%s=%s' % (key, value) for key, value in sorted(result.items())
+        if key not in ('name', 'count', 'mean', 'median', 'min', 'max',
+                       'total'))
+    return '%s(%s)' % (result['name'], params)
+
+
+def compare(before_file, after_file):
+    with open(before_file) as f:
+        before = {describe(result): result
+                  for result in json.load(f)['results']}
+    with open(after_file) as f:
+        after = json.load(f)['results']
+    for result in after:
+        key = describe(result)
+        old = before.get(key)
+        change = ('%+7.1f%%' % (100 * (result['median'] / old['median'] - 1))
+                  if old else '    new')
+        print('%-72s %10.3f ms %s' % (key, 1000 * result['median'], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='\n'.join(__doc__.splitlines()[1:]))
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='samples per stage measurement')
+    parser.add_argument('--backends', default=','.join(sorted(BACKENDS)),
+                        help='comma separated list of backends')
+    parser.add_argument('--algorithms', default=','.join(KEY_ALGORITHMS),
+                        help='comma separated list of key algorithms')
+    parser.add_argument('--inventory-sizes', default='1,100',
+                        help='comma separated inventory sizes, e.g. '
+                             '1,100,10000')
+    parser.add_argument('--inventory-algorithm', default='ec-prime256v1',
+                        choices=sorted(KEY_ALGORITHMS))
+    parser.add_argument('-j', '--jobs', type=int, default=1)
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write the results as JSON to FILE')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    backends = args.backends.split(',')
+    algorithms = args.algorithms.split(',')
+    results = []
+
+    def record(measurements):
+        for result in measurements:
+            print('%-72s %10.3f ms' % (describe(result),
+                                       1000 * result['median']))
+            results.append(result)
+
+    record(bench_config(max(100, args.repeat)))
+    for backend in backends:
+        record(bench_stages(backend, args.repeat, algorithms))
+    for size in map(int, args.inventory_sizes.split(',')):
+        for backend in backends:
+            record(bench_inventory(backend, size, args.jobs,
+                                   args.inventory_algorithm))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(environment=environment(), results=results), f,
+                      indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Compare the staged openssl backend with the pipelined one.
+
+Issues the same self-signed and CA-signed certificates with both backends
+and prints the mean time per stage and per certificate.
+
+    PYTHONPATH=src python benchmarks/bench_pipeline.py [-n COUNT]
+"""
+import argparse
+import collections
+import os
+import shutil
+import tempfile
+import time
+
+from ssl_certificate_builder.backends import (
+    OpenSSLBackend, OpenSSLPipelineBackend)
+from ssl_certificate_builder.builder import CertificateBuilder, CertificateInfo
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'test', 'data')
+
+
+def run(backend, count, ca, key_size):
+    stages = collections.defaultdict(float)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        shutil.copy(os.path.join(DATA_DIR, 'ca.cert'), tmpdir)
+        shutil.copy(os.path.join(DATA_DIR, 'ca.key'), tmpdir)
+        start = time.perf_counter()
+        for index in range(count):
+            cert_info = CertificateInfo(
+                'cert-%d' % index, CN='cert-%d' % index, ca=ca,
+                key_size=key_size,
+                subject_alt_names=['cert-%d' % index])
+            builder = CertificateBuilder(cert_info, base_dir=tmpdir,
+                                         backend=backend)
+            builder.generate_full_certificate()
+            for stage, seconds in builder.timings.items():
+                stages[stage] += seconds
+        total = time.perf_counter() - start
+    return total, stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=20)
+    parser.add_argument('--key-size', type=int, default=2048)
+    args = parser.parse_args()
+
+    for ca in (None, 'ca'):
+        print('%s certificates, %d x RSA-%d'
+              % ('CA-signed' if ca else 'Self-signed', args.count,
+                 args.key_size))
+        for backend in (OpenSSLBackend(), OpenSSLPipelineBackend()):
+            total, stages = run(backend, args.count, ca, args.key_size)
+            print('  %-14s %8.1f ms/cert' % (
+                backend.name, 1000 * total / args.count))
+            for stage, seconds in stages.items():
+                print('    %-28s %8.1f ms' % (
+                    stage, 1000 * seconds / args.count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Measure how long gen-ssl takes to start.
+
+Times a bare interpreter, importing ssl_certificate_builder.__main__ and
+running 'gen-ssl --help', each in a fresh process, and lists the slowest
+imports as reported by python -X importtime.  Exits with status 1 if
+starting gen-ssl takes more than --budget milliseconds longer than starting
+the bare interpreter, so it can guard against startup regressions.
+
+    PYTHONPATH=src python benchmarks/bench_startup.py
+    PYTHONPATH=src python benchmarks/bench_startup.py --budget 50 -o out.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+COMMANDS = {
+    'bare': ['-c', 'pass'],
+    'import': ['-c', 'import ssl_certificate_builder.__main__'],
+    'help': ['-m', 'ssl_certificate_builder', '--help'],
+}
+
+
+def environment():
+    '''The environment for the measured processes.
+
+    Bytecode caching is enabled, as it is for installed packages, so the
+    measurements don't include compiling the sources.
+    '''
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return env
+
+
+def measure(name, args, repeat):
+    '''Run python with args repeat times and summarise the wall times.'''
+    env = environment()
+    command = [sys.executable] + args
+    # Warm up the bytecode cache and the OS file cache.
+    subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, stdout=subprocess.DEVNULL,
+                       check=True)
+        samples.append(time.perf_counter() - start)
+    return dict(name=name, count=len(samples),
+                median=statistics.median(samples), min=min(samples),
+                max=max(samples))
+
+
+def slowest_imports(count):
+    '''The top-level imports of __main__ with the highest cumulative time.
+    '''
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         'import ssl_certificate_builder.__main__'],
+        env=environment(), stderr=subprocess.PIPE, check=True,
+        universal_newlines=True).stderr
+    imports = []
+    for line in stderr.splitlines()[1:]:
+        _, self_time, cumulative, name = (
+            part.strip() for part in line.replace(':', '|', 1).split('|'))
+        imports.append((int(cumulative), int(self_time), name))
+    imports.sort(reverse=True)
+    return imports[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='\n'.join(__doc__.splitlines()[1:]))
+    parser.add_argument('-n', '--repeat', type=int, default=20,
+                        help='runs per measurement')
+    parser.add_argument('--budget', type=float, default=75, metavar='MS',
+                        help='allowed startup time of gen-ssl --help over '
+                             'the bare interpreter (default: 75)')
+    parser.add_argument('--imports', type=int, default=15, metavar='N',
+                        help='number of slowest imports to list')
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help='write the results as JSON to FILE')
+    args = parser.parse_args()
+
+    results = [measure(name, command, args.repeat)
+               for name, command in COMMANDS.items()]
+    for result in results:
+        print('%-8s %8.1f ms' % (result['name'], 1000 * result['median']))
+    print()
+    print('%12s %12s  %s' % ('cumulative', 'self', 'import'))
+    for cumulative, self_time, name in slowest_imports(args.imports):
+        print('%9.1f ms %9.1f ms  %s' % (cumulative / 1000, self_time / 1000,
+                                         name))
+
+    medians = {result['name']: result['median'] for result in results}
+    overhead = 1000 * (medians['help'] - medians['bare'])
+    print()
+    print('startup overhead: %.1f ms (budget: %.1f ms)'
+          % (overhead, args.budget))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(results=results, overhead=overhead,
+                           budget=args.budget), f, indent=1)
+    if overhead > args.budget:
+        print('startup overhead exceeds the budget', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,9 +11,11 @@ setup(
     packages=find_packages('src'),
     package_dir={'': 'src'},
     install_requires=[
-        'jinja2',
         'pyyaml',
     ],
+    extras_require={
+        'cryptography': ['cryptography'],
+    },
 
     entry_points={
         'console_scripts': [
@@ -1,232 +1,764 @@
 #!/usr/bin/env python3
 
-import getpass
-import itertools
+import argparse
+import functools
 import os
-import subprocess
+import shutil
 import sys
-import textwrap
-
-from jinja2 import Template
-import yaml
-
-
-class CertificateInfo:
-    DEFAULT_KEY_SIZE = 2048
-    DEFAULT_EXPIRATION_DAYS = 10000
-
-    CERTIFICATE_EXT = "cert"
-    PRIVATE_KEY_EXT = "key"
-    CERT_REQUEST_EXT = "csr"
-    CONFIG_EXT = "cnf"
-
-    CONFIG_FILE_TEMPLATE = Template(textwrap.dedent("""\
-        extensions=v3_extensions
-
-        [req]
-        req_extensions=v3_extensions
-        x509_extensions=v3_extensions
-        distinguished_name=req_distinguished_name
-        prompt=no
-
-        [req_distinguished_name]
-        {% if cert_info.C %}C={{ cert_info.C }}{% endif %}
-        {% if cert_info.ST %}ST={{ cert_info.ST }}{% endif %}
-        {% if cert_info.L %}L={{ cert_info.L }}{% endif %}
-        {% if cert_info.O %}O={{ cert_info.O }}{% endif %}
-        {% if cert_info.OU %}OU={{ cert_info.OU }}{% endif %}
-        {% if cert_info.CN %}CN={{ cert_info.CN }}{% endif %}
-
-        [v3_extensions]
-        {% if cert_info.is_ca -%}
-        basicConstraints=CA:true
-        subjectKeyIdentifier=hash
-        authorityKeyIdentifier=keyid:always, issuer
-        {%- else -%}
-        basicConstraints=CA:false
-        keyUsage=digitalSignature, nonRepudiation, keyEncipherment
-        {%- endif %}
-        {% if cert_info.subject_alt_names -%}
-        subjectAltName=@alt_names
-
-        [alt_names]
-        {% for alt_name in cert_info.subject_alt_names -%}
-        DNS.{{ loop.index }}={{ alt_name }}
-        {% endfor %}
-        {%- endif %}
-    """))
-
-    def __init__(self, basename,
-                 C="", ST="", L="", O="", OU="", CN="",
-                 subject_alt_names=None, is_ca=False,
-                 ca=None,
-                 key_size=DEFAULT_KEY_SIZE,
-                 expiration_days=DEFAULT_EXPIRATION_DAYS,
-                 use_password=False):
-        self.basename = basename
-
-        self.C = C
-        self.ST = ST
-        self.L = L
-        self.O = O
-        self.OU = OU
-        self.CN = CN
-
-        self.subject_alt_names = subject_alt_names
-        self.is_ca = is_ca
-        self.ca = ca
-        self.key_size = key_size
-        self.expiration_days = expiration_days
-        self.use_password = use_password
-
-    def get_config_file(self):
-        return self.CONFIG_FILE_TEMPLATE.render(cert_info=self)
-
-    @property
-    def certificate_name(self):
-        return self._filename(self.CERTIFICATE_EXT)
-
-    @property
-    def private_key_name(self):
-        return self._filename(self.PRIVATE_KEY_EXT)
-
-    @property
-    def certificate_request_name(self):
-        return self._filename(self.CERT_REQUEST_EXT)
-
-    @property
-    def config_file_name(self):
-        return self._filename(self.CONFIG_EXT)
-
-    def _filename(self, ext):
-        return "%s.%s" % (self.basename, ext)
-
-    @classmethod
-    def from_dict(cls, dict):
-        kwargs = {'is_ca': False}
-        for key, value in dict.items():
-            if key == 'type':
-                kwargs['is_ca'] = value == 'ca'
-            else:
-                kwargs[key.replace('-', '_')] = value
-        return cls(**kwargs)
-
-
-class OpenSSL:
-    DEFAULT_OPENSSL = "openssl"
-
-    def __init__(self, openssl=DEFAULT_OPENSSL):
-        self.openssl = openssl
-
-    def __call__(self, pos_args, *opts, **opts_with_values):
-        args = self.build_openssl_commandline(pos_args, *opts,
-                                              **opts_with_values)
-        subprocess.check_call(args)
-
-    def build_openssl_commandline(self, pos_args, *opts, **opts_with_values):
-        args = [self.openssl]
-        if len(pos_args):
-            args.append(pos_args[0])
-            pos_args = pos_args[1:]
-
-        args.extend("-%s" % opt for opt in opts)
-        args.extend(itertools.chain.from_iterable(
-            ("-%s" % opt, value)
-            for opt, value
-            in opts_with_values.items()))
-        args.extend(pos_args)
-
-        return list(map(str, args))
-
-
-class CertificateBuilder:
-    def __init__(self, cert_info, base_dir=None, openssl=OpenSSL()):
-        self.cert_info = cert_info
-        self.base_dir = base_dir if base_dir else os.curdir
-        self.openssl = openssl
-        self.key_password = None
-
-    def generate_config_file(self):
-        with open(self._path(self.cert_info.config_file_name), "w") as f:
-            f.write(self.cert_info.get_config_file())
-
-    def generate_private_key(self):
-        args = [["genrsa", self.cert_info.key_size]]
-        if self.cert_info.use_password:
-            args.append('aes256')
-        self.openssl(
-            *args,
-            out=self._path(self.cert_info.private_key_name),
-            passout='pass:%s' % self.key_password)
-
-    def generate_certificate_request(self):
-        self.openssl(
-            ["req"], "new", "sha512",
-            out=self._path(self.cert_info.certificate_request_name),
-            key=self._path(self.cert_info.private_key_name),
-            config=self._path(self.cert_info.config_file_name),
-            passin='pass:%s' % self.key_password)
-
-    def generate_self_signed_certificate(self):
-        self.openssl(
-            ["req"], "x509", "new", "sha512", "nodes",
-            key=self._path(self.cert_info.private_key_name),
-            out=self._path(self.cert_info.certificate_name),
-            days=self.cert_info.expiration_days,
-            config=self._path(self.cert_info.config_file_name),
-            passin='pass:%s' % self.key_password)
-
-    def generate_ca_signed_certificate(self):
-        self.openssl(
-            ["x509"], "req", "CAcreateserial",
-            CA=self._path("%s.%s"
-                          % (self.cert_info.ca,
-                             CertificateInfo.CERTIFICATE_EXT)),
-            CAkey=self._path("%s.%s"
-                             % (self.cert_info.ca,
-                                CertificateInfo.PRIVATE_KEY_EXT)),
-            out=self._path(self.cert_info.certificate_name),
-            extfile=self._path(self.cert_info.config_file_name),
-            days=self.cert_info.expiration_days,
-            **{"in": self._path(self.cert_info.certificate_request_name)})
-
-    def generate_full_certificate(self):
-        if self.cert_info.use_password:
-            if sys.stdin.isatty():
-                self.key_password = getpass.getpass()
-            else:
-                print('Password:', end=' ')
-                self.key_password = input()
-        self.generate_config_file()
-        self.generate_private_key()
-        if self.cert_info.ca is None:
-            self.generate_self_signed_certificate()
+import tempfile
+import threading
+
+from .backends import (
+    BACKENDS, OpenSSLBackend, get_backend, write_private_file)
+from .batch import SigningBatches
+from .builder import CertificateBuilder, CertificateInfo, certificate_key
+from .configs import ConfigStore, ConfigStores
+from .instrumentation import Profiler, Recorder, get_recorder, set_recorder
+from .inventory import get_cert_infos
+from .keypool import KeyPool
+from .manifest import Manifests, fingerprint
+from .passwords import get_password_source
+from .scheduler import Scheduler, Task
+from .sharding import (
+    ShardError, merge_shards, parse_shard, select_cas, select_shard,
+    write_marker)
+
+
+class InventoryOrderError(Exception):
+    """A certificate comes before the CA that signs it."""
+
+
+class RunSummary:
+    """What the builders of a run did, for the summary at its end."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reused_keys = 0
+
+    def record(self, builder):
+        if builder.key_reused:
+            with self.lock:
+                self.reused_keys += 1
+
+
+def build_certificate(builder, manifest=None, batches=None, summary=None,
+                      writer=None):
+    callbacks = []
+    if manifest is not None:
+        current_fingerprint = fingerprint(builder)
+        if manifest.is_current(builder, current_fingerprint):
+            return
+        callbacks.append(functools.partial(manifest.record,
+                                           fingerprint=current_fingerprint))
+    if writer is not None:
+        writer.stage(builder)
+        callbacks.insert(0, writer.add)
+
+    def on_signed(builder):
+        builder.remove_intermediate_files()
+        for callback in callbacks:
+            callback(builder)
+
+    cert_info = builder.cert_info
+    try:
+        if batches is not None and cert_info.ca is not None \
+                and not cert_info.is_ca:
+            builder.generate_batch_request()
+            batches.add(builder, on_signed)
         else:
-            self.generate_certificate_request()
-            self.generate_ca_signed_certificate()
-
-    def _path(self, filename):
-        return os.path.join(self.base_dir, filename)
-
-
-def get_cert_infos(filenames):
-    for filename in filenames:
-        with open(filename, 'r') as f:
-            document = yaml.load(f)
-        basedir = os.path.dirname(filename)
-        for item in document:
-            yield basedir, CertificateInfo.from_dict(item)
-
-
-def generate_certificates(cert_infos):
+            builder.generate_full_certificate()
+            on_signed(builder)
+    except Exception:
+        if writer is not None:
+            writer.discard(builder)
+        raise
+    if summary is not None:
+        summary.record(builder)
+
+
+def generate_certificates(cert_infos, jobs=1, backend=None,
+                          incremental=False, key_pool=None,
+                          batch_sign=False, profiler=None, reuse_key=False,
+                          output_dir=None, password_source=None,
+                          writer=None, shared_config=False,
+                          keep_intermediates=True):
+    if backend is None:
+        backend = OpenSSLBackend()
+    config_dir = None
+    if shared_config and not keep_intermediates:
+        config_dir = tempfile.mkdtemp(prefix=".gen-ssl-configs-",
+                                      dir=output_dir)
+    config_stores = ConfigStores(config_dir) if shared_config else None
+    scheduler = Scheduler(jobs)
+    manifests = Manifests() if incremental else None
+    batches = SigningBatches(backend) if batch_sign else None
+    summary = RunSummary()
+    recorder = get_recorder()
+    if recorder is not None:
+        cert_infos = recorder.iterate(cert_infos, "parse",
+                                      lambda item: item[1].basename)
+    if profiler is not None:
+        cert_infos = profiler.iterate(cert_infos)
+    # The CAs described so far, and those whose files on disk certificates
+    # were signed with before the CA itself came up in the run.
+    described_cas = set()
+    used_from_disk = set()
     for basedir, cert_info in cert_infos:
-        builder = CertificateBuilder(cert_info, base_dir=basedir)
-        builder.generate_full_certificate()
-
-
-def main():
-    cert_infos = get_cert_infos(sys.argv[1:])
-    generate_certificates(cert_infos)
+        key = certificate_key(basedir, cert_info.basename)
+        if key in used_from_disk:
+            # Rebuilding it would replace the CA files under the
+            # certificates already signed with them.
+            scheduler.reject(key, InventoryOrderError(
+                "CA %s has to be described before the certificates it "
+                "signs" % cert_info.basename))
+            continue
+        if cert_info.is_ca:
+            described_cas.add(key)
+        # CAs stay next to the description, where their leaves look.
+        builder = CertificateBuilder(
+            cert_info,
+            base_dir=output_dir if output_dir and not cert_info.is_ca
+            else basedir,
+            ca_dir=basedir, serial_dir=output_dir, backend=backend,
+            key_pool=key_pool, reuse_key=reuse_key,
+            password_source=password_source,
+            config_store=config_stores[output_dir or basedir]
+            if shared_config else None,
+            keep_intermediates=keep_intermediates)
+        deps = []
+        if cert_info.ca is not None:
+            ca_key = certificate_key(basedir, cert_info.ca)
+            if ca_key in described_cas:
+                deps.append(ca_key)
+            elif os.path.exists(builder.ca_certificate_path) \
+                    and os.path.exists(builder.ca_private_key_path):
+                used_from_disk.add(ca_key)
+            else:
+                scheduler.reject(key, InventoryOrderError(
+                    "CA %s is neither described before it nor in %s" % (
+                        cert_info.ca, basedir or os.curdir)))
+                continue
+        func = functools.partial(
+            build_certificate, builder,
+            manifests[builder.base_dir] if incremental else None,
+            batches, summary, writer)
+        if profiler is not None:
+            func = profiler.wrap(func)
+        scheduler.submit(key, func, deps)
+    failed = [(task.state, task.key, task.error)
+              for task in scheduler.wait()]
+    if batch_sign:
+        for builder, error in batches.sign(jobs):
+            if writer is not None:
+                writer.discard(builder)
+            failed.append((
+                Task.FAILED,
+                certificate_key(builder.base_dir, builder.cert_info.basename),
+                error))
+    if writer is not None:
+        writer.close()
+    if config_dir is not None:
+        shutil.rmtree(config_dir)
+    if incremental:
+        manifests.save()
+    if reuse_key or summary.reused_keys:
+        print("reused %d existing private keys, skipping their generation"
+              % summary.reused_keys)
+    for state, key, error in failed:
+        print("%s: %s: %s" % (state, key, error), file=sys.stderr)
+    return failed
+
+
+def argument_type(parse):
+    """Make argparse report the ValueError message of parse."""
+    @functools.wraps(parse)
+    def parse_argument(text):
+        try:
+            return parse(text)
+        except ValueError as exc:
+            raise argparse.ArgumentTypeError(str(exc))
+    return parse_argument
+
+
+def add_backend_arguments(parser):
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, metavar="N",
+        help="build up to N certificates in parallel; CAs are always "
+             "issued before the certificates they sign")
+    parser.add_argument(
+        "--backend", choices=["auto"] + sorted(BACKENDS), default="auto",
+        help="how keys and certificates are generated: in-process with "
+             "the cryptography package or by running the openssl command "
+             "(default: cryptography if it is installed)")
+
+
+def add_password_source_argument(parser):
+    parser.add_argument(
+        "--password-source", type=argument_type(get_password_source),
+        default="prompt",
+        metavar="SOURCE",
+        help="where the passwords of encrypted keys come from: prompt "
+             "(for every key, the default), prompt-once (one password for "
+             "the whole run), prompt-per-ca (one password per CA for its "
+             "own key and the keys it signs), env:NAME, file:PATH or fd:N")
+
+
+def add_reuse_key_argument(parser):
+    parser.add_argument(
+        "--reuse-key", action="store_true",
+        help="keep existing private keys that match the requested key "
+             "type and size instead of generating new ones; single "
+             "descriptions can ask for this with 'reuse-key: true'")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="gen-ssl",
+        description="Generate SSL certificates from description files",
+        epilog="Other commands: %s. Run 'gen-ssl COMMAND --help' for "
+               "details." % ", ".join(sorted(COMMANDS)))
+    parser.add_argument(
+        "files", nargs="*", metavar="FILE",
+        help="YAML certificate description file, or a JSON Lines file "
+             "with one description per line (.jsonl); a basename like "
+             "node-{001..100} describes one certificate per number")
+    add_backend_arguments(parser)
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="only rebuild certificates whose description, config or "
+             "issuing CA changed since the last incremental run")
+    parser.add_argument(
+        "--batch-sign", action="store_true",
+        help="sign all certificates of a CA together in one signing "
+             "session after their keys and requests have been created")
+    parser.add_argument(
+        "--key-pool", metavar="DIR",
+        help="take private keys from the key pool in DIR when it has "
+             "matching ones")
+    add_reuse_key_argument(parser)
+    add_password_source_argument(parser)
+    sharding = parser.add_mutually_exclusive_group()
+    sharding.add_argument(
+        "--shard", type=argument_type(parse_shard), metavar="INDEX/COUNT",
+        help="only build the leaf certificates of shard INDEX out of COUNT; "
+             "the CAs have to be issued beforehand with --cas-only")
+    sharding.add_argument(
+        "--cas-only", action="store_true",
+        help="only build the CAs, before building the leaves in shards")
+    parser.add_argument(
+        "--output-dir", metavar="DIR",
+        help="write the certificates to DIR instead of next to their "
+             "description file; CAs are still read from there")
+    parser.add_argument(
+        "--shared-config", action="store_true",
+        help="write one OpenSSL config file per distinct configuration to "
+             "%s/ and pass the subject and subject alternative names in "
+             "the environment, instead of one .cnf file per certificate"
+             % ConfigStore.DIRNAME)
+    parser.add_argument(
+        "--no-intermediates", action="store_false",
+        dest="keep_intermediates",
+        help="don't keep the .cnf and .csr files of the certificates")
+    parser.add_argument(
+        "--atomic", action="store_true",
+        help="build every certificate in a staging directory and move its "
+             "files into place once all of them are complete")
+    parser.add_argument(
+        "--sync-batch", type=int, default=64, metavar="N",
+        help="with --atomic, sync and move completed certificates in "
+             "batches of N (default: 64)")
+    parser.add_argument(
+        "--fullchain", action="store_true",
+        help="also write BASENAME.fullchain.pem with the certificate and "
+             "its CA chain (implies --atomic)")
+    parser.add_argument(
+        "--pkcs12", action="store_true",
+        help="also write a BASENAME.p12 bundle of key, certificate and CA "
+             "chain, protected by the key password (implies --atomic)")
+    parser.add_argument(
+        "--archive", metavar="FILE",
+        help="also collect all files written by the run into a .tar, "
+             ".tar.gz, .tar.bz2, .tar.xz or .zip FILE (implies --atomic)")
+    parser.add_argument(
+        "--timings", metavar="FILE",
+        help="record the time spent in every build stage and openssl run "
+             "and write a report to FILE (CSV if FILE ends in .csv, JSON "
+             "otherwise)")
+    parser.add_argument(
+        "--profile", metavar="FILE",
+        help="profile the Python side of the run with cProfile and write "
+             "the stats to FILE")
+    return parser.parse_args(argv)
+
+
+def generate_main(argv):
+    args = parse_args(argv)
+    cert_infos = get_cert_infos(args.files)
+    if args.cas_only:
+        cert_infos = select_cas(cert_infos)
+    elif args.shard:
+        cert_infos = select_shard(cert_infos, *args.shard)
+        if args.output_dir:
+            write_marker(args.output_dir, *args.shard)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    backend = get_backend(args.backend)
+    key_pool = KeyPool(args.key_pool) if args.key_pool else None
+    recorder = Recorder() if args.timings else None
+    profiler = Profiler() if args.profile else None
+    if args.atomic or args.fullchain or args.pkcs12 or args.archive:
+        from .output import OutputWriter
+        writer = OutputWriter(batch_size=args.sync_batch,
+                              fullchain=args.fullchain, pkcs12=args.pkcs12,
+                              archive=args.archive)
+    else:
+        writer = None
+    set_recorder(recorder)
+    try:
+        failed = generate_certificates(
+            cert_infos, jobs=args.jobs, backend=backend,
+            incremental=args.incremental, key_pool=key_pool,
+            batch_sign=args.batch_sign, profiler=profiler,
+            reuse_key=args.reuse_key, output_dir=args.output_dir,
+            password_source=args.password_source, writer=writer,
+            shared_config=args.shared_config,
+            keep_intermediates=args.keep_intermediates)
+    finally:
+        set_recorder(None)
+        if recorder is not None:
+            recorder.write_report(args.timings)
+        if profiler is not None:
+            profiler.dump(args.profile)
+    if failed:
+        sys.exit(1)
+
+
+def pool_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="gen-ssl pool",
+        description="Manage a pool of pre-generated private keys")
+    parser.add_argument("action", choices=["fill", "status"])
+    parser.add_argument(
+        "--pool", metavar="DIR", required=True,
+        help="key pool directory")
+    parser.add_argument(
+        "--key-size", type=int, default=CertificateInfo.DEFAULT_KEY_SIZE,
+        metavar="BITS", help="size of the pooled RSA keys")
+    parser.add_argument(
+        "--key-type", choices=CertificateInfo.KEY_TYPES,
+        default=CertificateInfo.DEFAULT_KEY_TYPE,
+        help="type of the pooled keys")
+    parser.add_argument(
+        "--curve", default=CertificateInfo.DEFAULT_CURVE,
+        help="named curve of pooled EC keys")
+    parser.add_argument(
+        "--size", type=int, default=100, metavar="N",
+        help="number of keys to keep in the pool")
+    parser.add_argument(
+        "--background", action="store_true",
+        help="fill the pool in a detached background process")
+    add_backend_arguments(parser)
+    args = parser.parse_args(argv)
+
+    key_pool = KeyPool(args.pool)
+    key_info = CertificateInfo(None, key_size=args.key_size,
+                               key_type=args.key_type, curve=args.curve)
+    bucket = KeyPool.bucket_for(key_info)
+    if args.action == "status":
+        print("%s: %d" % (bucket, key_pool.count(bucket)))
+        return
+    if args.background:
+        if os.fork():
+            return
+        os.setsid()
+    failed = key_pool.fill(key_info, args.size, jobs=args.jobs,
+                           backend=get_backend(args.backend))
+    for task in failed:
+        print("failed: %s" % task.error, file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+def renew_main(argv):
+    from .renewal import (
+        CertificateIndexes, find_renewals, parse_duration)
+
+    parser = argparse.ArgumentParser(
+        prog="gen-ssl renew",
+        description="Re-issue the certificates that are about to expire or "
+                    "whose CA was re-issued")
+    parser.add_argument(
+        "files", nargs="+", metavar="FILE",
+        help="certificate description files")
+    parser.add_argument(
+        "--within", type=argument_type(parse_duration),
+        default=parse_duration("30d"),
+        metavar="DURATION",
+        help="renew certificates that expire within DURATION, e.g. 30d, "
+             "12h or 2w (default: 30d)")
+    parser.add_argument(
+        "-n", "--dry-run", action="store_true",
+        help="only list the certificates that would be renewed")
+    parser.add_argument(
+        "--key-pool", metavar="DIR",
+        help="take private keys from the key pool in DIR when it has "
+             "matching ones")
+    add_reuse_key_argument(parser)
+    add_password_source_argument(parser)
+    add_backend_arguments(parser)
+    args = parser.parse_args(argv)
+
+    indexes = CertificateIndexes()
+
+    def renewals():
+        for basedir, cert_info, reason in find_renewals(
+                get_cert_infos(args.files), args.within, indexes):
+            print("renew: %s: %s" % (
+                certificate_key(basedir, cert_info.basename), reason),
+                flush=True)
+            yield basedir, cert_info
+
+    try:
+        if args.dry_run:
+            for _ in renewals():
+                pass
+            return
+        failed = generate_certificates(
+            renewals(), jobs=args.jobs, backend=get_backend(args.backend),
+            key_pool=KeyPool(args.key_pool) if args.key_pool else None,
+            reuse_key=args.reuse_key, password_source=args.password_source)
+    finally:
+        indexes.save()
+    if failed:
+        sys.exit(1)
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "%dh %02dm" % (hours, minutes)
+    elif minutes:
+        return "%dm %02ds" % (minutes, seconds)
+    return "%ds" % seconds
+
+
+def plan_main(argv):
+    from .plan import CostModel, PlannedCertificate, make_plan
+
+    parser = argparse.ArgumentParser(
+        prog="gen-ssl plan",
+        description="Check the certificate descriptions and show what a "
+                    "run would build, without running openssl")
+    parser.add_argument(
+        "files", nargs="+", metavar="FILE",
+        help="certificate description files")
+    parser.add_argument(
+        "--output-dir", metavar="DIR",
+        help="look for the certificates in DIR, as with gen-ssl "
+             "--output-dir")
+    parser.add_argument(
+        "--costs", metavar="FILE",
+        help="estimate the run time from the results of "
+             "benchmarks/bench_issuance.py in FILE")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true",
+        help="also list the certificates that are up to date")
+    add_backend_arguments(parser)
+    args = parser.parse_args(argv)
+
+    plan = make_plan(args.files, output_dir=args.output_dir)
+    for planned in plan.certificates:
+        if args.verbose \
+                or planned.status != PlannedCertificate.UP_TO_DATE:
+            print("%-10s %s" % (planned.status, planned.key))
+    print("%d certificates: %d new, %d changed, %d up to date" % (
+        len(plan), plan.count(PlannedCertificate.NEW),
+        plan.count(PlannedCertificate.CHANGED),
+        plan.count(PlannedCertificate.UP_TO_DATE)))
+    if args.costs:
+        backend = get_backend(args.backend).name
+        try:
+            costs = CostModel.load(args.costs, backend)
+        except (OSError, ValueError, KeyError) as exc:
+            print("error: can't read the costs from %s: %s"
+                  % (args.costs, exc), file=sys.stderr)
+            sys.exit(1)
+        print("estimated run time with the %s backend and %d jobs: %s for "
+              "the %d outdated certificates (--incremental), %s for all" % (
+                  backend, args.jobs,
+                  format_duration(costs.estimate(
+                      (planned.cert_info for planned in plan.outdated),
+                      args.jobs)),
+                  len(plan) - plan.count(PlannedCertificate.UP_TO_DATE),
+                  format_duration(costs.estimate(
+                      (planned.cert_info for planned in plan.certificates),
+                      args.jobs))))
+        if costs.missing:
+            print("warning: no benchmark results for %s; the estimate "
+                  "leaves them out" % ", ".join(sorted(costs.missing)),
+                  file=sys.stderr)
+    for problem in plan.problems:
+        print("error: %s" % problem, file=sys.stderr)
+    if plan.problems:
+        sys.exit(1)
+
+
+def watch_main(argv):
+    from .watch import WatchedInventory, debounced, get_watcher
+
+    parser = argparse.ArgumentParser(
+        prog="gen-ssl watch",
+        description="Watch the description files in a directory and rebuild "
+                    "the certificates whose descriptions change")
+    parser.add_argument(
+        "directory", metavar="DIR",
+        help="directory with .yaml, .yml and .jsonl description files")
+    parser.add_argument(
+        "--debounce", type=float, default=0.5, metavar="SECONDS",
+        help="wait until the files were left alone for SECONDS before "
+             "rebuilding (default: 0.5)")
+    parser.add_argument(
+        "--poll", type=float, nargs="?", const=1.0, metavar="SECONDS",
+        help="check the files for changes every SECONDS (default: 1) "
+             "instead of using inotify")
+    add_reuse_key_argument(parser)
+    add_password_source_argument(parser)
+    add_backend_arguments(parser)
+    args = parser.parse_args(argv)
+
+    inventory = WatchedInventory(args.directory)
+    watcher = get_watcher(args.directory, poll=args.poll is not None,
+                          interval=args.poll or 1.0)
+    backend = get_backend(args.backend)
+    _, _, errors = inventory.update(inventory.description_files())
+    for error in errors:
+        print("error: %s" % error, file=sys.stderr, flush=True)
+    print("watching %s: %d certificates" % (args.directory, len(inventory)),
+          flush=True)
+    try:
+        for names in debounced(watcher, args.debounce):
+            rebuild, removed, errors = inventory.update(names)
+            for error in errors:
+                print("error: %s" % error, file=sys.stderr, flush=True)
+            for key in removed:
+                print("removed: %s" % key, flush=True)
+            if not rebuild:
+                continue
+            print("rebuilding: %s" % ", ".join(
+                certificate_key(basedir, cert_info.basename)
+                for basedir, cert_info in rebuild), flush=True)
+            failed = generate_certificates(
+                rebuild, jobs=args.jobs, backend=backend,
+                reuse_key=args.reuse_key,
+                password_source=args.password_source)
+            print("rebuilt %d certificates, %d failed"
+                  % (len(rebuild) - len(failed), len(failed)), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+def verify_main(argv):
+    from .renewal import parse_duration
+    from .verify import Report, verification_tasks, verify_certificates
+
+    parser = argparse.ArgumentParser(
+        prog="gen-ssl verify",
+        description="Check that the certificates of an inventory match their "
+                    "keys and descriptions and chain to their CAs")
+    parser.add_argument(
+        "files", nargs="+", metavar="FILE",
+        help="certificate description files")
+    parser.add_argument(
+        "--output-dir", metavar="DIR",
+        help="look for the certificates in DIR, as with gen-ssl "
+             "--output-dir")
+    parser.add_argument(
+        "--within", type=argument_type(parse_duration), default=0,
+        metavar="DURATION",
+        help="also fail certificates that expire within DURATION, e.g. 30d, "
+             "12h or 2w")
+    parser.add_argument(
+        "--report", metavar="FILE",
+        help="write the result of every check as JSON to FILE")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true",
+        help="also list the certificates that passed")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1, metavar="N",
+        help="check certificates in N processes (default: the number of "
+             "CPUs)")
+    add_password_source_argument(parser)
+    args = parser.parse_args(argv)
+
+    tasks = verification_tasks(
+        get_cert_infos(args.files), output_dir=args.output_dir,
+        password_source=args.password_source, within=args.within)
+    report = Report(args.report) if args.report else None
+    passed = failed = 0
+    try:
+        for result in verify_certificates(tasks, jobs=args.jobs):
+            if report is not None:
+                report.add(result)
+            if result["passed"]:
+                passed += 1
+            else:
+                failed += 1
+            if args.verbose or not result["passed"]:
+                print("%-4s %s" % ("ok" if result["passed"] else "FAIL",
+                                   result["certificate"]), flush=True)
+            for error in result["errors"]:
+                print("     %s" % error, flush=True)
+    except RuntimeError as exc:
+        print("error: %s" % exc, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if report is not None:
+            report.close()
+    print("verified %d certificates: %d passed, %d failed" % (
+        passed + failed, passed, failed))
+    if failed:
+        sys.exit(1)
+
+
+def merge_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="gen-ssl merge",
+        description="Check that the outputs of all shards of a run are "
+                    "complete and disjoint, then move them together")
+    parser.add_argument(
+        "files", nargs="+", metavar="FILE",
+        help="the certificate description files the shards were built from")
+    parser.add_argument(
+        "--shard-dir", action="append", required=True, metavar="DIR",
+        dest="shard_dirs",
+        help="output directory of one shard; give one per shard")
+    parser.add_argument(
+        "--into", metavar="DIR",
+        help="move the certificates to DIR instead of next to their "
+             "description file")
+    args = parser.parse_args(argv)
+
+    try:
+        problems = merge_shards(get_cert_infos(args.files), args.shard_dirs,
+                                into=args.into)
+    except ShardError as exc:
+        problems = [str(exc)]
+    for problem in problems:
+        print("error: %s" % problem, file=sys.stderr)
+    if problems:
+        sys.exit(1)
+
+
+def serve_main(argv):
+    from .server import (
+        IssuanceHTTPServer, IssuanceService, UnixIssuanceServer)
+
+    parser = argparse.ArgumentParser(
+        prog="gen-ssl serve",
+        description="Issue certificates over a Unix socket or local HTTP, "
+                    "keeping the CAs loaded between requests")
+    parser.add_argument(
+        "directory", metavar="DIR",
+        help="directory with the CA certificates and keys")
+    listen = parser.add_mutually_exclusive_group(required=True)
+    listen.add_argument(
+        "--socket", metavar="PATH", help="listen on a Unix socket")
+    listen.add_argument(
+        "--port", type=int, metavar="PORT",
+        help="listen for HTTP on localhost; 0 picks a free port")
+    parser.add_argument(
+        "--key-pool", metavar="DIR",
+        help="take private keys from the key pool in DIR when it has "
+             "matching ones")
+    add_backend_arguments(parser)
+    args = parser.parse_args(argv)
+
+    service = IssuanceService(
+        args.directory, get_backend(args.backend),
+        key_pool=KeyPool(args.key_pool) if args.key_pool else None)
+    if args.socket:
+        server = UnixIssuanceServer(args.socket, service)
+    else:
+        server = IssuanceHTTPServer(("127.0.0.1", args.port), service)
+    print("listening on %s" % server.url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def request_main(argv):
+    from .server import IssuanceClient, IssuanceError
+
+    parser = argparse.ArgumentParser(
+        prog="gen-ssl request",
+        description="Request certificates from a running 'gen-ssl serve'")
+    parser.add_argument(
+        "address", metavar="ADDRESS",
+        help="Unix socket path or http:// URL of the server")
+    parser.add_argument(
+        "files", nargs="*", metavar="FILE",
+        help="certificate description files; the certificates and keys "
+             "are written next to them")
+    parser.add_argument(
+        "--csr", metavar="FILE",
+        help="sign the certificate request in FILE instead and write the "
+             "certificate to stdout")
+    parser.add_argument("--ca", help="CA that signs the --csr request")
+    parser.add_argument("--days", type=int, help="validity of --csr")
+    parser.add_argument(
+        "--san", action="append", default=[], metavar="NAME",
+        help="subject alternative name for --csr; may be repeated")
+    args = parser.parse_args(argv)
+
+    client = IssuanceClient(args.address)
+    try:
+        if args.csr:
+            if not args.ca:
+                parser.error("--csr requires --ca")
+            with open(args.csr, "rb") as f:
+                request = f.read()
+            sys.stdout.write(client.sign(
+                request, args.ca, expiration_days=args.days,
+                subject_alt_names=args.san).decode())
+            return
+        for basedir, cert_info in get_cert_infos(args.files):
+            pem = client.issue(cert_info.to_dict())
+            key_start = pem.index(b"-----BEGIN", pem.index(b"-----END"))
+            builder = CertificateBuilder(cert_info, base_dir=basedir)
+            with open(builder.certificate_path, "wb") as f:
+                f.write(pem[:key_start].lstrip())
+            write_private_file(builder.private_key_path,
+                               pem[key_start:].lstrip())
+    except IssuanceError as exc:
+        print("failed: %s" % exc, file=sys.stderr)
+        sys.exit(1)
+
+
+COMMANDS = {
+    "merge": merge_main,
+    "plan": plan_main,
+    "pool": pool_main,
+    "renew": renew_main,
+    "request": request_main,
+    "serve": serve_main,
+    "verify": verify_main,
+    "watch": watch_main,
+}
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        COMMANDS[argv[0]](argv[1:])
+    else:
+        generate_main(argv)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,176 @@
+import asyncio
+import os
+import subprocess
+
+from .backends import OpenSSL, OpenSSLBackend
+from .builder import CertificateBuilder, certificate_key
+from .scheduler import DependencyFailed
+
+
+class AsyncOpenSSL(OpenSSL):
+    """Runs openssl as an asyncio subprocess.
+
+    At most jobs openssl processes run at the same time.  A run that is
+    cancelled kills its process before the cancellation propagates.
+    """
+
+    def __init__(self, openssl="openssl", jobs=1):
+        super().__init__(openssl)
+        self.semaphore = asyncio.Semaphore(max(1, jobs))
+
+    async def run(self, pos_args, *opts, **opts_with_values):
+        async with self.semaphore:
+            with self.secrets(opts_with_values) as (opts_with_values, fds):
+                args = self.build_openssl_commandline(pos_args, *opts,
+                                                      **opts_with_values)
+                process = await asyncio.create_subprocess_exec(
+                    *args, pass_fds=fds,
+                    env=self.environment(opts_with_values))
+            try:
+                returncode = await process.wait()
+            except asyncio.CancelledError:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, args)
+
+
+class AsyncCertificateBuilder(CertificateBuilder):
+    """CertificateBuilder whose openssl stages don't block the event loop.
+
+    Key passwords can't be prompted for: for a certificate with
+    use_password, either key_password has to be set or a password_source
+    that doesn't prompt has to be given.  If generating fails or is
+    cancelled, the files written so far are removed.
+    """
+
+    def __init__(self, cert_info, base_dir=None, openssl=None, ca_dir=None,
+                 password_source=None):
+        if openssl is None:
+            openssl = AsyncOpenSSL()
+        super().__init__(cert_info, base_dir=base_dir, openssl=openssl,
+                         backend=OpenSSLBackend(openssl), ca_dir=ca_dir,
+                         password_source=password_source)
+        self.has_password_source = password_source is not None
+        self.written_paths = []
+
+    async def generate_private_key(self):
+        with self.timed("private_key"):
+            await self._run(self.backend.private_key_command(self),
+                            self.private_key_path)
+
+    async def generate_certificate_request(self):
+        with self.timed("request"):
+            await self._run(self.backend.certificate_request_command(self),
+                            self.certificate_request_path)
+
+    async def generate_self_signed_certificate(self):
+        with self.timed("self_signed"):
+            await self._run(
+                self.backend.self_signed_certificate_command(self),
+                self.certificate_path)
+
+    async def generate_ca_signed_certificate(self):
+        with self.timed("ca_signed"):
+            await self._run(
+                self.backend.ca_signed_certificate_command(self),
+                self.certificate_path)
+
+    async def generate_full_certificate(self):
+        if self.key_password is None:
+            if self.cert_info.use_password and not self.has_password_source:
+                raise ValueError("%s: key_password has to be set for an "
+                                 "encrypted key" % self.cert_info.basename)
+            self.read_key_password()
+        try:
+            self.written_paths.append(self.config_file_path)
+            self.generate_config_file()
+            await self.generate_private_key()
+            if self.cert_info.ca is None:
+                await self.generate_self_signed_certificate()
+            else:
+                await self.generate_certificate_request()
+                await self.generate_ca_signed_certificate()
+        except BaseException:
+            self.remove_partial_outputs()
+            raise
+
+    def remove_partial_outputs(self):
+        for path in self.written_paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.written_paths = []
+
+    async def _run(self, command, output_path):
+        pos_args, opts, opts_with_values = command
+        self.written_paths.append(output_path)
+        await self.openssl.run(pos_args, *opts, **opts_with_values)
+
+
+async def generate_certificates(cert_infos, jobs=1, openssl=None,
+                                password_source=None):
+    """Build certificates and yield (builder, error) as each one finishes.
+
+    error is None for certificates that were built.  CAs are built before
+    the certificates they sign; certificates whose CA failed are skipped
+    with a DependencyFailed error.  When the consumer stops iterating, the
+    certificates still being built are cancelled.
+    """
+    if openssl is None:
+        openssl = AsyncOpenSSL(jobs=jobs)
+    max_pending = 4 * max(1, jobs)
+    tasks_by_key = {}
+    pending = set()
+
+    async def finished(return_when):
+        nonlocal pending
+        done, pending = await asyncio.wait(pending, return_when=return_when)
+        results = [task.result() for task in done]
+        for builder, error in results:
+            key = certificate_key(builder.base_dir,
+                                  builder.cert_info.basename)
+            # Unknown keys count as built, so built tasks can be dropped.
+            if error is None and tasks_by_key.get(key) in done:
+                del tasks_by_key[key]
+        return results
+
+    try:
+        for basedir, cert_info in cert_infos:
+            while len(pending) >= max_pending:
+                for result in await finished(asyncio.FIRST_COMPLETED):
+                    yield result
+            builder = AsyncCertificateBuilder(
+                cert_info, base_dir=basedir, openssl=openssl,
+                password_source=password_source)
+            dependency = None
+            if cert_info.ca is not None:
+                dependency = tasks_by_key.get(
+                    certificate_key(basedir, cert_info.ca))
+            task = asyncio.ensure_future(_build(builder, dependency))
+            tasks_by_key[certificate_key(basedir, cert_info.basename)] = task
+            pending.add(task)
+        while pending:
+            for result in await finished(asyncio.FIRST_COMPLETED):
+                yield result
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+
+async def _build(builder, dependency):
+    if dependency is not None:
+        await asyncio.wait([dependency])
+        if dependency.cancelled() or dependency.result()[1] is not None:
+            return builder, DependencyFailed(certificate_key(
+                builder.base_dir, builder.cert_info.ca))
+    try:
+        await builder.generate_full_certificate()
+    except Exception as exc:
+        return builder, exc
+    return builder, None
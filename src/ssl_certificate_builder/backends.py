@@ -0,0 +1,832 @@
+import contextlib
+import datetime
+import importlib
+import importlib.util
+import itertools
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import textwrap
+import time
+
+from .instrumentation import get_recorder
+from .serials import hex_serial
+
+
+class LazyModule:
+    """A module that is imported when one of its attributes is first used.
+
+    cryptography takes longer to import than most runs of the openssl
+    backends take to start, so it is only loaded once it is needed.
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+
+if importlib.util.find_spec("cryptography") is not None:
+    x509 = LazyModule("cryptography.x509")
+    hashes = LazyModule("cryptography.hazmat.primitives.hashes")
+    serialization = LazyModule(
+        "cryptography.hazmat.primitives.serialization")
+    ec = LazyModule("cryptography.hazmat.primitives.asymmetric.ec")
+    ed25519 = LazyModule("cryptography.hazmat.primitives.asymmetric.ed25519")
+    rsa = LazyModule("cryptography.hazmat.primitives.asymmetric.rsa")
+else:
+    x509 = None
+
+
+def write_private_file(path, data):
+    """Write data to a file that only its owner can read, like openssl
+    does for private keys.
+
+    An existing file is made private before anything is written to it.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.fchmod(fd, 0o600)
+    except BaseException:
+        os.close(fd)
+        raise
+    with open(fd, "wb") as f:
+        f.write(data)
+
+
+def file_stamp(path):
+    """What changes when the file at path is replaced or rewritten."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+# Named curves and the digest that matches their strength.
+CURVE_DIGESTS = {
+    "prime256v1": "sha256",
+    "secp384r1": "sha384",
+    "secp521r1": "sha512",
+}
+
+
+def signing_digest(key_algorithm):
+    """The digest a CA key signs certificates with, given its algorithm in
+    the form of CertificateInfo.key_algorithm.
+
+    Every backend follows this rule, so a certificate doesn't depend on the
+    backend that issued it.  Ed25519 signatures have no separate digest.
+    """
+    if key_algorithm == "ed25519":
+        return None
+    if key_algorithm is not None and key_algorithm.startswith("ec-"):
+        return CURVE_DIGESTS.get(key_algorithm[len("ec-"):], "sha256")
+    return "sha256"
+
+
+class InvalidRequestError(ValueError):
+    """A certificate request that must not be signed."""
+
+
+class Secret:
+    """A password option value, e.g. passin=Secret(password).
+
+    OpenSSL hands it to openssl as fd:N through an inherited pipe, so
+    passwords never appear on a command line.  A Secret of None leaves the
+    option out.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+
+class ConfigFile:
+    """A config or extfile option value whose file reads values from the
+    environment, e.g. config=ConfigFile(path, {"GEN_SSL_CN": "www"}).
+
+    OpenSSL runs openssl with these variables added to its environment.
+    """
+
+    def __init__(self, path, environment):
+        self.path = path
+        self.environment = environment
+
+    def __str__(self):
+        return self.path
+
+
+class OpenSSL:
+    DEFAULT_OPENSSL = "openssl"
+
+    def __init__(self, openssl=DEFAULT_OPENSSL):
+        self.openssl = openssl
+
+    def __call__(self, pos_args, *opts, **opts_with_values):
+        with self.secrets(opts_with_values) as (opts_with_values, fds):
+            args = self.build_openssl_commandline(pos_args, *opts,
+                                                  **opts_with_values)
+            env = self.environment(opts_with_values)
+            if get_recorder() is None:
+                subprocess.check_call(args, pass_fds=fds, env=env)
+            else:
+                self._wait(subprocess.Popen(args, pass_fds=fds, env=env),
+                           args, time.perf_counter())
+
+    def output(self, pos_args, *opts, **opts_with_values):
+        """Run openssl and return its standard output as text."""
+        with self.secrets(opts_with_values) as (opts_with_values, fds):
+            args = self.build_openssl_commandline(pos_args, *opts,
+                                                  **opts_with_values)
+            return subprocess.run(
+                args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                pass_fds=fds, env=self.environment(opts_with_values),
+                check=True, universal_newlines=True).stdout
+
+    @staticmethod
+    def environment(opts_with_values):
+        """The environment for the ConfigFile values of opts_with_values,
+        or None if openssl can inherit ours.
+        """
+        env = None
+        for value in opts_with_values.values():
+            if isinstance(value, ConfigFile):
+                if env is None:
+                    env = dict(os.environ)
+                env.update(value.environment)
+        return env
+
+    @staticmethod
+    @contextlib.contextmanager
+    def secrets(opts_with_values):
+        """Put the Secret values of opts_with_values into pipes.
+
+        Yields the options with every Secret replaced by fd:N and the file
+        descriptors the openssl process has to inherit.
+        """
+        resolved = {}
+        fds = []
+        try:
+            for opt, value in opts_with_values.items():
+                if isinstance(value, Secret):
+                    if value.value is None:
+                        continue
+                    read_fd, write_fd = os.pipe()
+                    fds.append(read_fd)
+                    # A password easily fits into the pipe buffer.
+                    with open(write_fd, "w") as f:
+                        f.write(value.value + "\n")
+                    value = "fd:%d" % read_fd
+                resolved[opt] = value
+            yield resolved, fds
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def pipe(self, *commands):
+        """Run commands with the output of each one piped into the next.
+
+        Every command is a (pos_args, opts, opts_with_values) tuple.
+        """
+        processes = []
+        stdin = None
+        start = time.perf_counter()
+        for index, (pos_args, opts, opts_with_values) in enumerate(commands):
+            with self.secrets(opts_with_values) as (opts_with_values, fds):
+                args = self.build_openssl_commandline(pos_args, *opts,
+                                                      **opts_with_values)
+                last = index == len(commands) - 1
+                process = subprocess.Popen(
+                    args, stdin=stdin, pass_fds=fds,
+                    env=self.environment(opts_with_values),
+                    stdout=None if last else subprocess.PIPE)
+            if stdin is not None:
+                stdin.close()
+            stdin = process.stdout
+            processes.append((process, args))
+        for process, args in processes:
+            self._wait(process, args, start)
+
+    @staticmethod
+    def _wait(process, args, start):
+        recorder = get_recorder()
+        if recorder is None:
+            process.wait()
+        else:
+            # wait4 reports the resources used by this child alone.
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            recorder.command(args, time.perf_counter() - start,
+                             usage.ru_utime + usage.ru_stime)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, args)
+
+    def build_openssl_commandline(self, pos_args, *opts, **opts_with_values):
+        args = [self.openssl]
+        if len(pos_args):
+            args.append(pos_args[0])
+            pos_args = pos_args[1:]
+
+        args.extend("-%s" % opt for opt in opts)
+        args.extend(itertools.chain.from_iterable(
+            ("-%s" % opt, value)
+            for opt, value
+            in opts_with_values.items()))
+        args.extend(pos_args)
+
+        return list(map(str, args))
+
+
+class Backend:
+    """Performs the individual stages of issuing a certificate.
+
+    Every stage receives the CertificateBuilder whose certificate is being
+    built; the builder knows the certificate description, the output paths
+    and the key password.
+    """
+    name = None
+
+    def issue(self, builder):
+        """Create the key and certificate once the config file exists."""
+        builder.generate_private_key()
+        if builder.cert_info.ca is None:
+            builder.generate_self_signed_certificate()
+        else:
+            builder.generate_certificate_request()
+            builder.generate_ca_signed_certificate()
+
+    def generate_private_key(self, builder):
+        raise NotImplementedError
+
+    def import_private_key(self, builder, path):
+        """Move the unencrypted key at path to the builder's key file."""
+        raise NotImplementedError
+
+    def private_key_algorithm(self, builder, path):
+        """Return the algorithm of the key at path in the form of
+        CertificateInfo.key_algorithm, or None if it can't be read with
+        the builder's key password.
+        """
+        raise NotImplementedError
+
+    def generate_certificate_request(self, builder):
+        raise NotImplementedError
+
+    def generate_self_signed_certificate(self, builder):
+        raise NotImplementedError
+
+    def generate_ca_signed_certificate(self, builder):
+        raise NotImplementedError
+
+    def sign_batch(self, builders):
+        """Sign the requests of builders that share a CA.
+
+        Returns a dict that maps the builders that failed to their error.
+        """
+        errors = {}
+        for builder in builders:
+            try:
+                builder.generate_ca_signed_certificate()
+            except Exception as exc:
+                errors[builder] = exc
+        return errors
+
+    def forget(self, builder):
+        """Drop anything kept in memory for the builder's certificate."""
+
+
+class OpenSSLBackend(Backend):
+    """Backend that runs the openssl command line tool for every stage."""
+    name = "openssl"
+
+    BATCH_CA_CONFIG = textwrap.dedent("""\
+        [ca]
+        default_ca=batch_ca
+
+        [batch_ca]
+        database={tmp_dir}/index.txt
+        serial={tmp_dir}/serial
+        new_certs_dir={tmp_dir}
+        certificate={ca_certificate}
+        private_key={ca_private_key}
+        default_md={digest}
+        policy=policy_any
+        copy_extensions=copyall
+        unique_subject=no
+        email_in_dn=no
+        preserve=yes
+
+        [policy_any]
+        countryName=optional
+        stateOrProvinceName=optional
+        localityName=optional
+        organizationName=optional
+        organizationalUnitName=optional
+        commonName=optional
+        """)
+
+    def __init__(self, openssl=OpenSSL()):
+        self.openssl = openssl
+        self._ca_digests = {}
+
+    def generate_private_key(self, builder):
+        self._run(self.private_key_command(builder))
+
+    def import_private_key(self, builder, path):
+        if not builder.cert_info.use_password:
+            shutil.move(path, builder.private_key_path)
+            return
+        self.openssl(
+            ["pkey"], "aes256",
+            out=builder.private_key_path,
+            passout=Secret(builder.key_password),
+            **{"in": path})
+        os.remove(path)
+
+    def private_key_algorithm(self, builder, path):
+        try:
+            text = self.openssl.output(
+                ["pkey"], "noout", "text",
+                passin=Secret(builder.key_password),
+                **{"in": path})
+        except subprocess.CalledProcessError:
+            return None
+        if text.startswith("ED25519"):
+            return "ed25519"
+        curve = re.search(r"^ASN1 OID: (\S+)", text, re.M)
+        if curve is not None:
+            return "ec-%s" % curve.group(1)
+        bits = re.search(r"^(?:RSA )?Private-Key: \((\d+) bit", text)
+        if bits is not None and "modulus:" in text:
+            return "rsa-%s" % bits.group(1)
+        return None
+
+    def generate_certificate_request(self, builder):
+        self._run(self.certificate_request_command(builder))
+
+    def generate_self_signed_certificate(self, builder):
+        self._run(self.self_signed_certificate_command(builder))
+
+    def generate_ca_signed_certificate(self, builder):
+        self._run(self.ca_signed_certificate_command(builder))
+
+    # The *_command methods return the openssl invocation of a stage as
+    # (pos_args, opts, opts_with_values), the form OpenSSL.pipe takes.
+
+    def private_key_command(self, builder):
+        cert_info = builder.cert_info
+        if cert_info.key_type == cert_info.RSA:
+            pos_args = ["genrsa", cert_info.key_size]
+            password_opt = "passout"
+        elif cert_info.key_type == cert_info.EC:
+            pos_args = ["genpkey",
+                        "-pkeyopt", "ec_paramgen_curve:%s" % cert_info.curve,
+                        "-pkeyopt", "ec_param_enc:named_curve"]
+            password_opt = "pass"
+        else:
+            pos_args = ["genpkey"]
+            password_opt = "pass"
+        opts = ["aes256"] if cert_info.use_password else []
+        opts_with_values = {
+            "out": builder.private_key_path,
+            password_opt: Secret(builder.key_password),
+        }
+        if cert_info.key_type != cert_info.RSA:
+            opts_with_values["algorithm"] = cert_info.key_type.upper()
+        return pos_args, opts, opts_with_values
+
+    def certificate_request_command(self, builder):
+        return (["req"], ["new"] + self._digest(builder.cert_info),
+                dict(out=builder.certificate_request_path,
+                     key=builder.private_key_path,
+                     config=builder.config_file_option(),
+                     passin=Secret(builder.key_password)))
+
+    def self_signed_certificate_command(self, builder):
+        return (["req"],
+                ["x509", "new"] + self._digest(builder.cert_info) + ["nodes"],
+                dict(key=builder.private_key_path,
+                     out=builder.certificate_path,
+                     days=builder.cert_info.expiration_days,
+                     config=builder.config_file_option(),
+                     passin=Secret(builder.key_password)))
+
+    def ca_signed_certificate_command(self, builder):
+        return (["x509"], ["req"] + self._ca_digest(builder),
+                dict(set_serial="0x%X" % builder.allocate_serials(),
+                     CA=builder.ca_certificate_path,
+                     CAkey=builder.ca_private_key_path,
+                     passin=Secret(builder.ca_key_password()),
+                     out=builder.certificate_path,
+                     extfile=builder.config_file_option(),
+                     days=builder.cert_info.expiration_days,
+                     **{"in": builder.certificate_request_path}))
+
+    def _run(self, command):
+        pos_args, opts, opts_with_values = command
+        self.openssl(pos_args, *opts, **opts_with_values)
+
+    def sign_batch(self, builders):
+        """Sign all requests with a single 'openssl ca' run per validity.
+
+        The requests carry the same extensions as the config files, and
+        'openssl ca' copies them into the certificates.  If a batch fails,
+        its requests are signed one by one so that only the bad ones fail;
+        any other error fails the whole batch.
+        """
+        by_days = {}
+        for builder in builders:
+            by_days.setdefault(builder.cert_info.expiration_days,
+                               []).append(builder)
+        errors = {}
+        for days, group in by_days.items():
+            try:
+                self._sign_with_ca(group, days)
+            except subprocess.CalledProcessError:
+                errors.update(super().sign_batch(group))
+            except Exception as exc:
+                errors.update(dict.fromkeys(group, exc))
+        return errors
+
+    def _sign_with_ca(self, builders, days):
+        first_serial = builders[0].allocate_serials(len(builders))
+        start = time.perf_counter()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_path = os.path.join(tmp_dir, "ca.cnf")
+            with open(config_path, "w") as f:
+                f.write(self.BATCH_CA_CONFIG.format(
+                    tmp_dir=tmp_dir,
+                    digest="".join(self._ca_digest(builders[0]))
+                    or "default",
+                    ca_certificate=builders[0].ca_certificate_path,
+                    ca_private_key=builders[0].ca_private_key_path))
+            open(os.path.join(tmp_dir, "index.txt"), "w").close()
+            with open(os.path.join(tmp_dir, "serial"), "w") as f:
+                f.write(hex_serial(first_serial))
+            self.openssl(
+                ["ca", "-infiles"] + [builder.certificate_request_path
+                                      for builder in builders],
+                "batch", "notext",
+                config=config_path,
+                passin=Secret(builders[0].ca_key_password()),
+                days=days,
+                out=os.path.join(tmp_dir, "out.pem"))
+            for serial, builder in enumerate(builders, first_serial):
+                shutil.move(
+                    os.path.join(tmp_dir, hex_serial(serial) + ".pem"),
+                    builder.certificate_path)
+        elapsed = time.perf_counter() - start
+        for builder in builders:
+            builder.timings["ca_signed"] = elapsed / len(builders)
+
+    @staticmethod
+    def _digest(cert_info):
+        return [cert_info.digest] if cert_info.digest else []
+
+    def _ca_digest(self, builder):
+        """The digest option for signing with the issuing CA's key.
+
+        The key's algorithm is read from the CA certificate, which needs no
+        password, once per CA for as long as the file doesn't change.
+        """
+        path = builder.ca_certificate_path
+        stamp = file_stamp(path)
+        cached = self._ca_digests.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        text = self.openssl.output(["x509"], "noout", "text",
+                                   **{"in": path})
+        digest = signing_digest(self._public_key_algorithm(text))
+        options = [digest] if digest else []
+        self._ca_digests[path] = (stamp, options)
+        return options
+
+    @staticmethod
+    def _public_key_algorithm(text):
+        """The key algorithm of a certificate in `openssl x509 -text`."""
+        algorithm = re.search(r"Public Key Algorithm: (\S+)", text)
+        if algorithm is None:
+            return None
+        if algorithm.group(1) == "ED25519":
+            return "ed25519"
+        curve = re.search(r"^\s*ASN1 OID: (\S+)", text, re.M)
+        if curve is not None:
+            return "ec-%s" % curve.group(1)
+        bits = re.search(r"Public-Key: \((\d+) bit", text)
+        if algorithm.group(1) == "rsaEncryption" and bits is not None:
+            return "rsa-%s" % bits.group(1)
+        return None
+
+
+class OpenSSLPipelineBackend(OpenSSLBackend):
+    """Backend that issues a certificate with as few openssl runs as possible.
+
+    The key is generated by the same req command that creates the request
+    or the self-signed certificate.  A request is piped straight into the
+    x509 command that signs it instead of going through a .csr file.
+    """
+    name = "openssl-pipe"
+
+    def issue(self, builder):
+        cert_info = builder.cert_info
+        key_args = []
+        if builder.reuse_existing_key() or builder.take_pooled_key():
+            key_opts = []
+            key_opts_with_values = {
+                "key": builder.private_key_path,
+                "passin": Secret(builder.key_password),
+            }
+        else:
+            key_opts = [] if cert_info.use_password else ["nodes"]
+            key_opts_with_values = {
+                "newkey": self._new_key(cert_info),
+                "keyout": builder.private_key_path,
+                "passout": Secret(builder.key_password),
+            }
+            if cert_info.key_type == cert_info.EC:
+                key_args = ["-pkeyopt",
+                            "ec_paramgen_curve:%s" % cert_info.curve]
+        digest = self._digest(cert_info)
+
+        if cert_info.ca is None:
+            with builder.timed("key_and_self_signed"):
+                self.openssl(
+                    ["req"] + key_args, "x509", "new", *digest + key_opts,
+                    out=builder.certificate_path,
+                    days=cert_info.expiration_days,
+                    config=builder.config_file_option(),
+                    **key_opts_with_values)
+            return
+
+        with builder.timed("key_request_and_ca_signed"):
+            self.openssl.pipe(
+                (["req"] + key_args, ["new"] + digest + key_opts,
+                 dict(config=builder.config_file_option(),
+                      **key_opts_with_values)),
+                (["x509"], ["req"] + self._ca_digest(builder),
+                 dict(set_serial="0x%X" % builder.allocate_serials(),
+                      CA=builder.ca_certificate_path,
+                      CAkey=builder.ca_private_key_path,
+                      passin=Secret(builder.ca_key_password()),
+                      out=builder.certificate_path,
+                      extfile=builder.config_file_option(),
+                      days=cert_info.expiration_days)))
+
+    @staticmethod
+    def _new_key(cert_info):
+        if cert_info.key_type == cert_info.RSA:
+            return "rsa:%d" % int(cert_info.key_size)
+        return cert_info.key_type
+
+
+class CryptographyBackend(Backend):
+    """Backend that builds keys and certificates in-process.
+
+    It uses the cryptography package and produces the same files as the
+    openssl backend.  Keys and requests generated for a builder are kept in
+    memory so later stages don't have to parse them again; loaded objects
+    are read again once their file changes.
+    """
+    name = "cryptography"
+
+    NAME_ATTRIBUTES = (
+        ("C", "COUNTRY_NAME"),
+        ("ST", "STATE_OR_PROVINCE_NAME"),
+        ("L", "LOCALITY_NAME"),
+        ("O", "ORGANIZATION_NAME"),
+        ("OU", "ORGANIZATIONAL_UNIT_NAME"),
+        ("CN", "COMMON_NAME"),
+    )
+
+    # Our curve names and the names of their classes and curves in
+    # cryptography.
+    CURVES = {
+        "prime256v1": "SECP256R1",
+        "secp384r1": "SECP384R1",
+        "secp521r1": "SECP521R1",
+    }
+    CURVE_NAMES = {curve.lower(): name for name, curve in CURVES.items()}
+
+    def __init__(self):
+        if x509 is None:
+            raise RuntimeError(
+                "the cryptography backend requires the cryptography package")
+        self._objects = {}
+
+    def generate_private_key(self, builder):
+        cert_info = builder.cert_info
+        if cert_info.key_type == cert_info.RSA:
+            key = rsa.generate_private_key(
+                public_exponent=65537, key_size=int(cert_info.key_size))
+        elif cert_info.key_type == cert_info.EC:
+            key = ec.generate_private_key(
+                getattr(ec, self.CURVES[cert_info.curve])())
+        else:
+            key = ed25519.Ed25519PrivateKey.generate()
+        self._store_private_key(builder, key)
+
+    def import_private_key(self, builder, path):
+        if not builder.cert_info.use_password:
+            shutil.move(path, builder.private_key_path)
+            return
+        key = self._load_private_key(path)
+        self._objects.pop(path, None)
+        self._store_private_key(builder, key)
+        os.remove(path)
+
+    def private_key_algorithm(self, builder, path):
+        try:
+            key = self._load_private_key(path, builder.key_password)
+        except (TypeError, ValueError):
+            return None
+        return self._key_algorithm(key)
+
+    def _key_algorithm(self, key):
+        if isinstance(key, rsa.RSAPrivateKey):
+            return "rsa-%d" % key.key_size
+        if isinstance(key, ec.EllipticCurvePrivateKey):
+            return "ec-%s" % self.CURVE_NAMES.get(key.curve.name,
+                                                  key.curve.name)
+        if isinstance(key, ed25519.Ed25519PrivateKey):
+            return "ed25519"
+        return None
+
+    def _store_private_key(self, builder, key):
+        if builder.cert_info.use_password:
+            encryption = serialization.BestAvailableEncryption(
+                builder.key_password.encode())
+        else:
+            encryption = serialization.NoEncryption()
+        if isinstance(key, ed25519.Ed25519PrivateKey):
+            # Ed25519 keys have no traditional format.
+            private_format = serialization.PrivateFormat.PKCS8
+        else:
+            private_format = serialization.PrivateFormat.TraditionalOpenSSL
+        write_private_file(builder.private_key_path, key.private_bytes(
+            serialization.Encoding.PEM, private_format, encryption))
+        self._remember(builder.private_key_path, key)
+
+    def generate_certificate_request(self, builder):
+        key = self._load_private_key(builder.private_key_path,
+                                     builder.key_password)
+        request_builder = x509.CertificateSigningRequestBuilder(
+            subject_name=self._name(builder.cert_info))
+        for extension, critical in self._extensions(builder.cert_info,
+                                                    key.public_key()):
+            request_builder = request_builder.add_extension(
+                extension, critical)
+        request = request_builder.sign(
+            key, self._hash(builder.cert_info.digest))
+        if builder.keep_intermediates:
+            self._write(builder.certificate_request_path,
+                        request.public_bytes(serialization.Encoding.PEM))
+        self._remember(builder.certificate_request_path, request)
+
+    def generate_self_signed_certificate(self, builder):
+        key = self._load_private_key(builder.private_key_path,
+                                     builder.key_password)
+        name = self._name(builder.cert_info)
+        certificate = self._sign(
+            builder.cert_info, x509.random_serial_number(), name,
+            key.public_key(), name, key, key.public_key(),
+            self._hash(builder.cert_info.digest))
+        self._store_certificate(builder, certificate)
+
+    def generate_ca_signed_certificate(self, builder):
+        request = self._cached(builder.certificate_request_path)
+        self._objects.pop(builder.certificate_request_path, None)
+        if request is None:
+            with open(builder.certificate_request_path, "rb") as f:
+                request = x509.load_pem_x509_csr(f.read())
+        if not request.is_signature_valid:
+            raise InvalidRequestError(
+                "the signature of the certificate request %s is invalid"
+                % builder.certificate_request_path)
+        ca_certificate = self._load_certificate(builder.ca_certificate_path)
+        ca_key = self._load_private_key(builder.ca_private_key_path,
+                                        prompt=builder.ca_key_password)
+        certificate = self._sign(
+            builder.cert_info, builder.allocate_serials(),
+            request.subject, request.public_key(),
+            ca_certificate.subject, ca_key, ca_key.public_key(),
+            self._signing_hash(ca_key))
+        self._store_certificate(builder, certificate)
+
+    def _store_certificate(self, builder, certificate):
+        self._write(builder.certificate_path,
+                    certificate.public_bytes(serialization.Encoding.PEM))
+        # CAs stay loaded for signing the certificates that follow them.
+        if builder.cert_info.is_ca:
+            self._remember(builder.certificate_path, certificate)
+        else:
+            self.forget(builder)
+
+    def forget(self, builder):
+        self._objects.pop(builder.private_key_path, None)
+        self._objects.pop(builder.certificate_request_path, None)
+
+    def _sign(self, cert_info, serial_number, subject, public_key, issuer,
+              signing_key, issuer_public_key, algorithm):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        certificate_builder = x509.CertificateBuilder(
+            subject_name=subject,
+            issuer_name=issuer,
+            public_key=public_key,
+            serial_number=serial_number,
+            not_valid_before=now,
+            not_valid_after=now + datetime.timedelta(
+                days=int(cert_info.expiration_days)))
+        for extension, critical in self._extensions(
+                cert_info, public_key, issuer_public_key):
+            certificate_builder = certificate_builder.add_extension(
+                extension, critical)
+        return certificate_builder.sign(signing_key, algorithm)
+
+    @staticmethod
+    def _hash(digest):
+        return getattr(hashes, digest.upper())() if digest else None
+
+    def _signing_hash(self, key):
+        return self._hash(signing_digest(self._key_algorithm(key)))
+
+    def _name(self, cert_info):
+        return x509.Name([
+            x509.NameAttribute(getattr(x509.NameOID, oid),
+                               str(getattr(cert_info, attr)))
+            for attr, oid in self.NAME_ATTRIBUTES
+            if getattr(cert_info, attr)])
+
+    def _extensions(self, cert_info, public_key, issuer_public_key=None):
+        if cert_info.is_ca:
+            yield x509.BasicConstraints(ca=True, path_length=None), False
+            yield x509.SubjectKeyIdentifier.from_public_key(public_key), False
+            if issuer_public_key is not None:
+                yield (x509.AuthorityKeyIdentifier.from_issuer_public_key(
+                    issuer_public_key), False)
+        else:
+            yield x509.BasicConstraints(ca=False, path_length=None), False
+            yield x509.KeyUsage(
+                digital_signature=True, content_commitment=True,
+                key_encipherment=cert_info.key_type == cert_info.RSA,
+                data_encipherment=False,
+                key_agreement=False, key_cert_sign=False, crl_sign=False,
+                encipher_only=False, decipher_only=False), False
+        if cert_info.subject_alt_names:
+            yield x509.SubjectAlternativeName([
+                x509.DNSName(str(alt_name))
+                for alt_name in cert_info.subject_alt_names]), False
+
+    def _load_private_key(self, path, password=None, prompt=None):
+        key = self._cached(path)
+        if key is not None:
+            return key
+        with open(path, "rb") as f:
+            data = f.read()
+        if password is None and prompt is not None and b"ENCRYPTED" in data:
+            password = prompt()
+        key = serialization.load_pem_private_key(
+            data, password.encode() if password is not None else None)
+        self._remember(path, key)
+        return key
+
+    def _load_certificate(self, path):
+        certificate = self._cached(path)
+        if certificate is None:
+            with open(path, "rb") as f:
+                certificate = x509.load_pem_x509_certificate(f.read())
+            self._remember(path, certificate)
+        return certificate
+
+    def _remember(self, path, obj):
+        self._objects[path] = (file_stamp(path), obj)
+
+    def _cached(self, path):
+        """The object remembered for path, unless the file changed since,
+        e.g. because a long-running service's CA was renewed on disk.
+        """
+        stamp, obj = self._objects.get(path, (None, None))
+        if obj is not None and stamp != file_stamp(path):
+            self._objects.pop(path, None)
+            return None
+        return obj
+
+    @staticmethod
+    def _write(path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+BACKENDS = {
+    OpenSSLBackend.name: OpenSSLBackend,
+    OpenSSLPipelineBackend.name: OpenSSLPipelineBackend,
+    CryptographyBackend.name: CryptographyBackend,
+}
+
+
+def get_backend(name="auto"):
+    if name == "auto":
+        name = CryptographyBackend.name if x509 else OpenSSLBackend.name
+    return BACKENDS[name]()
@@ -0,0 +1,55 @@
+import threading
+
+from .scheduler import Scheduler
+
+
+class SigningBatches:
+    """Certificate requests waiting to be signed, grouped by their CA.
+
+    Builders are added once their key and request exist.  sign() then signs
+    every group in one session with its CA, so the CA key and certificate
+    are only loaded once per CA instead of once per certificate.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.groups = {}
+
+    def add(self, builder, on_signed=None):
+        with self.lock:
+            self.groups.setdefault(builder.ca_certificate_path, []).append(
+                (builder, on_signed))
+
+    def sign(self, jobs=1):
+        """Sign all batches and return (builder, error) for the failed ones.
+
+        Errors never escape: whatever goes wrong with a group is reported
+        for each of its builders, like a failure of a single certificate.
+        """
+        scheduler = Scheduler(jobs)
+        results = []
+        for ca_path, entries in self.groups.items():
+            scheduler.submit(ca_path, self._sign_group(entries, results))
+        for task in scheduler.wait():
+            results.extend((builder, task.error)
+                           for builder, _ in self.groups[task.key])
+        return results
+
+    def _sign_group(self, entries, results):
+        def sign_group():
+            builders = [builder for builder, _ in entries]
+            try:
+                errors = self.backend.sign_batch(builders)
+            except Exception as exc:
+                errors = dict.fromkeys(builders, exc)
+            for builder, on_signed in entries:
+                error = errors.get(builder)
+                if error is None and on_signed is not None:
+                    try:
+                        on_signed(builder)
+                    except Exception as exc:
+                        error = exc
+                if error is not None:
+                    results.append((builder, error))
+        return sign_group
@@ -0,0 +1,446 @@
+import contextlib
+import functools
+import os
+import sys
+import time
+
+from .backends import CURVE_DIGESTS, ConfigFile, OpenSSL, OpenSSLBackend
+from .instrumentation import get_recorder
+from .passwords import PromptPassword
+from .serials import SerialAllocator
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class CertificateInfo:
+    """The description of one certificate.
+
+    Inventories can have millions of entries, so instances have no
+    __dict__, strings that repeat across entries (subject fields other
+    than the CN, CA names, key types and curves) are interned and the
+    subject alternative names are kept in a tuple.
+    """
+    FIELDS = ("basename", "C", "ST", "L", "O", "OU", "CN",
+              "subject_alt_names", "is_ca", "ca", "key_size",
+              "expiration_days", "use_password", "key_type", "curve",
+              "reuse_key")
+    __slots__ = FIELDS
+
+    DEFAULT_KEY_SIZE = 2048
+    DEFAULT_EXPIRATION_DAYS = 10000
+
+    RSA = "rsa"
+    EC = "ec"
+    ED25519 = "ed25519"
+    KEY_TYPES = (RSA, EC, ED25519)
+    DEFAULT_KEY_TYPE = RSA
+    DEFAULT_CURVE = "prime256v1"
+
+    # Named curves and the digest that matches their strength.
+    CURVE_DIGESTS = CURVE_DIGESTS
+    CURVE_ALIASES = {
+        "P-256": "prime256v1",
+        "secp256r1": "prime256v1",
+        "P-384": "secp384r1",
+        "P-521": "secp521r1",
+    }
+    RSA_DIGEST = "sha512"
+
+    CERTIFICATE_EXT = "cert"
+    PRIVATE_KEY_EXT = "key"
+    CERT_REQUEST_EXT = "csr"
+    CONFIG_EXT = "cnf"
+
+    SUBJECT_FIELDS = ("C", "ST", "L", "O", "OU", "CN")
+    ENVIRONMENT_PREFIX = "GEN_SSL_"
+
+    def __init__(self, basename,
+                 C="", ST="", L="", O="", OU="", CN="",
+                 subject_alt_names=None, is_ca=False,
+                 ca=None,
+                 key_size=DEFAULT_KEY_SIZE,
+                 expiration_days=DEFAULT_EXPIRATION_DAYS,
+                 use_password=False,
+                 key_type=DEFAULT_KEY_TYPE,
+                 curve=DEFAULT_CURVE,
+                 reuse_key=False):
+        self.basename = basename
+
+        self.C = _intern(C)
+        self.ST = _intern(ST)
+        self.L = _intern(L)
+        self.O = _intern(O)
+        self.OU = _intern(OU)
+        self.CN = CN
+
+        self.subject_alt_names = (tuple(subject_alt_names)
+                                  if subject_alt_names is not None else None)
+        self.is_ca = is_ca
+        self.ca = _intern(ca)
+        self.key_size = key_size
+        self.expiration_days = expiration_days
+        self.use_password = use_password
+
+        if key_type not in self.KEY_TYPES:
+            raise ValueError("unknown key type %r, expected one of %s"
+                             % (key_type, ", ".join(self.KEY_TYPES)))
+        curve = self.CURVE_ALIASES.get(curve, curve)
+        if key_type == self.EC and curve not in self.CURVE_DIGESTS:
+            raise ValueError("unsupported curve %r, expected one of %s"
+                             % (curve, ", ".join(self.CURVE_DIGESTS)))
+        self.key_type = _intern(key_type)
+        self.curve = _intern(curve)
+        self.reuse_key = reuse_key
+
+    @property
+    def key_algorithm(self):
+        if self.key_type == self.RSA:
+            return "%s-%d" % (self.key_type, int(self.key_size))
+        elif self.key_type == self.EC:
+            return "%s-%s" % (self.key_type, self.curve)
+        else:
+            return self.key_type
+
+    @property
+    def digest(self):
+        if self.key_type == self.RSA:
+            return self.RSA_DIGEST
+        elif self.key_type == self.EC:
+            return self.CURVE_DIGESTS[self.curve]
+        else:
+            # Ed25519 signatures have no separate digest.
+            return None
+
+    @property
+    def key_usage(self):
+        if self.key_type == self.RSA:
+            return "digitalSignature, nonRepudiation, keyEncipherment"
+        else:
+            return "digitalSignature, nonRepudiation"
+
+    def get_config_file(self):
+        """Render the OpenSSL config file for this certificate.
+
+        Subject fields and the digest are only written if they are set.
+        """
+        return render_config(
+            self.digest, self._subject(), self.is_ca, self.key_usage,
+            alt_names=tuple(map(str, self.subject_alt_names or ())))
+
+    def get_shared_config_file(self):
+        """Render a config file that reads the subject and the subject
+        alternative names from the environment given by config_environment.
+
+        Certificates that only differ in those values get the same file.
+        """
+        subject = tuple(
+            (field, "${ENV::%s%s}" % (self.ENVIRONMENT_PREFIX, field)
+             if value else "")
+            for field, value in self._subject())
+        return render_config(
+            self.digest, subject, self.is_ca, self.key_usage,
+            alt_names_variable="%sSAN" % self.ENVIRONMENT_PREFIX
+            if self.subject_alt_names else None)
+
+    def config_environment(self):
+        """The environment variables get_shared_config_file refers to."""
+        environment = {self.ENVIRONMENT_PREFIX + field: value
+                       for field, value in self._subject() if value}
+        if self.subject_alt_names:
+            environment[self.ENVIRONMENT_PREFIX + "SAN"] = ",".join(
+                "DNS:%s" % alt_name for alt_name in self.subject_alt_names)
+        return environment
+
+    def _subject(self):
+        return tuple((field, str(getattr(self, field) or ""))
+                     for field in self.SUBJECT_FIELDS)
+
+    @property
+    def certificate_name(self):
+        return self._filename(self.CERTIFICATE_EXT)
+
+    @property
+    def private_key_name(self):
+        return self._filename(self.PRIVATE_KEY_EXT)
+
+    @property
+    def certificate_request_name(self):
+        return self._filename(self.CERT_REQUEST_EXT)
+
+    @property
+    def config_file_name(self):
+        return self._filename(self.CONFIG_EXT)
+
+    def _filename(self, ext):
+        return "%s.%s" % (self.basename, ext)
+
+    def to_dict(self):
+        """The fields of this description as CertificateInfo() takes them.
+        """
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, dict):
+        kwargs = {'is_ca': False}
+        for key, value in dict.items():
+            if key == 'type':
+                kwargs['is_ca'] = value == 'ca'
+            else:
+                kwargs[key.replace('-', '_')] = value
+        return cls(**kwargs)
+
+
+@functools.lru_cache(maxsize=4096)
+def render_config(digest, subject, is_ca, key_usage, alt_names=(),
+                  alt_names_variable=None):
+    """Render an OpenSSL config file.
+
+    subject holds (field, value) pairs; fields without a value are left
+    out.  The subject alternative names are either listed in alt_names or
+    read from the environment variable alt_names_variable.  Renders are
+    cached by these arguments, which is everything that goes into them.
+    """
+    lines = [
+        "extensions=v3_extensions",
+        "",
+        "[req]",
+        "req_extensions=v3_extensions",
+        "x509_extensions=v3_extensions",
+        "distinguished_name=req_distinguished_name",
+        "prompt=no",
+        "default_md=%s" % digest if digest else "",
+        "",
+        "[req_distinguished_name]",
+    ]
+    lines += ["%s=%s" % (field, value) if value else ""
+              for field, value in subject]
+    lines += ["", "[v3_extensions]"]
+    if is_ca:
+        lines += [
+            "basicConstraints=CA:true",
+            "subjectKeyIdentifier=hash",
+            "authorityKeyIdentifier=keyid:always, issuer",
+        ]
+    else:
+        lines += [
+            "basicConstraints=CA:false",
+            "keyUsage=%s" % key_usage,
+        ]
+    if alt_names_variable:
+        lines.append("subjectAltName=${ENV::%s}" % alt_names_variable)
+    elif alt_names:
+        lines += ["subjectAltName=@alt_names", "", "[alt_names]"]
+        lines += ["DNS.%d=%s" % (index, alt_name)
+                  for index, alt_name in enumerate(alt_names, 1)]
+    return "\n".join(lines) + "\n"
+
+
+def certificate_key(basedir, basename):
+    return os.path.normpath(os.path.join(basedir, basename))
+
+
+class CertificateBuilder:
+    def __init__(self, cert_info, base_dir=None, openssl=OpenSSL(),
+                 backend=None, key_pool=None, ca_dir=None, reuse_key=False,
+                 serial_dir=None, password_source=None, config_store=None,
+                 keep_intermediates=True):
+        self.cert_info = cert_info
+        self.base_dir = base_dir if base_dir else os.curdir
+        # The directory of a description given by a bare file name is "".
+        self.ca_dir = ((ca_dir or os.curdir) if ca_dir is not None
+                       else self.base_dir)
+        self.serial_dir = serial_dir if serial_dir else self.ca_dir
+        self.openssl = openssl
+        self.backend = backend if backend else OpenSSLBackend(openssl)
+        self.key_pool = key_pool
+        self.reuse_key = reuse_key or cert_info.reuse_key
+        self.key_reused = False
+        self.password_source = (password_source if password_source
+                                else PromptPassword())
+        self.config_store = config_store
+        self.keep_intermediates = keep_intermediates
+        self.key_password = None
+        self.timings = {}
+
+    @property
+    def certificate_path(self):
+        return self._path(self.cert_info.certificate_name)
+
+    @property
+    def private_key_path(self):
+        return self._path(self.cert_info.private_key_name)
+
+    @property
+    def certificate_request_path(self):
+        return self._path(self.cert_info.certificate_request_name)
+
+    @property
+    def config_file_path(self):
+        if self.config_store is not None:
+            return self.config_store.path(self.cert_info)
+        return self._path(self.cert_info.config_file_name)
+
+    def config_file_option(self):
+        """The config file as the value of a config or extfile option."""
+        if self.config_store is not None:
+            return ConfigFile(self.config_file_path,
+                              self.cert_info.config_environment())
+        return self.config_file_path
+
+    @property
+    def ca_certificate_path(self):
+        return os.path.join(self.ca_dir, "%s.%s" % (
+            self.cert_info.ca, CertificateInfo.CERTIFICATE_EXT))
+
+    @property
+    def ca_private_key_path(self):
+        return os.path.join(self.ca_dir, "%s.%s" % (
+            self.cert_info.ca, CertificateInfo.PRIVATE_KEY_EXT))
+
+    @property
+    def ca_serial_path(self):
+        return os.path.join(self.serial_dir, "%s.srl" % self.cert_info.ca)
+
+    @property
+    def password_group(self):
+        """The group of the key in the sense of PasswordSource.get()."""
+        if self.cert_info.is_ca or self.cert_info.ca is None:
+            return self.cert_info.basename
+        return self.cert_info.ca
+
+    def read_key_password(self):
+        if self.cert_info.use_password:
+            self.key_password = self.password_source.get(self.password_group)
+
+    def ca_key_password(self):
+        """The password of the issuing CA's key, None if it isn't encrypted.
+        """
+        try:
+            with open(self.ca_private_key_path, "rb") as f:
+                if b"ENCRYPTED" not in f.read():
+                    return None
+        except FileNotFoundError:
+            return None
+        return self.password_source.get(
+            self.cert_info.ca,
+            "Enter pass phrase for %s:" % self.ca_private_key_path)
+
+    def allocate_serials(self, count=1):
+        """Reserve count consecutive serial numbers of the issuing CA."""
+        return SerialAllocator.for_path(self.ca_serial_path).allocate(count)
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        recorder = get_recorder()
+        start = time.perf_counter()
+        try:
+            if recorder is None:
+                yield
+            else:
+                with recorder.stage(self.cert_info.basename, stage,
+                                    self.output_paths):
+                    yield
+        finally:
+            self.timings[stage] = (self.timings.get(stage, 0.0)
+                                   + time.perf_counter() - start)
+
+    @property
+    def output_paths(self):
+        """The files the builder writes; shared config files aren't its own.
+        """
+        paths = (self.private_key_path, self.certificate_request_path,
+                 self.certificate_path)
+        if self.config_store is None:
+            paths = (self.config_file_path,) + paths
+        return paths
+
+    def generate_config_file(self):
+        with self.timed("config"):
+            if self.config_store is not None:
+                self.config_store.write(self.cert_info)
+                return
+            with open(self.config_file_path, "w") as f:
+                f.write(self.cert_info.get_config_file())
+
+    def remove_intermediate_files(self):
+        """Delete the config file and request unless they are to be kept.
+        """
+        if self.keep_intermediates:
+            return
+        paths = [self.certificate_request_path]
+        if self.config_store is None:
+            paths.append(self.config_file_path)
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def take_pooled_key(self):
+        if self.key_pool is None:
+            return False
+        with self.timed("pooled_key"):
+            pooled_key = self.key_pool.take(self.cert_info)
+            if pooled_key is None:
+                return False
+            self.backend.import_private_key(self, pooled_key)
+            return True
+
+    def reuse_existing_key(self):
+        """Keep the existing key if reusing keys was asked for and it fits.
+
+        The key fits if it can be read, is encrypted exactly when the
+        description asks for a password and has the requested algorithm
+        and size.
+        """
+        if not self.reuse_key:
+            return False
+        with self.timed("reused_key"):
+            try:
+                with open(self.private_key_path, "rb") as f:
+                    encrypted = b"ENCRYPTED" in f.read()
+            except FileNotFoundError:
+                return False
+            if encrypted != bool(self.cert_info.use_password):
+                return False
+            self.key_reused = (
+                self.backend.private_key_algorithm(
+                    self, self.private_key_path)
+                == self.cert_info.key_algorithm)
+            return self.key_reused
+
+    def generate_private_key(self):
+        if self.reuse_existing_key():
+            return
+        if not self.take_pooled_key():
+            with self.timed("private_key"):
+                self.backend.generate_private_key(self)
+
+    def generate_certificate_request(self):
+        with self.timed("request"):
+            self.backend.generate_certificate_request(self)
+
+    def generate_self_signed_certificate(self):
+        with self.timed("self_signed"):
+            self.backend.generate_self_signed_certificate(self)
+
+    def generate_ca_signed_certificate(self):
+        with self.timed("ca_signed"):
+            self.backend.generate_ca_signed_certificate(self)
+
+    def generate_full_certificate(self):
+        self.read_key_password()
+        self.generate_config_file()
+        self.backend.issue(self)
+
+    def generate_batch_request(self):
+        """Create the key and request to be signed by Backend.sign_batch."""
+        self.read_key_password()
+        self.generate_config_file()
+        self.generate_private_key()
+        self.generate_certificate_request()
+
+    def _path(self, filename):
+        return os.path.join(self.base_dir, filename)
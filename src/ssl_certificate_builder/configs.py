@@ -0,0 +1,72 @@
+import hashlib
+import os
+import threading
+
+
+class ConfigStore:
+    """Content-addressed OpenSSL config files shared between certificates.
+
+    Certificates use CertificateInfo.get_shared_config_file, so all those
+    that only differ in their subject and subject alternative names share a
+    file, which is written once and named after the hash of its content.
+    """
+    DIRNAME = ".gen-ssl-configs"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.paths = {}
+        self.written = set()
+
+    def path(self, cert_info):
+        """The path of the shared config file of cert_info."""
+        return self._entry(cert_info)[0]
+
+    def write(self, cert_info):
+        """Make sure the shared config file of cert_info exists."""
+        path, content = self._entry(cert_info)
+        with self.lock:
+            if path not in self.written:
+                os.makedirs(self.directory, exist_ok=True)
+                if not os.path.exists(path):
+                    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+                    with open(tmp_path, "w") as f:
+                        f.write(content)
+                    os.replace(tmp_path, path)
+                self.written.add(path)
+        return path
+
+    def _entry(self, cert_info):
+        content = cert_info.get_shared_config_file()
+        path = self.paths.get(content)
+        if path is None:
+            digest = hashlib.sha256(content.encode()).hexdigest()
+            path = os.path.join(self.directory, digest[:32] + ".cnf")
+            with self.lock:
+                self.paths[content] = path
+        return path, content
+
+
+class ConfigStores:
+    """The config stores of all output directories of a run.
+
+    Every output directory keeps its store in a subdirectory, unless a
+    directory for all stores is given.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.stores = {}
+
+    def __getitem__(self, base_dir):
+        if self.directory is not None:
+            directory = self.directory
+        else:
+            directory = os.path.join(os.path.normpath(base_dir or os.curdir),
+                                     ConfigStore.DIRNAME)
+        with self.lock:
+            store = self.stores.get(directory)
+            if store is None:
+                store = self.stores[directory] = ConfigStore(directory)
+            return store
@@ -0,0 +1,188 @@
+import contextlib
+import json
+import math
+import os
+import re
+import threading
+import time
+
+
+_recorder = None
+_context = threading.local()
+
+PASSWORD_RE = re.compile(r"^pass:.*")
+
+
+def get_recorder():
+    return _recorder
+
+
+def set_recorder(recorder):
+    global _recorder
+    _recorder = recorder
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def aggregate(values):
+    values = sorted(values)
+    return dict(count=len(values), total=sum(values),
+                p50=percentile(values, 0.5), p95=percentile(values, 0.95),
+                max=values[-1] if values else None)
+
+
+class Recorder:
+    """Collects timings of builder stages and openssl runs.
+
+    Stages record their wall time, the CPU time of the thread running them,
+    the CPU time of the openssl processes they ran and how many bytes they
+    wrote to the certificate's output files.  Every openssl run is recorded
+    with its command line, with passwords masked.
+    """
+    REPORT_FIELDS = ("kind", "name", "count", "total", "p50", "p95", "max",
+                     "cpu", "child_cpu", "bytes_written")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = []
+        self.commands = []
+
+    @contextlib.contextmanager
+    def stage(self, entry, stage, paths=()):
+        stamps = [self._stamp(path) for path in paths]
+        record = dict(entry=entry, stage=stage, child_cpu=0.0)
+        outer = getattr(_context, "stage", None)
+        _context.stage = record
+        start = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            record["wall"] = time.perf_counter() - start
+            record["cpu"] = time.thread_time() - start_cpu
+            # Files the stage wrote count with their whole size, also if
+            # they replaced a file of the same size.
+            record["bytes_written"] = sum(
+                after[1] for after, before in zip(map(self._stamp, paths),
+                                                  stamps)
+                if after is not None and after != before)
+            _context.stage = outer
+            with self.lock:
+                self.stages.append(record)
+
+    def command(self, args, wall, child_cpu):
+        stage = getattr(_context, "stage", None)
+        if stage is not None:
+            stage["child_cpu"] += child_cpu
+        with self.lock:
+            self.commands.append(dict(
+                entry=stage["entry"] if stage else None,
+                stage=stage["stage"] if stage else None,
+                command=[PASSWORD_RE.sub("pass:***", arg) for arg in args],
+                wall=wall, child_cpu=child_cpu))
+
+    def iterate(self, iterable, stage, entry_name):
+        """Yield from iterable, recording the time each item takes."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            start_cpu = time.thread_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            with self.lock:
+                self.stages.append(dict(
+                    entry=entry_name(item), stage=stage,
+                    wall=time.perf_counter() - start,
+                    cpu=time.thread_time() - start_cpu,
+                    child_cpu=0.0, bytes_written=0))
+            yield item
+
+    def summary(self):
+        rows = []
+        for kind, records, key in (
+                ("stage", self.stages, lambda record: record["stage"]),
+                ("command", self.commands,
+                 lambda record: " ".join(record["command"][1:2]))):
+            groups = {}
+            for record in records:
+                groups.setdefault(key(record), []).append(record)
+            for name, group in sorted(groups.items()):
+                row = dict(kind=kind, name=name)
+                row.update(aggregate([record["wall"] for record in group]))
+                row["cpu"] = sum(record.get("cpu", 0.0) for record in group)
+                row["child_cpu"] = sum(record["child_cpu"]
+                                       for record in group)
+                row["bytes_written"] = sum(record.get("bytes_written", 0)
+                                           for record in group)
+                rows.append(row)
+        return rows
+
+    def write_report(self, path):
+        if path.endswith(".csv"):
+            import csv
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, self.REPORT_FIELDS)
+                writer.writeheader()
+                writer.writerows(self.summary())
+        else:
+            with open(path, "w") as f:
+                json.dump(dict(summary=self.summary(), stages=self.stages,
+                               commands=self.commands), f, indent=1)
+
+    @staticmethod
+    def _stamp(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class Profiler:
+    """Profiles function calls on any thread and merges the results.
+
+    Only one call is profiled at a time since Python profilers can't run on
+    several threads at once everywhere, so a profiled run is serialised.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = None
+
+    def run(self, func, *args, **kwargs):
+        import cProfile
+        import pstats
+        with self.lock:
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(func, *args, **kwargs)
+            finally:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+
+    def wrap(self, func):
+        def profiled(*args, **kwargs):
+            return self.run(func, *args, **kwargs)
+        return profiled
+
+    def iterate(self, iterable):
+        iterator = iter(iterable)
+        while True:
+            try:
+                item = self.run(next, iterator)
+            except StopIteration:
+                return
+            yield item
+
+    def dump(self, path):
+        if self.stats is not None:
+            self.stats.dump_stats(path)
@@ -0,0 +1,287 @@
+import array
+import functools
+import json
+import os
+import re
+
+from .builder import CertificateInfo
+
+
+JSON_LINES_EXTS = (".jsonl", ".ndjson")
+
+RANGE_RE = re.compile(r"\{(\d+)\.\.(\d+)\}")
+
+
+@functools.lru_cache(maxsize=None)
+def streaming_loader():
+    """The YAML loader class for iter_yaml_entries.
+
+    yaml is imported here, on first use, as JSON Lines inventories and
+    most commands never need it.  With libyaml, this is a safe loader on
+    libyaml's parser that can compose single nodes: yaml.CSafeLoader
+    composes whole documents in C, mixing in the Python composer makes it
+    possible to construct one sequence item at a time.
+    """
+    import yaml
+    from yaml.composer import Composer
+    from yaml.constructor import SafeConstructor
+    from yaml.resolver import Resolver
+    try:
+        from yaml.cyaml import CParser
+    except ImportError:
+        return yaml.SafeLoader
+
+    class StreamingLoader(CParser, Composer, SafeConstructor, Resolver):
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            Composer.__init__(self)
+            SafeConstructor.__init__(self)
+            Resolver.__init__(self)
+
+    return StreamingLoader
+
+
+def iter_yaml_entries(stream):
+    """Yield the certificate entries of a YAML stream as they are parsed.
+
+    Every document is either a list of entries or a single entry.
+    """
+    from yaml.events import (
+        SequenceEndEvent, SequenceStartEvent, StreamEndEvent)
+    loader = streaming_loader()(stream)
+    try:
+        loader.get_event()
+        while not loader.check_event(StreamEndEvent):
+            loader.get_event()
+            if loader.check_event(SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(SequenceEndEvent):
+                    yield loader.construct_document(
+                        loader.compose_node(None, None))
+                loader.get_event()
+            else:
+                entry = loader.construct_document(
+                    loader.compose_node(None, None))
+                if entry is not None:
+                    yield entry
+            loader.get_event()
+            loader.anchors = {}
+    finally:
+        loader.dispose()
+
+
+def iter_json_lines_entries(stream):
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_entries(filename):
+    with open(filename, 'r') as f:
+        if filename.endswith(JSON_LINES_EXTS):
+            yield from iter_json_lines_entries(f)
+        else:
+            yield from iter_yaml_entries(f)
+
+
+def expand_entry(entry):
+    """Yield the entries described by an entry with a range in its basename.
+
+    A basename like "node-{0001..5000}" stands for one entry per number in
+    the range, zero-padded when either bound is.  Every occurrence of the
+    same range in the entry's other strings, including list items such as
+    subject_alt_names, is replaced by the number as well.  Entries without
+    a range are yielded unchanged.
+    """
+    match = RANGE_RE.search(str(entry.get("basename", "")))
+    if match is None:
+        yield entry
+        return
+    token = match.group(0)
+    first, last = match.group(1), match.group(2)
+    if len(first) > 1 and first.startswith("0") \
+            or len(last) > 1 and last.startswith("0"):
+        width = max(len(first), len(last))
+    else:
+        width = 0
+    step = 1 if int(first) <= int(last) else -1
+    for index in range(int(first), int(last) + step, step):
+        value = str(index).zfill(width)
+        yield {key: _substitute(item, token, value)
+               for key, item in entry.items()}
+
+
+def _substitute(item, token, value):
+    if isinstance(item, str):
+        return item.replace(token, value)
+    if isinstance(item, list):
+        return [_substitute(element, token, value) for element in item]
+    return item
+
+
+def get_cert_infos(filenames):
+    for filename in filenames:
+        basedir = os.path.dirname(filename)
+        for item in iter_entries(filename):
+            if not isinstance(item, dict):
+                raise ValueError("%s: expected a certificate description, "
+                                 "got %r" % (filename, item))
+            for entry in expand_entry(item):
+                yield basedir, CertificateInfo.from_dict(entry)
+
+
+class StringColumn:
+    """A column of strings stored as UTF-8 in one buffer.
+
+    Strings that are unique to an entry, like basenames, CNs and subject
+    alternative names, take a fraction of the memory of str objects this
+    way.  Values that aren't strings are kept as they are.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array.array("Q")
+        self.others = {}
+
+    def __len__(self):
+        return len(self.ends)
+
+    def append(self, value):
+        if type(value) is str:
+            self.data += value.encode()
+        else:
+            self.others[len(self.ends)] = value
+        self.ends.append(len(self.data))
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index in self.others:
+            return self.others[index]
+        start = self.ends[index - 1] if index else 0
+        return self.data[start:self.ends[index]].decode()
+
+
+class Inventory:
+    """The certificate descriptions of an inventory, stored by column.
+
+    Commands that need a whole inventory at once keep it here instead of
+    in a list of CertificateInfo objects.  Values that repeat across
+    entries, such as the subject fields other than the CN, CA names and
+    base directories, are stored once and referenced by number; numbers
+    and flags are packed into arrays; basenames, CNs and the subject
+    alternative names of all entries go into StringColumns.  Indexing
+    returns a (basedir, cert_info) pair whose CertificateInfo is made on
+    demand, so only the entries in use take a full object.
+    """
+    CODED_FIELDS = ("C", "ST", "L", "O", "OU", "ca", "key_type", "curve")
+    NUMBER_FIELDS = ("key_size", "expiration_days")
+    FLAG_FIELDS = ("is_ca", "use_password", "reuse_key")
+    # Set if subject_alt_names is not None, after the FLAG_FIELDS bits.
+    HAS_ALT_NAMES = 1 << len(FLAG_FIELDS)
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        self.basedirs = array.array("I")
+        self.basenames = StringColumn()
+        self.common_names = StringColumn()
+        self.coded = {field: array.array("I")
+                      for field in self.CODED_FIELDS}
+        self.numbers = {field: array.array("i")
+                        for field in self.NUMBER_FIELDS}
+        self.flags = bytearray()
+        self.alt_names = StringColumn()
+        self.alt_name_ends = array.array("L")
+
+    @classmethod
+    def from_files(cls, filenames):
+        inventory = cls()
+        inventory.extend(get_cert_infos(filenames))
+        return inventory
+
+    def __len__(self):
+        return len(self.basenames)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def _code(self, value):
+        # The type is part of the key so that e.g. 1 and True stay apart.
+        key = (type(value), value)
+        code = self.codes.get(key)
+        if code is None:
+            code = self.codes[key] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def append(self, basedir, cert_info):
+        self.basedirs.append(self._code(basedir))
+        self.basenames.append(cert_info.basename)
+        self.common_names.append(cert_info.CN)
+        for field, column in self.coded.items():
+            column.append(self._code(getattr(cert_info, field)))
+        for field, column in self.numbers.items():
+            value = getattr(cert_info, field)
+            try:
+                column.append(value)
+            except (TypeError, OverflowError):
+                # Not a small int, e.g. a quoted number; keep it as it is.
+                column = self.numbers[field] = list(column)
+                column.append(value)
+        flags = 0
+        for bit, field in enumerate(self.FLAG_FIELDS):
+            if getattr(cert_info, field):
+                flags |= 1 << bit
+        if cert_info.subject_alt_names is not None:
+            flags |= self.HAS_ALT_NAMES
+            self.alt_names.extend(cert_info.subject_alt_names)
+        self.flags.append(flags)
+        self.alt_name_ends.append(len(self.alt_names))
+
+    def extend(self, entries):
+        """Append the (basedir, cert_info) pairs of entries."""
+        for basedir, cert_info in entries:
+            self.append(basedir, cert_info)
+
+    def basedir(self, index):
+        return self.values[self.basedirs[index]]
+
+    def get(self, index, field):
+        """One field of an entry, without making its CertificateInfo."""
+        if field == "basename":
+            return self.basenames[index]
+        if field == "CN":
+            return self.common_names[index]
+        if field in self.coded:
+            return self.values[self.coded[field][index]]
+        if field in self.numbers:
+            return self.numbers[field][index]
+        if field == "subject_alt_names":
+            return self._alt_names(index)
+        return bool(self.flags[index] & 1 << self.FLAG_FIELDS.index(field))
+
+    def _alt_names(self, index):
+        if not self.flags[index] & self.HAS_ALT_NAMES:
+            return None
+        start = self.alt_name_ends[index - 1] if index else 0
+        return tuple(self.alt_names[start:self.alt_name_ends[index]])
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError("inventory index out of range")
+        flags = self.flags[index]
+        fields = {field: self.values[column[index]]
+                  for field, column in self.coded.items()}
+        fields.update((field, column[index])
+                      for field, column in self.numbers.items())
+        fields.update((field, bool(flags & 1 << bit))
+                      for bit, field in enumerate(self.FLAG_FIELDS))
+        fields["subject_alt_names"] = self._alt_names(index)
+        return self.basedir(index), CertificateInfo(
+            self.basenames[index], CN=self.common_names[index], **fields)
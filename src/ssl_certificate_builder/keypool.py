@@ -0,0 +1,88 @@
+import os
+
+from .builder import CertificateBuilder, CertificateInfo
+from .scheduler import Scheduler
+
+
+class KeyPool:
+    """A directory of pre-generated, unencrypted private keys.
+
+    Keys are kept in one subdirectory per algorithm and size.  A key only
+    appears in its bucket once it is completely written, and taking a key
+    renames it out of the bucket first, so every key is handed out exactly
+    once even when several processes share the pool.  The keys are not
+    encrypted, so the pool and its keys are only accessible to their owner.
+    """
+    KEY_EXT = CertificateInfo.PRIVATE_KEY_EXT
+    TMP_DIR = ".tmp"
+    CLAIMED_DIR = ".claimed"
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @staticmethod
+    def bucket_for(cert_info):
+        return cert_info.key_algorithm
+
+    def count(self, bucket):
+        try:
+            return sum(1 for name in os.listdir(self._path(bucket))
+                       if name.endswith("." + self.KEY_EXT))
+        except FileNotFoundError:
+            return 0
+
+    def take(self, cert_info):
+        bucket = self.bucket_for(cert_info)
+        claimed_dir = self._path(bucket, self.CLAIMED_DIR)
+        try:
+            names = [name for name in os.listdir(self._path(bucket))
+                     if name.endswith("." + self.KEY_EXT)]
+        except FileNotFoundError:
+            return None
+        self._make_private_dirs(bucket, self.CLAIMED_DIR)
+        for name in names:
+            claimed = os.path.join(claimed_dir, name)
+            try:
+                os.rename(self._path(bucket, name), claimed)
+            except FileNotFoundError:
+                # Somebody else took it first.
+                continue
+            return claimed
+        return None
+
+    def fill(self, cert_info, size, jobs=1, backend=None):
+        bucket = self.bucket_for(cert_info)
+        tmp_dir = self._path(bucket, self.TMP_DIR)
+        self._make_private_dirs(bucket, self.TMP_DIR)
+        scheduler = Scheduler(jobs)
+        for _ in range(size - self.count(bucket)):
+            key_info = CertificateInfo(os.urandom(16).hex(),
+                                       key_size=cert_info.key_size,
+                                       key_type=cert_info.key_type,
+                                       curve=cert_info.curve)
+            builder = CertificateBuilder(key_info, base_dir=tmp_dir,
+                                         backend=backend)
+            scheduler.submit(key_info.basename, self._add_key(bucket, builder))
+        return scheduler.wait()
+
+    def _add_key(self, bucket, builder):
+        def add_key():
+            builder.generate_private_key()
+            builder.backend.forget(builder)
+            os.chmod(builder.private_key_path, 0o600)
+            os.rename(builder.private_key_path,
+                      self._path(bucket, builder.cert_info.private_key_name))
+        return add_key
+
+    def _make_private_dirs(self, *parts):
+        """Create the directories down to _path(*parts) as 0700."""
+        paths = [self.directory]
+        for part in parts:
+            paths.append(os.path.join(paths[-1], part))
+        for path in paths:
+            os.makedirs(path, mode=0o700, exist_ok=True)
+            if os.stat(path).st_mode & 0o077:
+                os.chmod(path, 0o700)
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
@@ -0,0 +1,51 @@
+import hashlib
+import json
+import os
+
+from .state import StateFile, StateFiles
+
+
+def fingerprint(builder):
+    """Hash everything that goes into the certificate a builder produces.
+
+    That is the certificate description, the rendered OpenSSL config file
+    and, for CA-signed certificates, the issuing CA's certificate, so
+    re-issuing a CA changes the fingerprint of every certificate it signs.
+    """
+    cert_info = builder.cert_info
+    digest = hashlib.sha256()
+    digest.update(json.dumps(cert_info.to_dict(), sort_keys=True,
+                             default=str).encode())
+    digest.update(cert_info.get_config_file().encode())
+    if cert_info.ca is not None:
+        try:
+            with open(builder.ca_certificate_path, "rb") as f:
+                digest.update(f.read())
+        except FileNotFoundError:
+            pass
+    return digest.hexdigest()
+
+
+class Manifest(StateFile):
+    """Fingerprints of the certificates built into one directory."""
+    FILENAME = ".gen-ssl-manifest.json"
+    VERSION = 1
+
+    def is_current(self, builder, fingerprint):
+        entry = self.entries.get(builder.cert_info.basename)
+        return (entry is not None
+                and entry["fingerprint"] == fingerprint
+                and os.path.exists(builder.certificate_path)
+                and os.path.exists(builder.private_key_path))
+
+    def record(self, builder, fingerprint):
+        with self.lock:
+            self.entries[builder.cert_info.basename] = {
+                "fingerprint": fingerprint,
+            }
+            self.changed = True
+
+
+class Manifests(StateFiles):
+    """The manifests of all output directories of a run."""
+    STATE_FILE = Manifest
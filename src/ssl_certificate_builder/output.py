@@ -0,0 +1,255 @@
+import ctypes
+import ctypes.util
+import functools
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+from .backends import OpenSSL, Secret
+from .builder import CertificateInfo, certificate_key
+
+
+FULLCHAIN_EXT = "fullchain.pem"
+PKCS12_EXT = "p12"
+PRIVATE_EXTS = (CertificateInfo.PRIVATE_KEY_EXT, PKCS12_EXT)
+
+
+@functools.lru_cache(maxsize=None)
+def _libc_syncfs():
+    try:
+        return ctypes.CDLL(ctypes.util.find_library("c"),
+                           use_errno=True).syncfs
+    except (AttributeError, OSError, TypeError):
+        return None
+
+
+def _syncfs(directory):
+    """Flush the filesystem that holds directory, and nothing else.
+
+    Returns False where syncfs() isn't available, so the caller can fall
+    back to syncing file by file.
+    """
+    syncfs = _libc_syncfs()
+    if syncfs is None:
+        return False
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        if syncfs(fd) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+    finally:
+        os.close(fd)
+    return True
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Archive:
+    """A tar or zip file that collects the outputs of a run.
+
+    The format follows the file name: .zip, .tar.gz/.tgz, .tar.bz2,
+    .tar.xz or plain .tar.
+    """
+    TAR_MODES = ((".tar.gz", "w:gz"), (".tgz", "w:gz"),
+                 (".tar.bz2", "w:bz2"), (".tar.xz", "w:xz"))
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.lock = threading.Lock()
+        if path.endswith(".zip"):
+            self.zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+            self.tar = None
+        else:
+            mode = next((mode for ext, mode in self.TAR_MODES
+                         if path.endswith(ext)), "w")
+            self.tar = tarfile.open(path, mode)
+            self.zip = None
+
+    def add(self, path, data):
+        """Add data as the file that ends up at path."""
+        name = os.path.relpath(os.path.abspath(path), self.directory)
+        if name.startswith(os.pardir):
+            name = os.path.basename(path)
+        file_mode = 0o600 if path.endswith(PRIVATE_EXTS) else 0o644
+        with self.lock:
+            if self.zip is not None:
+                info = zipfile.ZipInfo(name, time.localtime()[:6])
+                info.external_attr = file_mode << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+                self.zip.writestr(info, data)
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mode = file_mode
+                info.mtime = time.time()
+                self.tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        (self.zip or self.tar).close()
+
+
+class OutputWriter:
+    """Builds every certificate in a staging directory and moves its files
+    into place only once all of them are complete.
+
+    A crash therefore never leaves a half-written set of files behind: the
+    certificate is renamed last, so an updated certificate always comes with
+    the key and config it was made from.  Completed certificates are moved
+    in batches with a single syncfs() of the output filesystem per batch
+    instead of one fsync per file;
+    CAs are moved right away because the certificates they sign need them.
+
+    The full-chain PEM, PKCS#12 bundle and run archive are produced from
+    the staged files while they are moved, in the same pass.
+    """
+    STAGING_PREFIX = ".gen-ssl-staging-"
+
+    def __init__(self, batch_size=64, fullchain=False, pkcs12=False,
+                 archive=None, openssl=OpenSSL()):
+        self.batch_size = max(1, batch_size)
+        self.fullchain = fullchain
+        self.pkcs12 = pkcs12
+        self.archive = Archive(archive) if archive else None
+        self.openssl = openssl
+        self.lock = threading.Lock()
+        self.final_dirs = {}
+        self.chains = {}
+        self.pending = []
+
+    def stage(self, builder):
+        """Point the builder's outputs at a fresh staging directory."""
+        final_dir = builder.base_dir
+        staging_dir = tempfile.mkdtemp(prefix=self.STAGING_PREFIX,
+                                       dir=final_dir)
+        existing_key = builder.private_key_path
+        builder.base_dir = staging_dir
+        if builder.reuse_key and os.path.exists(existing_key):
+            shutil.copy2(existing_key, builder.private_key_path)
+        with self.lock:
+            self.final_dirs[builder] = final_dir
+
+    def add(self, builder):
+        """Queue the staged files of a finished builder to be moved."""
+        staging_dir = builder.base_dir
+        with self.lock:
+            final_dir = self.final_dirs[builder]
+        with open(builder.certificate_path, "rb") as f:
+            chain = f.read() + self._issuer_chain(builder)
+        if builder.cert_info.is_ca:
+            with self.lock:
+                self.chains[certificate_key(
+                    final_dir, builder.cert_info.basename)] = chain
+        if self.fullchain or self.pkcs12:
+            self._write_packages(builder, chain)
+        names = sorted(os.listdir(staging_dir))
+        # The certificate goes last, see the class docstring.
+        names.remove(builder.cert_info.certificate_name)
+        names.append(builder.cert_info.certificate_name)
+        if self.archive is not None:
+            for name in names:
+                with open(os.path.join(staging_dir, name), "rb") as f:
+                    self.archive.add(os.path.join(final_dir, name), f.read())
+        with self.lock:
+            del self.final_dirs[builder]
+            self.pending.append((staging_dir, final_dir, names))
+            flush = (builder.cert_info.is_ca
+                     or len(self.pending) >= self.batch_size)
+        if flush:
+            self.flush()
+
+    def discard(self, builder):
+        """Throw away the staged files of a builder that failed."""
+        with self.lock:
+            final_dir = self.final_dirs.pop(builder, None)
+        if final_dir is not None:
+            shutil.rmtree(builder.base_dir, ignore_errors=True)
+            builder.base_dir = final_dir
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if not pending:
+                return
+            self._sync_staged(pending)
+            directories = set()
+            for staging_dir, final_dir, names in pending:
+                for name in names:
+                    os.replace(os.path.join(staging_dir, name),
+                               os.path.join(final_dir, name))
+                os.rmdir(staging_dir)
+                directories.add(final_dir)
+            for directory in directories:
+                _fsync(directory)
+
+    @staticmethod
+    def _sync_staged(pending):
+        """Make all staged files durable before any of them is renamed.
+
+        Every filesystem that holds a staging directory is synced once;
+        without syncfs() the staged files are fsynced one by one.
+        """
+        synced = set()
+        for staging_dir, _, names in pending:
+            device = os.stat(staging_dir).st_dev
+            if device in synced:
+                continue
+            if _syncfs(staging_dir):
+                synced.add(device)
+            else:
+                for name in names:
+                    _fsync(os.path.join(staging_dir, name))
+
+    def close(self):
+        self.flush()
+        if self.archive is not None:
+            self.archive.close()
+
+    def _issuer_chain(self, builder):
+        """The certificates of the CA chain above a builder's certificate.
+
+        CAs issued in this run contribute their whole chain, other CAs
+        only their own certificate.
+        """
+        if builder.cert_info.ca is None:
+            return b""
+        key = certificate_key(builder.ca_dir, builder.cert_info.ca)
+        with self.lock:
+            chain = self.chains.get(key)
+        if chain is None:
+            with open(builder.ca_certificate_path, "rb") as f:
+                chain = f.read()
+            with self.lock:
+                self.chains[key] = chain
+        return chain
+
+    @staticmethod
+    def _staged_path(builder, ext):
+        return os.path.join(builder.base_dir,
+                            "%s.%s" % (builder.cert_info.basename, ext))
+
+    def _write_packages(self, builder, chain):
+        fullchain_path = self._staged_path(builder, FULLCHAIN_EXT)
+        with open(fullchain_path, "wb") as f:
+            f.write(chain)
+        if self.pkcs12:
+            self.openssl(
+                ["pkcs12"], "export",
+                inkey=builder.private_key_path,
+                out=self._staged_path(builder, PKCS12_EXT),
+                passin=Secret(builder.key_password),
+                passout=Secret(builder.key_password or ""),
+                **{"in": fullchain_path})
+        if not self.fullchain:
+            os.remove(fullchain_path)
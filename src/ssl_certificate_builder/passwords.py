@@ -0,0 +1,115 @@
+import getpass
+import os
+import sys
+import threading
+
+
+_prompt_lock = threading.Lock()
+
+
+def prompt(text="Password:"):
+    """Ask for a password on the terminal, or read a line from stdin."""
+    with _prompt_lock:
+        if sys.stdin.isatty():
+            return getpass.getpass(text + " ")
+        else:
+            print(text, end=' ', flush=True)
+            return input()
+
+
+class PasswordSource:
+    """Where the passwords of encrypted private keys come from.
+
+    get() is called with the group a key belongs to: the basename of the
+    CA that issues it, or its own basename for CAs and self-signed
+    certificates.  The key of a CA is therefore in the same group as the
+    keys of the certificates it signs.
+    """
+    spec = None
+
+    def get(self, group, text="Password:"):
+        raise NotImplementedError
+
+
+class PromptPassword(PasswordSource):
+    """Prompt for every key."""
+    spec = "prompt"
+
+    def get(self, group, text="Password:"):
+        return prompt(text)
+
+
+class PromptOncePassword(PasswordSource):
+    """Prompt once and use the password for every key of the run."""
+    spec = "prompt-once"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.password = None
+
+    def get(self, group, text="Password:"):
+        with self.lock:
+            if self.password is None:
+                self.password = prompt("Password for all keys:")
+            return self.password
+
+
+class PromptPerCAPassword(PasswordSource):
+    """Prompt once per CA and use the password for all keys it signs."""
+    spec = "prompt-per-ca"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.passwords = {}
+
+    def get(self, group, text="Password:"):
+        with self.lock:
+            if group not in self.passwords:
+                self.passwords[group] = prompt(
+                    "Password for the keys of %s:" % group)
+            return self.passwords[group]
+
+
+class FixedPassword(PasswordSource):
+    """The same password, read once from somewhere, for every key."""
+
+    def __init__(self, password):
+        self.password = password
+
+    def get(self, group, text="Password:"):
+        return self.password
+
+
+def _first_line(f):
+    return f.readline().rstrip("\r\n")
+
+
+def get_password_source(spec="prompt"):
+    """Create the password source described by spec.
+
+    spec is one of prompt, prompt-once, prompt-per-ca, env:NAME (the
+    environment variable NAME), file:PATH (the first line of a file) or
+    fd:N (the first line read from file descriptor N).
+    """
+    for source in (PromptPassword, PromptOncePassword, PromptPerCAPassword):
+        if spec == source.spec:
+            return source()
+    kind, _, value = spec.partition(":")
+    if kind == "env":
+        try:
+            return FixedPassword(os.environ[value])
+        except KeyError:
+            raise ValueError("environment variable %s is not set" % value)
+    try:
+        if kind == "file":
+            with open(value) as f:
+                return FixedPassword(_first_line(f))
+        if kind == "fd":
+            with os.fdopen(int(value), closefd=False) as f:
+                return FixedPassword(_first_line(f))
+    except OSError as exc:
+        raise ValueError("can't read the password from %s: %s"
+                         % (spec, exc))
+    raise ValueError(
+        "unknown password source %r, expected prompt, prompt-once, "
+        "prompt-per-ca, env:NAME, file:PATH or fd:N" % (spec,))
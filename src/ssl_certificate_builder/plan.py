@@ -0,0 +1,331 @@
+import array
+import json
+import os
+
+import yaml
+
+from .builder import CertificateBuilder, CertificateInfo, certificate_key
+from .inventory import Inventory, expand_entry, iter_entries
+from .manifest import Manifests, fingerprint
+
+
+# The keys a certificate description may have and the types of their
+# values; see CertificateInfo.from_dict.  Numbers may also be quoted;
+# "ca" is the only type.
+ENTRY_SCHEMA = {
+    "basename": str,
+    "type": str,
+    "C": str,
+    "ST": str,
+    "L": str,
+    "O": str,
+    "OU": str,
+    "CN": str,
+    "subject_alt_names": list,
+    "ca": str,
+    "key_size": int,
+    "expiration_days": int,
+    "use_password": bool,
+    "key_type": str,
+    "curve": str,
+    "reuse_key": bool,
+}
+
+
+def validate_entry(entry):
+    """Check a certificate description against ENTRY_SCHEMA.
+
+    Returns the list of problems found; it is empty for valid entries.
+    """
+    problems = []
+    if "basename" not in entry:
+        problems.append("missing basename")
+    for key, value in entry.items():
+        expected = ENTRY_SCHEMA.get(str(key).replace("-", "_"))
+        if expected is None:
+            problems.append("unknown key %r" % (key,))
+        elif value is None and key != "basename":
+            continue
+        elif expected is int and _is_integer(value):
+            continue
+        elif not isinstance(value, expected) or expected is int:
+            problems.append("%s should be of type %s, not %s" % (
+                key, expected.__name__, type(value).__name__))
+        elif expected is list and not all(isinstance(item, str)
+                                          for item in value):
+            problems.append("%s should be a list of strings" % key)
+        elif key == "type" and value != "ca":
+            problems.append("unknown type %r; leave it out for certificates "
+                            "that aren't CAs" % (value,))
+    return problems
+
+
+def _is_integer(value):
+    """Whether value is an int or a string that CertificateInfo reads as
+    one, like "2048"."""
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return True
+    if not isinstance(value, str):
+        return False
+    try:
+        int(value)
+    except ValueError:
+        return False
+    return True
+
+
+class PlannedCertificate:
+    NEW = "new"
+    CHANGED = "changed"
+    UP_TO_DATE = "up-to-date"
+
+    def __init__(self, key, location, basedir, cert_info, status=None):
+        self.key = key
+        self.location = location
+        self.basedir = basedir
+        self.cert_info = cert_info
+        self.status = status
+
+
+class Plan:
+    """What a run over an inventory would do, found without running it.
+
+    problems lists everything that would make entries fail: descriptions
+    that don't match the schema, CAs that don't exist, come after the
+    certificates they sign or sign each other in a cycle.  The valid
+    entries are kept in an Inventory, with their locations and statuses in
+    columns next to it; certificates yields them in inventory order as
+    PlannedCertificates.
+    """
+    STATUSES = (PlannedCertificate.NEW, PlannedCertificate.CHANGED,
+                PlannedCertificate.UP_TO_DATE)
+
+    def __init__(self):
+        self.problems = []
+        self.inventory = Inventory()
+        self.filenames = []
+        self.sources = array.array("I")
+        self.entry_numbers = array.array("I")
+        self.statuses = bytearray()
+
+    def __len__(self):
+        return len(self.inventory)
+
+    def append(self, filename, number, basedir, cert_info):
+        if not self.filenames or self.filenames[-1] != filename:
+            self.filenames.append(filename)
+        self.sources.append(len(self.filenames) - 1)
+        self.entry_numbers.append(number)
+        self.inventory.append(basedir, cert_info)
+        self.statuses.append(0)
+
+    def key(self, index):
+        return certificate_key(self.inventory.basedir(index),
+                               self.inventory.get(index, "basename"))
+
+    def location(self, index):
+        return _location(self.filenames[self.sources[index]],
+                         self.entry_numbers[index])
+
+    def status(self, index):
+        return self.STATUSES[self.statuses[index]]
+
+    def __getitem__(self, index):
+        basedir, cert_info = self.inventory[index]
+        return PlannedCertificate(self.key(index), self.location(index),
+                                  basedir, cert_info, self.status(index))
+
+    @property
+    def certificates(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def count(self, status):
+        return self.statuses.count(self.STATUSES.index(status))
+
+    @property
+    def outdated(self):
+        return (planned for planned in self.certificates
+                if planned.status != PlannedCertificate.UP_TO_DATE)
+
+
+def _location(filename, number):
+    return "%s: entry %d" % (filename, number)
+
+
+def make_plan(filenames, output_dir=None):
+    """Validate an inventory, resolve its CAs and find what is outdated.
+
+    A certificate is new if its file doesn't exist, up to date if the
+    manifest of an --incremental run has its current fingerprint and
+    changed otherwise.  Certificates of new or changed CAs are changed as
+    well.  output_dir has the same meaning as for generate_certificates.
+    """
+    plan = Plan()
+    # The index of every entry by basedir and basename.
+    indexes = {}
+    for filename, number, basedir, cert_info in _read_entries(
+            filenames, plan.problems):
+        basedir_indexes = indexes.setdefault(basedir, {})
+        existing = basedir_indexes.get(cert_info.basename)
+        if existing is not None:
+            plan.problems.append("%s: %s is already described in %s" % (
+                _location(filename, number), cert_info.basename,
+                plan.location(existing)))
+            continue
+        basedir_indexes[cert_info.basename] = len(plan)
+        plan.append(filename, number, basedir, cert_info)
+    _resolve_cas(plan, indexes)
+    _find_outdated(plan, indexes, output_dir)
+    return plan
+
+
+def _read_entries(filenames, problems):
+    for filename in filenames:
+        basedir = os.path.dirname(filename)
+        try:
+            for number, item in enumerate(iter_entries(filename), 1):
+                location = _location(filename, number)
+                if not isinstance(item, dict):
+                    problems.append("%s: expected a certificate description, "
+                                    "got %r" % (location, item))
+                    continue
+                entry_problems = validate_entry(item)
+                if entry_problems:
+                    problems.extend("%s (%s): %s" % (
+                        location, item.get("basename"), problem)
+                        for problem in entry_problems)
+                    continue
+                for entry in expand_entry(item):
+                    try:
+                        cert_info = CertificateInfo.from_dict(entry)
+                    except ValueError as exc:
+                        problems.append("%s (%s): %s" % (
+                            location, entry["basename"], exc))
+                        continue
+                    yield filename, number, basedir, cert_info
+        except (OSError, ValueError, yaml.YAMLError) as exc:
+            problems.append("%s: %s" % (filename, exc))
+
+
+def _ca_index(plan, indexes, index):
+    """The index of the CA of an entry, or None if it has none or the CA
+    isn't described.
+    """
+    ca = plan.inventory.get(index, "ca")
+    if ca is None:
+        return None
+    return indexes[plan.inventory.basedir(index)].get(ca)
+
+
+def _resolve_cas(plan, indexes):
+    inventory = plan.inventory
+    for index in range(len(plan)):
+        ca = inventory.get(index, "ca")
+        if ca is None:
+            continue
+        basename = inventory.get(index, "basename")
+        ca_index = _ca_index(plan, indexes, index)
+        if ca_index is None:
+            builder = CertificateBuilder(inventory[index][1],
+                                         base_dir=inventory.basedir(index))
+            if not (os.path.exists(builder.ca_certificate_path)
+                    and os.path.exists(builder.ca_private_key_path)):
+                plan.problems.append(
+                    "%s (%s): CA %s is neither described nor in %s" % (
+                        plan.location(index), basename, ca,
+                        inventory.basedir(index) or os.curdir))
+        elif not inventory.get(ca_index, "is_ca"):
+            plan.problems.append("%s (%s): %s is not a CA" % (
+                plan.location(index), basename, ca))
+        elif ca_index >= index:
+            plan.problems.append(
+                "%s (%s): CA %s has to be described before the "
+                "certificates it signs" % (
+                    plan.location(index), basename, ca))
+    reported = set()
+    for index in range(len(plan)):
+        chain = []
+        while index is not None and index not in chain:
+            chain.append(index)
+            index = _ca_index(plan, indexes, index)
+        if index is None:
+            continue
+        cycle = chain[chain.index(index):]
+        if frozenset(cycle) not in reported:
+            reported.add(frozenset(cycle))
+            plan.problems.append("CAs sign each other in a cycle: %s" % (
+                " -> ".join(map(plan.key, cycle + cycle[:1]))))
+
+
+def _find_outdated(plan, indexes, output_dir):
+    manifests = Manifests()
+    new, changed, up_to_date = range(len(plan.STATUSES))
+    for index in range(len(plan)):
+        basedir, cert_info = plan.inventory[index]
+        builder = CertificateBuilder(
+            cert_info,
+            base_dir=output_dir if output_dir and not cert_info.is_ca
+            else basedir,
+            ca_dir=basedir)
+        ca_index = _ca_index(plan, indexes, index)
+        if not os.path.exists(builder.certificate_path):
+            status = new
+        elif ca_index is not None and ca_index < index \
+                and plan.statuses[ca_index] != up_to_date \
+                or not manifests[builder.base_dir].is_current(
+                    builder, fingerprint(builder)):
+            status = changed
+        else:
+            status = up_to_date
+        plan.statuses[index] = status
+
+
+class CostModel:
+    """Stage costs measured by benchmarks/bench_issuance.py.
+
+    cost() adds up the median times of the stages a certificate goes
+    through on one backend: config rendering, key generation for its
+    algorithm, and a self-signed certificate or a request plus a
+    CA-signed certificate.
+    """
+
+    def __init__(self, results, backend):
+        self.backend = backend
+        self.medians = {}
+        for result in results:
+            self.medians[(result["name"], result.get("backend"),
+                          result.get("algorithm"))] = result["median"]
+        self.missing = set()
+
+    @classmethod
+    def load(cls, path, backend):
+        with open(path) as f:
+            return cls(json.load(f)["results"], backend)
+
+    def _median(self, name, backend=None, algorithm=None):
+        median = self.medians.get((name, backend, algorithm))
+        if median is None:
+            self.missing.add(" ".join(
+                part for part in (name, backend, algorithm) if part))
+            return 0.0
+        return median
+
+    def cost(self, cert_info):
+        seconds = self.medians.get(("config", None, None), 0.0)
+        seconds += self._median("keygen", self.backend,
+                                cert_info.key_algorithm)
+        if cert_info.ca is None:
+            seconds += self._median("self_signed", self.backend)
+        else:
+            seconds += self._median("request", self.backend)
+            seconds += self._median("ca_signed", self.backend)
+        return seconds
+
+    def estimate(self, cert_infos, jobs=1):
+        """Estimate the seconds it takes to build cert_infos with jobs
+        parallel builds.
+        """
+        return sum(map(self.cost, cert_infos)) / max(1, jobs)
@@ -0,0 +1,172 @@
+import base64
+import calendar
+import os
+import re
+import time
+
+from .builder import CertificateBuilder, certificate_key
+from .state import StateFile, StateFiles
+
+
+PEM_CERTIFICATE_RE = re.compile(
+    rb"-----BEGIN CERTIFICATE-----(.*?)-----END CERTIFICATE-----", re.S)
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+class CertificateParseError(ValueError):
+    pass
+
+
+def parse_duration(text):
+    """Parse a duration like 30d, 12h or 2w into seconds; default unit: d."""
+    match = re.fullmatch(r"(\d+)([smhdw]?)", text.strip())
+    if match is None:
+        raise ValueError("invalid duration %r" % (text,))
+    return int(match.group(1)) * DURATION_UNITS[match.group(2) or "d"]
+
+
+def _read_tlv(data, offset):
+    """Read the DER element at offset; returns tag, content and next offset.
+    """
+    try:
+        tag = data[offset]
+        length = data[offset + 1]
+        offset += 2
+        if length & 0x80:
+            size = length & 0x7f
+            length = int.from_bytes(data[offset:offset + size], "big")
+            offset += size
+    except IndexError:
+        raise CertificateParseError("truncated DER data")
+    if offset + length > len(data):
+        raise CertificateParseError("truncated DER data")
+    return tag, data[offset:offset + length], offset + length
+
+
+def _parse_time(tag, content):
+    text = bytes(content).decode("ascii")
+    if tag == 0x17:  # UTCTime, YYMMDDHHMMSSZ
+        year = int(text[:2])
+        text = ("19" if year >= 50 else "20") + text
+    elif tag != 0x18:  # GeneralizedTime, YYYYMMDDHHMMSSZ
+        raise CertificateParseError("unexpected time tag 0x%02x" % tag)
+    return calendar.timegm(time.strptime(text, "%Y%m%d%H%M%SZ"))
+
+
+def parse_certificate(pem):
+    """Read validity, issuer and subject of the first certificate in pem.
+
+    Only the few fields needed to decide about renewal are decoded, which
+    is much cheaper than a full X.509 parse.  Times are POSIX timestamps;
+    issuer and subject are the hex encoded DER names.
+    """
+    match = PEM_CERTIFICATE_RE.search(pem)
+    if match is None:
+        raise CertificateParseError("no PEM certificate found")
+    der = memoryview(base64.b64decode(match.group(1)))
+    _, certificate, _ = _read_tlv(der, 0)
+    _, tbs, _ = _read_tlv(certificate, 0)
+    tag, content, offset = _read_tlv(tbs, 0)
+    if tag == 0xa0:  # explicit version
+        tag, content, offset = _read_tlv(tbs, offset)
+    serial = int.from_bytes(content, "big")
+    _, _, offset = _read_tlv(tbs, offset)  # signature algorithm
+    _, issuer, offset = _read_tlv(tbs, offset)
+    _, validity, offset = _read_tlv(tbs, offset)
+    _, subject, offset = _read_tlv(tbs, offset)
+    tag, not_before, validity_offset = _read_tlv(validity, 0)
+    not_before = _parse_time(tag, not_before)
+    tag, not_after, _ = _read_tlv(validity, validity_offset)
+    not_after = _parse_time(tag, not_after)
+    return dict(serial="%X" % serial,
+                not_before=not_before, not_after=not_after,
+                issuer=bytes(issuer).hex(), subject=bytes(subject).hex())
+
+
+class CertificateIndex(StateFile):
+    """Parsed metadata of the certificates in one directory.
+
+    Entries are keyed by file name and remember the mtime and size they
+    were parsed from, so unchanged certificates are never parsed twice.
+    """
+    FILENAME = ".gen-ssl-index.json"
+    VERSION = 1
+
+    def get(self, path):
+        """Return the metadata of the certificate at path, or None if the
+        file doesn't exist.  Raises CertificateParseError for files that
+        aren't certificates.
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        name = os.path.basename(path)
+        with self.lock:
+            entry = self.entries.get(name)
+        if (entry is not None and entry["mtime_ns"] == stat.st_mtime_ns
+                and entry["size"] == stat.st_size):
+            return entry["metadata"]
+        with open(path, "rb") as f:
+            metadata = parse_certificate(f.read())
+        with self.lock:
+            self.entries[name] = dict(mtime_ns=stat.st_mtime_ns,
+                                      size=stat.st_size, metadata=metadata)
+            self.changed = True
+        return metadata
+
+
+class CertificateIndexes(StateFiles):
+    """The certificate indexes of all directories of a run."""
+    STATE_FILE = CertificateIndex
+
+    def get(self, path):
+        return self[os.path.dirname(path)].get(path)
+
+
+def find_renewals(cert_infos, within, indexes, now=None):
+    """Yield (basedir, cert_info, reason) for certificates to re-issue.
+
+    A certificate is renewed if it is missing or unreadable, expires in
+    less than within seconds, or its CA was re-issued after it: either
+    in this run or, judging by the CA's notBefore, since it was signed.
+    A CA is only known to be renewed in this run if it comes first in the
+    inventory; otherwise its certificates are caught on the next run.
+    """
+    if now is None:
+        now = time.time()
+    renewed = set()
+    for basedir, cert_info in cert_infos:
+        builder = CertificateBuilder(cert_info, base_dir=basedir)
+        reason = _renewal_reason(builder, within, indexes, now, renewed)
+        if reason is not None:
+            renewed.add(certificate_key(basedir, cert_info.basename))
+            yield basedir, cert_info, reason
+
+
+def _renewal_reason(builder, within, indexes, now, renewed):
+    try:
+        metadata = indexes.get(builder.certificate_path)
+    except (OSError, ValueError) as exc:
+        return "unreadable: %s" % exc
+    if metadata is None:
+        return "missing"
+    if metadata["not_after"] - now < within:
+        return "expires %s" % time.strftime(
+            "%Y-%m-%d %H:%M:%S UTC", time.gmtime(metadata["not_after"]))
+    cert_info = builder.cert_info
+    if cert_info.ca is None:
+        return None
+    if certificate_key(builder.base_dir, cert_info.ca) in renewed:
+        return "CA %s renewed" % cert_info.ca
+    try:
+        ca_metadata = indexes.get(builder.ca_certificate_path)
+    except (OSError, ValueError):
+        ca_metadata = None
+    if ca_metadata is None:
+        return None
+    if (ca_metadata["not_before"] > metadata["not_before"]
+            or ca_metadata["subject"] != metadata["issuer"]):
+        return "CA %s re-issued" % cert_info.ca
+    return None
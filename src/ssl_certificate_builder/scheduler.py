@@ -0,0 +1,143 @@
+import threading
+
+
+class DependencyFailed(Exception):
+    def __init__(self, dependency):
+        super().__init__("dependency %s failed" % (dependency,))
+        self.dependency = dependency
+
+
+class Task:
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
+    def __init__(self, key, func):
+        self.key = key
+        self.func = func
+        self.state = self.PENDING
+        self.error = None
+        self.waiting_for = 0
+        self.dependents = []
+
+    @property
+    def finished(self):
+        return self.state in (self.DONE, self.FAILED, self.SKIPPED)
+
+
+class Scheduler:
+    """Run tasks on a thread pool once the tasks they depend on are done.
+
+    Dependencies are resolved against the tasks submitted so far; a key that
+    has not been submitted is assumed to refer to something that already
+    exists.  When a task fails, every task that (transitively) depends on it
+    is skipped while unrelated tasks keep running.
+
+    submit() blocks while max_pending tasks are unfinished, and finished
+    tasks are only remembered if they failed, so memory use does not grow
+    with the number of tasks fed in from a stream.
+    """
+
+    def __init__(self, jobs=1, max_pending=None):
+        # Imported here as it pulls in logging, which commands that never
+        # build anything shouldn't pay for at startup.
+        import concurrent.futures
+        jobs = max(1, jobs)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=jobs)
+        self.max_pending = max_pending if max_pending else 4 * jobs
+        self.lock = threading.Lock()
+        self.failed_tasks = []
+        self.tasks_by_key = {}
+        self.outstanding = 0
+        self.task_finished = threading.Condition(self.lock)
+
+    def submit(self, key, func, deps=()):
+        task = Task(key, func)
+        with self.lock:
+            while self.outstanding >= self.max_pending:
+                self.task_finished.wait()
+            self.outstanding += 1
+            failed_dep = None
+            for dep in deps:
+                dep_task = self.tasks_by_key.get(dep)
+                if dep_task is None or dep_task.state == Task.DONE:
+                    continue
+                if dep_task.state in (Task.FAILED, Task.SKIPPED):
+                    failed_dep = dep
+                    break
+                dep_task.dependents.append(task)
+                task.waiting_for += 1
+            self.tasks_by_key[key] = task
+            if failed_dep is not None:
+                self._skip(task, failed_dep)
+            elif task.waiting_for == 0:
+                self._start(task)
+        return task
+
+    def reject(self, key, error):
+        """Record a task that fails with error without running.
+
+        Tasks that depend on it are skipped like those of any failed task.
+        """
+        task = Task(key, None)
+        task.state = Task.FAILED
+        task.error = error
+        with self.lock:
+            self.tasks_by_key[key] = task
+            self.failed_tasks.append(task)
+        return task
+
+    def wait(self):
+        """Wait for all tasks and return the ones that failed or were skipped.
+        """
+        with self.lock:
+            while self.outstanding:
+                self.task_finished.wait()
+        self.executor.shutdown()
+        return self.failed_tasks
+
+    def _start(self, task):
+        task.state = Task.RUNNING
+        self.executor.submit(self._run, task)
+
+    def _run(self, task):
+        try:
+            task.func()
+        except Exception as exc:
+            with self.lock:
+                task.state = Task.FAILED
+                task.error = exc
+                self._finish(task)
+                for dependent in task.dependents:
+                    self._skip(dependent, task.key)
+        else:
+            with self.lock:
+                task.state = Task.DONE
+                # Unknown keys count as done, so done tasks can be dropped.
+                if self.tasks_by_key.get(task.key) is task:
+                    del self.tasks_by_key[task.key]
+                self._finish(task)
+                for dependent in task.dependents:
+                    dependent.waiting_for -= 1
+                    if (dependent.state == Task.PENDING
+                            and dependent.waiting_for == 0):
+                        self._start(dependent)
+
+    def _skip(self, task, failed_key):
+        if task.finished:
+            return
+        task.state = Task.SKIPPED
+        task.error = DependencyFailed(failed_key)
+        self._finish(task)
+        for dependent in task.dependents:
+            self._skip(dependent, task.key)
+
+    def _finish(self, task):
+        task.func = None
+        if task.state != Task.DONE:
+            self.failed_tasks.append(task)
+        self.outstanding -= 1
+        self.task_finished.notify_all()
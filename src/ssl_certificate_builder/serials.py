@@ -0,0 +1,71 @@
+import fcntl
+import os
+import threading
+
+
+class SerialAllocator:
+    """Hands out certificate serial numbers for one CA.
+
+    The serial file next to the CA (the .srl file openssl's -CAcreateserial
+    uses) holds the last serial number that was handed out, in hex.  Serials
+    are reserved from it in blocks while holding an exclusive lock on the
+    file, so concurrent processes never reuse a serial, and the signers in
+    one process share a block without touching the file per certificate.
+    """
+    DEFAULT_BLOCK_SIZE = 64
+    RANDOM_START_BITS = 120
+
+    _allocators = {}
+    _allocators_lock = threading.Lock()
+
+    def __init__(self, path, block_size=DEFAULT_BLOCK_SIZE):
+        self.path = path
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.next_serial = 0
+        self.block_end = 0
+
+    @classmethod
+    def for_path(cls, path):
+        path = os.path.abspath(path)
+        with cls._allocators_lock:
+            allocator = cls._allocators.get(path)
+            if allocator is None:
+                allocator = cls._allocators[path] = cls(path)
+            return allocator
+
+    def allocate(self, count=1):
+        """Return the first of count consecutive serial numbers."""
+        with self.lock:
+            if self.block_end - self.next_serial < count:
+                self.next_serial = self._reserve(max(count, self.block_size))
+                self.block_end = self.next_serial + max(count,
+                                                        self.block_size)
+            first = self.next_serial
+            self.next_serial += count
+            return first
+
+    def _reserve(self, count):
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read().strip()
+                if content:
+                    first = int(content, 16) + 1
+                else:
+                    first = int.from_bytes(
+                        os.urandom(self.RANDOM_START_BITS // 8), "big")
+                f.seek(0)
+                f.truncate()
+                f.write(hex_serial(first + count - 1) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return first
+
+
+def hex_serial(serial):
+    digits = "%X" % serial
+    return "0" * (len(digits) % 2) + digits
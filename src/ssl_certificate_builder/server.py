@@ -0,0 +1,253 @@
+import http.client
+import http.server
+import json
+import os
+import re
+import socket
+import socketserver
+import tempfile
+import urllib.parse
+
+from .backends import InvalidRequestError
+from .builder import CertificateBuilder, CertificateInfo
+
+
+PEM_CONTENT_TYPE = "application/x-pem-file"
+CSR_CONTENT_TYPE = "application/pkcs10"
+JSON_CONTENT_TYPE = "application/json"
+CSR_MARKER = b"-----BEGIN CERTIFICATE REQUEST-----"
+# Characters that would let a value break out of its line or section of
+# the OpenSSL config file, or expand variables in it.
+UNSAFE_VALUE_RE = re.compile(r"[\x00-\x1f\x7f\[\]$\\]")
+
+
+class IssuanceError(ValueError):
+    """The request can't be issued as described."""
+
+
+class IssuanceService:
+    """Issues leaf certificates signed by the CAs in a directory.
+
+    The service is meant to live as long as the process: the backend keeps
+    loaded CA keys and certificates in memory until their files change on
+    disk, and serial numbers are taken from the per-CA allocator, so a
+    request only pays for its own key and signature.  Every request is
+    built in a scratch directory that is removed afterwards; only the CA
+    directory is shared.  Descriptions come from clients, so values that
+    could rewrite the OpenSSL config are refused.
+    """
+    BASENAME = "certificate"
+
+    def __init__(self, ca_dir, backend, key_pool=None):
+        self.ca_dir = ca_dir
+        self.backend = backend
+        self.key_pool = key_pool
+
+    def issue(self, entry):
+        """Issue a certificate for a description; returns cert and key PEM.
+        """
+        if not isinstance(entry, dict):
+            raise IssuanceError("expected a certificate description, got %r"
+                                % (entry,))
+        cert_info = self._cert_info(entry)
+        with tempfile.TemporaryDirectory(prefix="gen-ssl-serve-") as tmpdir:
+            builder = self._builder(cert_info, tmpdir)
+            builder.generate_full_certificate()
+            return (self._read(builder.certificate_path)
+                    + self._read(builder.private_key_path))
+
+    def sign(self, request, ca, expiration_days=None, subject_alt_names=()):
+        """Sign a PEM certificate request with a CA; returns the cert PEM.
+        """
+        if not request.lstrip().startswith(CSR_MARKER):
+            raise IssuanceError("expected a PEM certificate request")
+        entry = dict(ca=ca, subject_alt_names=list(subject_alt_names))
+        if expiration_days is not None:
+            entry["expiration_days"] = expiration_days
+        cert_info = self._cert_info(entry)
+        with tempfile.TemporaryDirectory(prefix="gen-ssl-serve-") as tmpdir:
+            builder = self._builder(cert_info, tmpdir)
+            builder.generate_config_file()
+            with open(builder.certificate_request_path, "wb") as f:
+                f.write(request)
+            try:
+                builder.generate_ca_signed_certificate()
+            except InvalidRequestError as exc:
+                raise IssuanceError(str(exc))
+            return self._read(builder.certificate_path)
+
+    def _cert_info(self, entry):
+        entry = dict(entry, basename=self.BASENAME)
+        for key, value in entry.items():
+            for item in value if isinstance(value, list) else [value]:
+                match = UNSAFE_VALUE_RE.search(item) \
+                    if isinstance(item, str) else None
+                if match is not None:
+                    raise IssuanceError("%s may not contain %r"
+                                        % (key, match.group(0)))
+        try:
+            cert_info = CertificateInfo.from_dict(entry)
+        except TypeError as exc:
+            raise IssuanceError(str(exc))
+        if cert_info.is_ca:
+            raise IssuanceError("only leaf certificates can be issued")
+        if cert_info.use_password:
+            raise IssuanceError("encrypted private keys can't be issued")
+        ca = cert_info.ca
+        if ca is not None:
+            if (os.path.basename(ca) != ca or ca in (os.curdir, os.pardir)
+                    or not os.path.exists(os.path.join(
+                        self.ca_dir,
+                        "%s.%s" % (ca, CertificateInfo.CERTIFICATE_EXT)))):
+                raise IssuanceError("unknown CA %r" % (ca,))
+        return cert_info
+
+    def _builder(self, cert_info, tmpdir):
+        return CertificateBuilder(cert_info, base_dir=tmpdir,
+                                  backend=self.backend,
+                                  key_pool=self.key_pool,
+                                  ca_dir=self.ca_dir)
+
+    @staticmethod
+    def _read(path):
+        with open(path, "rb") as f:
+            return f.read()
+
+
+class IssuanceRequestHandler(http.server.BaseHTTPRequestHandler):
+    """POST /certificate with a JSON description or a PEM request.
+
+    Requests are signed by the CA named in the "ca" query parameter; "days"
+    and repeated "san" parameters set the validity and the alternative
+    names.
+    """
+    server_version = "gen-ssl"
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/certificate":
+            self.send_error(404)
+            return
+        query = urllib.parse.parse_qs(url.query)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = self.headers.get_content_type()
+        service = self.server.service
+        try:
+            if content_type == CSR_CONTENT_TYPE or body.lstrip().startswith(
+                    CSR_MARKER):
+                if "ca" not in query:
+                    raise IssuanceError("the ca parameter is required")
+                pem = service.sign(
+                    body, query["ca"][0],
+                    expiration_days=query.get("days", [None])[0],
+                    subject_alt_names=query.get("san", []))
+            else:
+                pem = service.issue(json.loads(body))
+        except ValueError as exc:
+            self._respond(400, str(exc))
+        except Exception as exc:
+            self._respond(500, str(exc))
+        else:
+            self._respond(200, pem, PEM_CONTENT_TYPE)
+
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return self.server.server_address
+
+    def _respond(self, status, body, content_type="text/plain"):
+        if isinstance(body, str):
+            body = (body + "\n").encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class IssuanceHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, IssuanceRequestHandler)
+        self.service = service
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+
+class UnixIssuanceServer(socketserver.ThreadingMixIn,
+                         socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, IssuanceRequestHandler)
+        self.service = service
+
+    @property
+    def url(self):
+        return self.server_address
+
+    def server_close(self):
+        super().server_close()
+        os.remove(self.server_address)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+class IssuanceClient:
+    """Client for a running issuance server.
+
+    The address is either the path of a Unix socket or an http:// URL.
+    """
+
+    def __init__(self, address, timeout=60):
+        self.address = address
+        self.timeout = timeout
+
+    def issue(self, entry):
+        return self._post("/certificate", json.dumps(entry).encode(),
+                          JSON_CONTENT_TYPE)
+
+    def sign(self, request, ca, expiration_days=None, subject_alt_names=()):
+        query = [("ca", ca)]
+        if expiration_days is not None:
+            query.append(("days", expiration_days))
+        query.extend(("san", name) for name in subject_alt_names)
+        return self._post(
+            "/certificate?" + urllib.parse.urlencode(query), request,
+            CSR_CONTENT_TYPE)
+
+    def _post(self, path, body, content_type):
+        connection = self._connect()
+        try:
+            connection.request("POST", path, body,
+                               {"Content-Type": content_type})
+            response = connection.getresponse()
+            data = response.read()
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise IssuanceError("%d %s: %s" % (
+                response.status, response.reason,
+                data.decode(errors="replace").strip()))
+        return data
+
+    def _connect(self):
+        url = urllib.parse.urlsplit(self.address)
+        if url.scheme == "http":
+            return http.client.HTTPConnection(url.hostname, url.port,
+                                              timeout=self.timeout)
+        return UnixHTTPConnection(self.address, timeout=self.timeout)
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import shutil
+
+from .builder import CertificateBuilder
+
+
+MARKER_FILENAME = ".gen-ssl-shard.json"
+
+
+class ShardError(Exception):
+    pass
+
+
+def parse_shard(text):
+    """Parse a shard spec like 2/8 into (index, count)."""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError("invalid shard %r, expected INDEX/COUNT" % (text,))
+    if not 0 <= index < count:
+        raise ValueError("invalid shard %r, INDEX has to be between 0 and "
+                         "COUNT - 1" % (text,))
+    return index, count
+
+
+def shard_of(cert_info, count):
+    """The shard a leaf certificate belongs to.
+
+    It only depends on the basename, so every machine assigns the same
+    certificates to the same shard.
+    """
+    digest = hashlib.sha256(cert_info.basename.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def select_cas(cert_infos):
+    """The CA entries of an inventory, which are issued before sharding."""
+    for basedir, cert_info in cert_infos:
+        if cert_info.is_ca:
+            yield basedir, cert_info
+
+
+def select_shard(cert_infos, index, count):
+    """The leaf entries of an inventory that belong to one shard."""
+    for basedir, cert_info in cert_infos:
+        if not cert_info.is_ca and shard_of(cert_info, count) == index:
+            yield basedir, cert_info
+
+
+def write_marker(output_dir, index, count):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, MARKER_FILENAME), "w") as f:
+        json.dump({"shard": index, "count": count}, f)
+
+
+def read_markers(shard_dirs):
+    """Map every shard index to its directory and return the shard count.
+
+    The directories have to hold each shard of one partitioning exactly
+    once.
+    """
+    dirs_by_index = {}
+    counts = set()
+    for shard_dir in shard_dirs:
+        try:
+            with open(os.path.join(shard_dir, MARKER_FILENAME)) as f:
+                marker = json.load(f)
+        except (OSError, ValueError) as exc:
+            raise ShardError("%s: not a shard output directory: %s"
+                             % (shard_dir, exc))
+        counts.add(marker["count"])
+        if marker["shard"] in dirs_by_index:
+            raise ShardError("%s and %s both hold shard %d" % (
+                dirs_by_index[marker["shard"]], shard_dir, marker["shard"]))
+        dirs_by_index[marker["shard"]] = shard_dir
+    if len(counts) != 1:
+        raise ShardError("the directories come from different shard counts: "
+                         "%s" % ", ".join(map(str, sorted(counts))))
+    count = counts.pop()
+    missing = sorted(set(range(count)) - set(dirs_by_index))
+    if missing:
+        raise ShardError("missing shards: %s" % ", ".join(
+            "%d/%d" % (index, count) for index in missing))
+    return dirs_by_index, count
+
+
+def merge_shards(cert_infos, shard_dirs, into=None):
+    """Move the outputs of all shards next to the inventory or into a
+    directory.
+
+    Nothing is moved unless every leaf of the inventory was built by the
+    shard it belongs to, no shard holds certificates of another shard and
+    no shard holds files that aren't outputs of the inventory.  Returns the
+    list of problems found; it is empty if the shards were merged.
+    """
+    # output pulls in the archive modules, which startup does without.
+    from .output import FULLCHAIN_EXT, PKCS12_EXT
+    dirs_by_index, count = read_markers(shard_dirs)
+    unclaimed = {
+        shard_dir: set(os.listdir(shard_dir)) - {MARKER_FILENAME}
+        for shard_dir in dirs_by_index.values()}
+    moves = []
+    problems = []
+    for basedir, cert_info in cert_infos:
+        if cert_info.is_ca:
+            continue
+        shard_dir = dirs_by_index[shard_of(cert_info, count)]
+        builder = CertificateBuilder(cert_info, base_dir=shard_dir)
+        for path in (builder.certificate_path, builder.private_key_path):
+            if os.path.basename(path) not in unclaimed[shard_dir]:
+                problems.append("%s: missing from its shard" % path)
+        target_dir = into if into else basedir
+        # The bundles of --fullchain and --pkcs12 go before the
+        # certificate, which is moved last like OutputWriter does.
+        bundles = tuple(os.path.join(shard_dir, "%s.%s" % (
+            cert_info.basename, ext)) for ext in (FULLCHAIN_EXT, PKCS12_EXT))
+        for path in bundles + builder.output_paths:
+            name = os.path.basename(path)
+            if name in unclaimed[shard_dir]:
+                unclaimed[shard_dir].remove(name)
+                moves.append((path, os.path.join(target_dir, name)))
+    for shard_dir, names in sorted(unclaimed.items()):
+        problems.extend(
+            "%s: not an output of this shard" % os.path.join(shard_dir, name)
+            for name in sorted(names)
+            if not name.endswith(".srl") and not name.startswith("."))
+    if problems:
+        return problems
+    for source, target in moves:
+        os.makedirs(os.path.dirname(target) or os.curdir, exist_ok=True)
+        shutil.move(source, target)
+    return []
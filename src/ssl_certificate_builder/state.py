@@ -0,0 +1,61 @@
+import json
+import os
+import threading
+
+
+class StateFile:
+    """Entries that gen-ssl keeps about the files in one directory.
+
+    The entries are stored as JSON in FILENAME in that directory along
+    with VERSION.  A file that is missing, unreadable or of another version
+    is treated as empty, as everything in it can be worked out again; it is
+    only ever replaced whole, so a crash leaves the old file behind.
+    """
+    FILENAME = None
+    VERSION = 1
+
+    def __init__(self, base_dir):
+        self.path = os.path.join(base_dir, self.FILENAME)
+        self.lock = threading.Lock()
+        self.changed = False
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            data = None
+        if isinstance(data, dict) and data.get("version") == self.VERSION \
+                and isinstance(data.get("entries"), dict):
+            self.entries = data["entries"]
+        else:
+            self.entries = {}
+
+    def save(self):
+        if not self.changed:
+            return
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump({"version": self.VERSION, "entries": self.entries},
+                      f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+
+class StateFiles:
+    """The StateFiles of type STATE_FILE of all directories of a run."""
+    STATE_FILE = StateFile
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def __getitem__(self, base_dir):
+        base_dir = os.path.normpath(base_dir or os.curdir)
+        with self.lock:
+            state_file = self.files.get(base_dir)
+            if state_file is None:
+                state_file = self.files[base_dir] = self.STATE_FILE(base_dir)
+            return state_file
+
+    def save(self):
+        for state_file in self.files.values():
+            state_file.save()
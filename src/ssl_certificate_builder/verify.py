@@ -0,0 +1,287 @@
+import datetime
+import functools
+import itertools
+import json
+import time
+
+try:
+    from cryptography import exceptions, x509
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+except ImportError:
+    x509 = None
+
+from .backends import CryptographyBackend
+from .builder import CertificateBuilder, certificate_key
+
+
+class VerifyTask:
+    """What to check about one certificate of an inventory.
+
+    Tasks are sent to worker processes, so they only hold plain values.
+    """
+
+    def __init__(self, key, cert_info, certificate_path, private_key_path,
+                 ca_certificate_path=None, key_password=None, now=None,
+                 within=0):
+        self.key = key
+        self.cert_info = cert_info
+        self.certificate_path = certificate_path
+        self.private_key_path = private_key_path
+        self.ca_certificate_path = ca_certificate_path
+        self.key_password = key_password
+        self.now = time.time() if now is None else now
+        self.within = within
+
+
+def verification_tasks(cert_infos, output_dir=None, password_source=None,
+                       within=0):
+    """Yield the VerifyTasks of the (basedir, cert_info) pairs of an
+    inventory.
+
+    output_dir has the same meaning as for generate_certificates.  The
+    passwords of encrypted keys are asked for here, in inventory order.
+    """
+    now = time.time()
+    for basedir, cert_info in cert_infos:
+        builder = CertificateBuilder(
+            cert_info,
+            base_dir=output_dir if output_dir and not cert_info.is_ca
+            else basedir,
+            ca_dir=basedir, password_source=password_source)
+        builder.read_key_password()
+        yield VerifyTask(
+            certificate_key(basedir, cert_info.basename), cert_info,
+            builder.certificate_path, builder.private_key_path,
+            builder.ca_certificate_path if cert_info.ca is not None
+            else None,
+            builder.key_password, now, within)
+
+
+def _read_certificate(path):
+    with open(path, "rb") as f:
+        return x509.load_pem_x509_certificate(f.read())
+
+
+@functools.lru_cache(maxsize=None)
+def _read_ca_certificate(path):
+    """Read a CA certificate once per process, however many certificates it
+    signed.
+    """
+    return _read_certificate(path)
+
+
+def _public_key_bytes(key):
+    return key.public_bytes(serialization.Encoding.DER,
+                            serialization.PublicFormat.SubjectPublicKeyInfo)
+
+
+def _key_algorithm(public_key):
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return "rsa-%d" % public_key.key_size
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return "ec-%s" % CryptographyBackend.CURVE_NAMES.get(
+            public_key.curve.name, public_key.curve.name)
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return "ed25519"
+    return type(public_key).__name__
+
+
+def _basic_constraints(certificate):
+    try:
+        return certificate.extensions.get_extension_for_class(
+            x509.BasicConstraints).value
+    except x509.ExtensionNotFound:
+        return None
+
+
+def _is_ca(certificate):
+    constraints = _basic_constraints(certificate)
+    return constraints is not None and constraints.ca
+
+
+def _check_key(task, certificate):
+    try:
+        with open(task.private_key_path, "rb") as f:
+            private_key = serialization.load_pem_private_key(
+                f.read(), task.key_password.encode()
+                if task.key_password is not None else None)
+    except (OSError, TypeError, ValueError) as exc:
+        return "can't read the private key: %s" % exc
+    public_key = certificate.public_key()
+    if _public_key_bytes(private_key.public_key()) \
+            != _public_key_bytes(public_key):
+        return "the certificate doesn't match the private key %s" % (
+            task.private_key_path)
+    algorithm = _key_algorithm(public_key)
+    if algorithm != task.cert_info.key_algorithm:
+        return "the key is %s, expected %s" % (
+            algorithm, task.cert_info.key_algorithm)
+    return None
+
+
+def _check_chain(task, certificate):
+    if task.ca_certificate_path is None:
+        issuer = certificate
+    else:
+        try:
+            issuer = _read_ca_certificate(task.ca_certificate_path)
+        except (OSError, ValueError) as exc:
+            return "can't read the CA certificate: %s" % exc
+        if not _is_ca(issuer):
+            return "%s is not a CA certificate" % task.ca_certificate_path
+    try:
+        certificate.verify_directly_issued_by(issuer)
+    except exceptions.InvalidSignature:
+        return "the signature doesn't verify with the key of %s" % (
+            task.ca_certificate_path or "the certificate itself")
+    except (TypeError, ValueError) as exc:
+        return "not issued by %s: %s" % (
+            task.ca_certificate_path or "itself", exc)
+    return None
+
+
+def _check_subject(task, certificate):
+    expected = x509.Name([
+        x509.NameAttribute(getattr(x509.NameOID, oid),
+                           str(getattr(task.cert_info, attr)))
+        for attr, oid in CryptographyBackend.NAME_ATTRIBUTES
+        if getattr(task.cert_info, attr)])
+    if certificate.subject != expected:
+        return "%s, expected %s" % (certificate.subject.rfc4514_string(),
+                                    expected.rfc4514_string())
+    return None
+
+
+def _check_subject_alt_names(task, certificate):
+    try:
+        names = certificate.extensions.get_extension_for_class(
+            x509.SubjectAlternativeName).value.get_values_for_type(
+                x509.DNSName)
+    except x509.ExtensionNotFound:
+        names = []
+    expected = [str(name)
+                for name in task.cert_info.subject_alt_names or ()]
+    if names != expected:
+        return "%s, expected %s" % (", ".join(names) or "none",
+                                    ", ".join(expected) or "none")
+    return None
+
+
+def _check_basic_constraints(task, certificate):
+    constraints = _basic_constraints(certificate)
+    if constraints is None:
+        return "missing"
+    if constraints.ca != task.cert_info.is_ca:
+        return "CA:%s, expected CA:%s" % (str(constraints.ca).lower(),
+                                          str(task.cert_info.is_ca).lower())
+    return None
+
+
+def _check_expiry(task, certificate):
+    not_before = certificate.not_valid_before_utc
+    not_after = certificate.not_valid_after_utc
+    days = round((not_after - not_before).total_seconds() / 86400)
+    if days != int(task.cert_info.expiration_days):
+        return "valid for %d days, expected %s" % (
+            days, task.cert_info.expiration_days)
+    now = datetime.datetime.fromtimestamp(task.now, datetime.timezone.utc)
+    if not_after <= now:
+        return "expired on %s" % not_after.isoformat()
+    if not_after <= now + datetime.timedelta(seconds=task.within):
+        return "expires on %s" % not_after.isoformat()
+    return None
+
+
+CHECKS = (
+    ("key", _check_key),
+    ("chain", _check_chain),
+    ("subject", _check_subject),
+    ("subject_alt_names", _check_subject_alt_names),
+    ("basic_constraints", _check_basic_constraints),
+    ("expiry", _check_expiry),
+)
+
+
+def verify_certificate(task):
+    """Run CHECKS on the certificate of a VerifyTask.
+
+    Returns the result as a dict that can go into the JSON report.
+    """
+    checks = dict.fromkeys((name for name, _ in CHECKS), False)
+    errors = []
+    try:
+        certificate = _read_certificate(task.certificate_path)
+    except (OSError, ValueError) as exc:
+        errors.append("can't read the certificate: %s" % exc)
+    else:
+        for name, check in CHECKS:
+            error = check(task, certificate)
+            checks[name] = error is None
+            if error is not None:
+                errors.append("%s: %s" % (name, error))
+    return dict(certificate=task.key, path=task.certificate_path,
+                passed=not errors, checks=checks, errors=errors)
+
+
+# The most tasks sent to a worker at once.
+CHUNK_SIZE = 64
+
+
+def verify_certificates(tasks, jobs=1):
+    """Verify the certificates of tasks in up to jobs processes.
+
+    Yields the results in the order of tasks.  Neighbouring tasks, which
+    are usually signed by the same CA, go to the same worker in chunks, so
+    every worker reads few CA certificates.  tasks is consumed a window at
+    a time, so an inventory of any size takes little memory.
+    """
+    if x509 is None:
+        raise RuntimeError("gen-ssl verify requires the cryptography package")
+    if jobs <= 1:
+        yield from map(verify_certificate, tasks)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    tasks = iter(tasks)
+    window_size = 4 * jobs * CHUNK_SIZE
+    with ProcessPoolExecutor(jobs) as executor:
+        previous = ()
+        while True:
+            window = list(itertools.islice(tasks, window_size))
+            if not window:
+                break
+            chunk_size = max(1, min(CHUNK_SIZE, len(window) // (4 * jobs)))
+            # The next window is submitted before the results of the
+            # previous one are collected, so the workers never run dry.
+            results = executor.map(verify_certificate, window,
+                                   chunksize=chunk_size)
+            yield from previous
+            previous = results
+        yield from previous
+
+
+class Report:
+    """Writes the results of verify_certificates to a JSON file as they
+    come in, with the number of passed and failed certificates at the end.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "w")
+        self.file.write('{"certificates": [')
+        self.passed = 0
+        self.failed = 0
+
+    def add(self, result):
+        if self.passed or self.failed:
+            self.file.write(",")
+        self.file.write("\n ")
+        json.dump(result, self.file)
+        if result["passed"]:
+            self.passed += 1
+        else:
+            self.failed += 1
+
+    def close(self):
+        self.file.write('\n], "passed": %d, "failed": %d}\n'
+                        % (self.passed, self.failed))
+        self.file.close()
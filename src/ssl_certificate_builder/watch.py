@@ -0,0 +1,225 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import time
+
+from .builder import certificate_key
+from .inventory import JSON_LINES_EXTS, get_cert_infos
+
+
+DESCRIPTION_EXTS = (".yaml", ".yml") + JSON_LINES_EXTS
+
+
+def is_description_file(name):
+    return name.endswith(DESCRIPTION_EXTS) and not name.startswith(".")
+
+
+class InotifyWatcher:
+    """Reports changed description files in a directory through inotify.
+
+    libc is called through ctypes, so nothing needs to be compiled.
+    """
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_DELETE = 0x200
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                  self.MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno), directory)
+
+    def wait(self, timeout=None):
+        """Return the names of the files that changed, or an empty set if
+        nothing changed within timeout seconds.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        data = os.read(self.fd, 65536)
+        names = set()
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if is_description_file(name):
+                names.add(name)
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Reports changed description files by comparing their mtime and size
+    every interval seconds.
+    """
+
+    def __init__(self, directory, interval=1.0):
+        self.directory = directory
+        self.interval = interval
+        self.state = self._scan()
+
+    def _scan(self):
+        state = {}
+        for entry in os.scandir(self.directory):
+            if is_description_file(entry.name):
+                stat = entry.stat()
+                state[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return state
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            state = self._scan()
+            names = {name for name in set(state) | set(self.state)
+                     if state.get(name) != self.state.get(name)}
+            self.state = state
+            if names:
+                return names
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, max(0, deadline - time.monotonic()))
+            time.sleep(delay)
+
+    def close(self):
+        pass
+
+
+def get_watcher(directory, poll=False, interval=1.0):
+    """An InotifyWatcher, or a PollingWatcher where inotify isn't available
+    or poll is set.
+    """
+    if not poll:
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError, TypeError):
+            pass
+    return PollingWatcher(directory, interval)
+
+
+def debounced(watcher, delay):
+    """Yield the sets of changed files, each once delay seconds passed
+    without further changes.
+    """
+    while True:
+        names = watcher.wait()
+        while True:
+            more = watcher.wait(delay)
+            if not more:
+                break
+            names |= more
+        yield names
+
+
+def _description(cert_info):
+    return json.dumps(cert_info.to_dict(), sort_keys=True, default=str)
+
+
+class WatchedInventory:
+    """The parsed description files of a directory.
+
+    update() re-reads files and works out which certificates have to be
+    rebuilt: those that were added or whose description changed, and every
+    certificate signed, directly or through intermediates, by one of them.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+
+    def description_files(self):
+        return [name for name in os.listdir(self.directory)
+                if is_description_file(name)]
+
+    def __len__(self):
+        return sum(map(len, self.files.values()))
+
+    def _read(self, name):
+        entries = {}
+        for basedir, cert_info in get_cert_infos(
+                [os.path.join(self.directory, name)]):
+            entries[certificate_key(basedir, cert_info.basename)] = (
+                basedir, cert_info, _description(cert_info))
+        return entries
+
+    def update(self, names):
+        """Re-read the named files.
+
+        Returns the (basedir, cert_info) pairs to rebuild, CAs before the
+        certificates they sign; the keys of the certificates that were
+        removed; and the errors of files that couldn't be read, which keep
+        their previous contents.
+        """
+        changed = set()
+        removed = []
+        errors = []
+        for name in sorted(names):
+            old = self.files.get(name, {})
+            try:
+                new = self._read(name)
+            except FileNotFoundError:
+                new = {}
+            except Exception as exc:
+                errors.append("%s: %s" % (name, exc))
+                continue
+            if new:
+                self.files[name] = new
+            else:
+                self.files.pop(name, None)
+            changed.update(key for key, entry in new.items()
+                           if key not in old or old[key][2] != entry[2])
+            removed.extend(key for key in old if key not in new)
+        return self._with_dependents(changed), removed, errors
+
+    def _with_dependents(self, changed):
+        entries = [(key, basedir, cert_info)
+                   for _, file_entries in sorted(self.files.items())
+                   for key, (basedir, cert_info, _) in file_entries.items()]
+        while True:
+            dependents = {
+                key for key, basedir, cert_info in entries
+                if key not in changed and cert_info.ca is not None
+                and certificate_key(basedir, cert_info.ca) in changed}
+            if not dependents:
+                break
+            changed |= dependents
+        # CAs go before the certificates they sign, even if they are
+        # described in a later file.
+        pending = [entry for entry in entries if entry[0] in changed]
+        ordered = []
+        built = set()
+        while pending:
+            waiting = []
+            for key, basedir, cert_info in pending:
+                ca_key = (certificate_key(basedir, cert_info.ca)
+                          if cert_info.ca is not None else None)
+                if ca_key in changed and ca_key not in built \
+                        and ca_key != key:
+                    waiting.append((key, basedir, cert_info))
+                else:
+                    ordered.append((basedir, cert_info))
+                    built.add(key)
+            if len(waiting) == len(pending):
+                # A cycle; its certificates fail like in a normal run.
+                ordered.extend((basedir, cert_info)
+                               for _, basedir, cert_info in waiting)
+                break
+            pending = waiting
+        return ordered
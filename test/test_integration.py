@@ -1,11 +1,32 @@
 '''End-to-end integration tests.'''
+import asyncio
+import csv
+import itertools
+import json
 import os.path
+import pstats
 import shutil
+import ssl
 import subprocess
 import sys
+import tarfile
 import tempfile
 from textwrap import dedent
+import threading
+import time
 import unittest
+from unittest import mock
+import zipfile
+
+from ssl_certificate_builder import aio, output
+from ssl_certificate_builder.builder import CertificateInfo
+from ssl_certificate_builder.inventory import Inventory, get_cert_infos
+from ssl_certificate_builder.scheduler import DependencyFailed
+
+try:
+    import cryptography
+except ImportError:
+    cryptography = None
 
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
@@ -35,7 +56,8 @@ class IntegrationBaseTestCase:
         '''Append the given parts to the workspace path.'''
         return os.path.join(self.tmpdir.name, *parts)
 
-    def run_certificate_builder(self, *args, **kwargs):
+    def run_certificate_builder(self, *args, expected_returncode=0,
+                                **kwargs):
         '''Run ssl_certificate_builder main with the given arguments.'''
         full_args = [sys.executable, '-m', 'ssl_certificate_builder']
         full_args.extend(args)
@@ -47,12 +69,16 @@ class IntegrationBaseTestCase:
                 timeout=10,
                 encoding=sys.stdin.encoding,
                 **kwargs)
-            completed.check_returncode()
+            if completed.returncode != expected_returncode:
+                raise subprocess.CalledProcessError(
+                    completed.returncode, full_args,
+                    completed.stdout, completed.stderr)
         except (subprocess.TimeoutExpired,
                 subprocess.CalledProcessError) as exc:
             print('STDOUT:', exc.stdout)
             print('STDERR:', exc.stderr)
             raise
+        return completed
 
 
 class IntegrationTest(IntegrationBaseTestCase, unittest.TestCase):
@@ -256,5 +282,2058 @@ class IntegrationTest(IntegrationBaseTestCase, unittest.TestCase):
                               '-----END RSA PRIVATE KEY-----\n')
 
 
+
+class InventoryFormatTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for the description file formats.'''
+    def assert_certificates_exist(self, *basenames):
+        for basename in basenames:
+            self.assertIn('-----BEGIN CERTIFICATE-----',
+                          self.get_file_content(basename + '.cert'))
+
+    def test_should_read_multiple_yaml_documents(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            ---
+            - basename: ca
+              type: ca
+              CN: test-ca
+            - basename: cert-1
+              CN: cert-1
+              ca: ca
+            ---
+            basename: cert-2
+            CN: cert-2
+            ca: ca
+            ---
+            '''))
+
+        self.run_certificate_builder(self.path('certs.yaml'))
+
+        self.assert_certificates_exist('ca', 'cert-1', 'cert-2')
+
+    def test_should_resolve_aliases_between_entries(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            ---
+            - &defaults
+              basename: cert-1
+              C: DE
+              O: gen-ssl
+              CN: cert-1
+            - <<: *defaults
+              basename: cert-2
+              CN: cert-2
+            '''))
+
+        self.run_certificate_builder(self.path('certs.yaml'))
+
+        cnf = self.get_file_content('cert-2.cnf')
+        self.assertIn('C=DE', cnf)
+        self.assertIn('O=gen-ssl', cnf)
+        self.assertIn('CN=cert-2', cnf)
+
+    def test_should_read_json_lines(self):
+        self.given_file_content('certs.jsonl', dedent('''\
+            {"basename": "ca", "type": "ca", "CN": "test-ca"}
+
+            {"basename": "cert", "CN": "cert", "ca": "ca"}
+            '''))
+
+        self.run_certificate_builder(self.path('certs.jsonl'))
+
+        self.assert_certificates_exist('ca', 'cert')
+
+    def test_should_expand_basename_ranges(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            ---
+            - basename: node-{08..11}
+              CN: node-{08..11}.example.com
+              subject_alt_names:
+                - node-{08..11}.example.com
+                - node-{08..11}
+              key_type: ec
+            '''))
+
+        self.run_certificate_builder(self.path('certs.yaml'))
+
+        self.assert_certificates_exist('node-08', 'node-09', 'node-10',
+                                       'node-11')
+        self.assertFalse(os.path.exists(self.path('node-07.cert')))
+        cnf = self.get_file_content('node-09.cnf')
+        self.assertIn('CN=node-09.example.com', cnf)
+        self.assertIn('DNS.1=node-09.example.com', cnf)
+        self.assertIn('DNS.2=node-09', cnf)
+
+    def test_should_expand_ranges_lazily(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            basename: node-{1..1000000000}
+            CN: node-{1..1000000000}
+            '''))
+
+        cert_infos = get_cert_infos([self.path('certs.yaml')])
+
+        self.assertEqual(
+            [cert_info.CN for _, cert_info in itertools.islice(cert_infos, 3)],
+            ['node-1', 'node-2', 'node-3'])
+
+
+class InventoryTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Tests for the compact in-memory inventory.'''
+
+    def setUp(self):
+        super().setUp()
+        self.given_file_content('certs.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              C: DE
+              O: gen-ssl
+              CN: test-ca
+              key_type: ec
+              curve: P-384
+              use_password: true
+            - basename: node-{1..3}
+              C: DE
+              O: gen-ssl
+              CN: node-{1..3}.example.com
+              subject_alt_names:
+                - node-{1..3}.example.com
+                - node-{1..3}
+              ca: ca
+              key_size: '4096'
+            - basename: 1234
+              CN: Zürich
+              subject_alt_names: []
+              reuse_key: true
+            '''))
+        self.cert_infos = list(get_cert_infos([self.path('certs.yaml')]))
+
+    def test_should_keep_every_field_of_the_descriptions(self):
+        inventory = Inventory.from_files([self.path('certs.yaml')])
+
+        self.assertEqual(len(inventory), 5)
+        self.assertEqual(
+            [(basedir, cert_info.to_dict())
+             for basedir, cert_info in inventory],
+            [(basedir, cert_info.to_dict())
+             for basedir, cert_info in self.cert_infos])
+        self.assertEqual(inventory.get(2, 'subject_alt_names'),
+                         ('node-2.example.com', 'node-2'))
+        self.assertEqual(inventory.get(4, 'basename'), 1234)
+        self.assertTrue(inventory.get(0, 'use_password'))
+        with self.assertRaises(IndexError):
+            inventory[5]
+
+    def test_should_store_descriptions_compactly(self):
+        _, node_1 = self.cert_infos[1]
+        _, node_2 = self.cert_infos[2]
+
+        self.assertFalse(hasattr(node_1, '__dict__'))
+        self.assertIs(node_1.O, node_2.O)
+        self.assertIs(node_1.ca, node_2.ca)
+        self.assertEqual(node_1.subject_alt_names,
+                         ('node-1.example.com', 'node-1'))
+
+
+class ParallelGenerationTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for --jobs.'''
+    def test_should_issue_ca_before_signed_certificates(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            ---
+            - basename: ca
+              type: ca
+              CN: test-ca
+            - basename: cert-1
+              CN: cert-1
+              ca: ca
+            - basename: cert-2
+              CN: cert-2
+              ca: ca
+            - basename: cert-3
+              CN: cert-3
+            '''))
+
+        self.run_certificate_builder('--jobs', '4', self.path('certs.yaml'))
+
+        for basename in ('ca', 'cert-1', 'cert-2', 'cert-3'):
+            cert = self.get_file_content(basename + '.cert')
+            self.assertIn('-----BEGIN CERTIFICATE-----', cert)
+        subprocess.run(
+            ['openssl', 'verify', '-CAfile', self.path('ca.cert'),
+             self.path('cert-1.cert'), self.path('cert-2.cert')],
+            stdout=subprocess.PIPE, check=True)
+
+    def test_should_only_skip_dependents_of_failed_certificate(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            ---
+            - basename: broken-ca
+              type: ca
+              CN: broken-ca
+              key_size: not-a-number
+            - basename: broken-cert
+              CN: broken-cert
+              ca: broken-ca
+            - basename: ca
+              type: ca
+              CN: test-ca
+            - basename: cert
+              CN: cert
+              ca: ca
+            '''))
+
+        completed = self.run_certificate_builder(
+            '--jobs', '2', self.path('certs.yaml'), expected_returncode=1)
+
+        self.assertTrue(os.path.exists(self.path('ca.cert')))
+        self.assertTrue(os.path.exists(self.path('cert.cert')))
+        self.assertFalse(os.path.exists(self.path('broken-ca.cert')))
+        self.assertFalse(os.path.exists(self.path('broken-cert.cnf')))
+        self.assertIn('broken-cert', completed.stderr)
+
+    def given_ca_after_its_certificate(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            ---
+            - basename: cert
+              CN: cert
+              ca: ca
+            - basename: ca
+              type: ca
+              CN: new-ca
+            '''))
+
+    def test_should_fail_certificates_described_before_their_ca(self):
+        self.given_ca_after_its_certificate()
+
+        for _ in range(3):
+            completed = self.run_certificate_builder(
+                '--jobs', '4', self.path('certs.yaml'),
+                expected_returncode=1)
+
+            self.assertIn('%s: CA ca is neither described before it nor in'
+                          % self.path('cert'), completed.stderr)
+            self.assertFalse(os.path.exists(self.path('cert.cert')))
+            self.assertTrue(os.path.exists(self.path('ca.cert')))
+            os.remove(self.path('ca.cert'))
+            os.remove(self.path('ca.key'))
+
+    def test_should_not_replace_ca_used_before_it_is_described(self):
+        shutil.copy(os.path.join(DATA_DIR, 'ca.cert'), self.path())
+        shutil.copy(os.path.join(DATA_DIR, 'ca.key'), self.path())
+        self.given_ca_after_its_certificate()
+
+        completed = self.run_certificate_builder(
+            '--jobs', '4', self.path('certs.yaml'), expected_returncode=1)
+
+        self.assertIn('%s: CA ca has to be described before the '
+                      'certificates it signs' % self.path('ca'),
+                      completed.stderr)
+        with open(os.path.join(DATA_DIR, 'ca.cert')) as f:
+            self.assertEqual(self.get_file_content('ca.cert'), f.read())
+        subprocess.run(
+            ['openssl', 'verify', '-CAfile', self.path('ca.cert'),
+             self.path('cert.cert')],
+            stdout=subprocess.PIPE, check=True)
+
+
+
+class IncrementalBuildTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for --incremental.'''
+    CERTS = dedent('''\
+        ---
+        - basename: ca
+          type: ca
+          CN: {ca_cn}
+        - basename: cert
+          CN: {cert_cn}
+          ca: ca
+        - basename: other
+          CN: other
+        ''')
+
+    def given_certs(self, ca_cn='test-ca', cert_cn='test-cert'):
+        self.given_file_content(
+            'certs.yaml', self.CERTS.format(ca_cn=ca_cn, cert_cn=cert_cn))
+
+    def get_certificates(self):
+        return {basename: self.get_file_content(basename + '.cert')
+                for basename in ('ca', 'cert', 'other')}
+
+    def test_should_not_rebuild_unchanged_certificates(self):
+        self.given_certs()
+        self.run_certificate_builder('--incremental', self.path('certs.yaml'))
+        before = self.get_certificates()
+
+        self.run_certificate_builder('--incremental', self.path('certs.yaml'))
+
+        self.assertEqual(self.get_certificates(), before)
+
+    def test_should_rebuild_changed_certificate(self):
+        self.given_certs()
+        self.run_certificate_builder('--incremental', self.path('certs.yaml'))
+        before = self.get_certificates()
+
+        self.given_certs(cert_cn='changed-cert')
+        self.run_certificate_builder('--incremental', self.path('certs.yaml'))
+
+        after = self.get_certificates()
+        self.assertEqual(after['ca'], before['ca'])
+        self.assertNotEqual(after['cert'], before['cert'])
+        self.assertEqual(after['other'], before['other'])
+
+    def test_should_rebuild_certificates_of_reissued_ca(self):
+        self.given_certs()
+        self.run_certificate_builder('--incremental', self.path('certs.yaml'))
+        before = self.get_certificates()
+
+        self.given_certs(ca_cn='changed-ca')
+        self.run_certificate_builder('--incremental', self.path('certs.yaml'))
+
+        after = self.get_certificates()
+        self.assertNotEqual(after['ca'], before['ca'])
+        self.assertNotEqual(after['cert'], before['cert'])
+        self.assertEqual(after['other'], before['other'])
+
+    def test_should_rebuild_missing_outputs(self):
+        self.given_certs()
+        self.run_certificate_builder('--incremental', self.path('certs.yaml'))
+        os.remove(self.path('other.cert'))
+
+        self.run_certificate_builder('--incremental', self.path('certs.yaml'))
+
+        self.assertTrue(os.path.exists(self.path('other.cert')))
+
+    def test_should_rebuild_everything_after_a_corrupt_manifest(self):
+        self.given_certs()
+        self.run_certificate_builder('--incremental', self.path('certs.yaml'))
+        before = self.get_certificates()
+        self.given_file_content('.gen-ssl-manifest.json', '{"version": 1, ')
+
+        self.run_certificate_builder('--incremental', self.path('certs.yaml'))
+
+        after = self.get_certificates()
+        self.assertNotEqual(after['ca'], before['ca'])
+        self.assertEqual(json.loads(self.get_file_content(
+            '.gen-ssl-manifest.json'))['version'], 1)
+
+
+class KeyPoolTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for the private key pool.'''
+    def get_pooled_keys(self) -> set:
+        '''Get the contents of the keys left in the pool.'''
+        bucket = self.path('pool', 'rsa-1024')
+        return {self.get_file_content(os.path.join(bucket, name))
+                for name in os.listdir(bucket) if name.endswith('.key')}
+
+    def test_should_fill_pool(self):
+        self.run_certificate_builder(
+            'pool', 'fill', '--pool', self.path('pool'), '--key-size', '1024',
+            '--size', '3', '--jobs', '2')
+
+        self.assertEqual(len(self.get_pooled_keys()), 3)
+        completed = self.run_certificate_builder(
+            'pool', 'status', '--pool', self.path('pool'),
+            '--key-size', '1024')
+        self.assertEqual(completed.stdout, 'rsa-1024: 3\n')
+
+    def test_should_keep_pool_private(self):
+        os.mkdir(self.path('pool'), 0o755)
+
+        self.run_certificate_builder(
+            'pool', 'fill', '--pool', self.path('pool'), '--key-size', '1024',
+            '--size', '2')
+        self.given_file_content('cert.yaml', dedent('''\
+            - basename: cert
+              CN: cert
+              key_size: 1024
+            '''))
+        self.run_certificate_builder(
+            '--key-pool', self.path('pool'), self.path('cert.yaml'))
+
+        bucket = self.path('pool', 'rsa-1024')
+        for directory in (self.path('pool'), bucket,
+                          os.path.join(bucket, '.tmp'),
+                          os.path.join(bucket, '.claimed')):
+            self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+        names = [name for name in os.listdir(bucket)
+                 if name.endswith('.key')]
+        self.assertEqual(len(names), 1)
+        self.assertEqual(
+            os.stat(os.path.join(bucket, names[0])).st_mode & 0o777, 0o600)
+
+    def test_should_take_each_key_once(self):
+        self.run_certificate_builder(
+            'pool', 'fill', '--pool', self.path('pool'), '--key-size', '1024',
+            '--size', '3')
+        pooled_keys = self.get_pooled_keys()
+        self.given_file_content('certs.yaml', dedent('''\
+            ---
+            - basename: cert-1
+              CN: cert-1
+              key_size: 1024
+            - basename: cert-2
+              CN: cert-2
+              key_size: 1024
+            - basename: cert-3
+              CN: cert-3
+            '''))
+
+        self.run_certificate_builder(
+            '--key-pool', self.path('pool'), '--jobs', '3',
+            self.path('certs.yaml'))
+
+        keys = {self.get_file_content('cert-1.key'),
+                self.get_file_content('cert-2.key')}
+        self.assertEqual(len(keys), 2)
+        self.assertLessEqual(keys, pooled_keys)
+        self.assertNotIn(self.get_file_content('cert-3.key'), pooled_keys)
+        self.assertEqual(self.get_pooled_keys(), pooled_keys - keys)
+
+    def test_should_encrypt_pooled_key(self):
+        self.run_certificate_builder(
+            'pool', 'fill', '--pool', self.path('pool'), '--key-size', '1024',
+            '--size', '1')
+        self.given_file_content('cert.yaml', dedent('''\
+            ---
+            - basename: cert
+              CN: cert
+              key_size: 1024
+              use_password: true
+            '''))
+
+        self.run_certificate_builder(
+            '--key-pool', self.path('pool'), self.path('cert.yaml'),
+            input='key-password\n', universal_newlines=True)
+
+        self.assertEqual(self.get_pooled_keys(), set())
+        self.assertIn('ENCRYPTED', self.get_file_content('cert.key'))
+
+    def test_should_bucket_keys_by_type(self):
+        self.run_certificate_builder(
+            'pool', 'fill', '--pool', self.path('pool'), '--key-type', 'ec',
+            '--curve', 'secp384r1', '--size', '2')
+
+        completed = self.run_certificate_builder(
+            'pool', 'status', '--pool', self.path('pool'), '--key-type', 'ec',
+            '--curve', 'P-384')
+        self.assertEqual(completed.stdout, 'ec-secp384r1: 2\n')
+
+
+class SerialNumberTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for serial number allocation.'''
+    def setUp(self):
+        super().setUp()
+        shutil.copy(os.path.join(DATA_DIR, 'ca.cert'), self.path())
+        shutil.copy(os.path.join(DATA_DIR, 'ca.key'), self.path())
+
+    def given_leaves(self, filename: str, basenames: list):
+        '''Describe 1024 bit certificates signed by the test CA.'''
+        self.given_file_content(filename, ''.join(
+            '- {{basename: {0}, CN: {0}, ca: ca, key_size: 1024}}\n'
+            .format(basename) for basename in basenames))
+
+    def get_serial(self, basename: str) -> int:
+        '''Get the serial number of a certificate in the workspace.'''
+        output = subprocess.run(
+            ['openssl', 'x509', '-noout', '-serial',
+             '-in', self.path(basename + '.cert')],
+            stdout=subprocess.PIPE, check=True,
+            universal_newlines=True).stdout
+        return int(output.strip().split('=')[1], 16)
+
+    def test_should_continue_from_serial_file(self):
+        self.given_file_content('ca.srl', '1000\n')
+        self.given_leaves('certs.yaml', ['cert'])
+
+        self.run_certificate_builder(self.path('certs.yaml'))
+
+        self.assertEqual(self.get_serial('cert'), 0x1001)
+        self.assertGreaterEqual(int(self.get_file_content('ca.srl'), 16),
+                                0x1001)
+
+    def test_should_not_reuse_serials_across_concurrent_runs(self):
+        basenames = {name: ['%s-%d' % (name, index) for index in range(6)]
+                     for name in ('first', 'second')}
+        for name in basenames:
+            self.given_leaves(name + '.yaml', basenames[name])
+
+        processes = [
+            subprocess.Popen(
+                [sys.executable, '-m', 'ssl_certificate_builder',
+                 '--jobs', '3', '--backend', backend,
+                 self.path(name + '.yaml')],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for name, backend in zip(basenames, ('openssl', 'auto'))]
+        for process in processes:
+            self.assertEqual(process.wait(timeout=30), 0)
+
+        serials = [self.get_serial(basename)
+                   for names in basenames.values() for basename in names]
+        self.assertEqual(len(set(serials)), len(serials))
+        self.assertGreaterEqual(int(self.get_file_content('ca.srl'), 16),
+                                max(serials))
+
+
+class PasswordSourceTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for --password-source.'''
+    def given_two_cas(self):
+        self.given_file_content('certs.yaml', ''.join(dedent('''\
+            - basename: {ca}
+              type: ca
+              CN: {ca}
+              key_type: ec
+              use_password: true
+            - basename: {ca}-leaf-{{1..3}}
+              CN: {ca}-leaf-{{1..3}}
+              ca: {ca}
+              key_type: ec
+              use_password: true
+            ''').format(ca=ca) for ca in ('first', 'second')))
+
+    def assert_key_password(self, basename: str, password: str):
+        subprocess.run(
+            ['openssl', 'pkey', '-noout', '-in', self.path(basename + '.key'),
+             '-passin', 'pass:' + password],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+
+    def test_should_prompt_once_per_ca(self):
+        self.given_two_cas()
+
+        completed = self.run_certificate_builder(
+            '--password-source', 'prompt-per-ca', '--backend', 'openssl',
+            '--jobs', '4', self.path('certs.yaml'),
+            input='first-password\nsecond-password\n')
+
+        self.assertEqual(completed.stdout.count('Password for the keys of'),
+                         2)
+        for ca in ('first', 'second'):
+            for basename in (ca, ca + '-leaf-1', ca + '-leaf-3'):
+                self.assert_key_password(basename, ca + '-password')
+
+    def test_should_read_password_from_file_and_fd(self):
+        self.given_two_cas()
+        self.given_file_content('password', 'file-password\n')
+
+        self.run_certificate_builder(
+            '--password-source', 'file:' + self.path('password'),
+            self.path('certs.yaml'), stdin=subprocess.DEVNULL)
+
+        self.assert_key_password('second-leaf-2', 'file-password')
+
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b'fd-password\n')
+        os.close(write_fd)
+        try:
+            self.run_certificate_builder(
+                '--password-source', 'fd:%d' % read_fd,
+                self.path('certs.yaml'), stdin=subprocess.DEVNULL,
+                pass_fds=[read_fd])
+        finally:
+            os.close(read_fd)
+
+        self.assert_key_password('first-leaf-1', 'fd-password')
+
+    def test_should_fail_batch_when_ca_password_is_unavailable(self):
+        self.given_file_content('ca.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              CN: ca
+              key_type: ec
+              use_password: true
+            '''))
+        self.given_file_content('password', 'ca-password\n')
+        self.run_certificate_builder(
+            '--password-source', 'file:' + self.path('password'),
+            self.path('ca.yaml'))
+        self.given_file_content('certs.yaml', dedent('''\
+            - basename: leaf-{1..2}
+              CN: leaf-{1..2}
+              ca: ca
+              key_type: ec
+            '''))
+
+        completed = self.run_certificate_builder(
+            '--backend', 'openssl', '--batch-sign', '--atomic',
+            self.path('certs.yaml'), stdin=subprocess.DEVNULL,
+            expected_returncode=1)
+
+        self.assertNotIn('Traceback', completed.stderr)
+        for basename in ('leaf-1', 'leaf-2'):
+            self.assertIn('failed: %s' % self.path(basename),
+                          completed.stderr)
+            self.assertFalse(os.path.exists(self.path(basename + '.cert')))
+        self.assertEqual([name for name in os.listdir(self.path())
+                          if name.startswith('.gen-ssl-staging-')], [])
+
+    def test_should_reject_unknown_password_source(self):
+        completed = self.run_certificate_builder(
+            '--password-source', 'env:GEN_SSL_NO_SUCH_VARIABLE',
+            self.path('certs.yaml'), expected_returncode=2)
+
+        self.assertIn('GEN_SSL_NO_SUCH_VARIABLE is not set', completed.stderr)
+
+
+class TimingReportTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for --timings and --profile.'''
+    def setUp(self):
+        super().setUp()
+        self.given_file_content('certs.yaml', dedent('''\
+            ---
+            - basename: ca
+              type: ca
+              CN: ca
+              key_type: ec
+            - basename: cert
+              CN: cert
+              ca: ca
+              key_type: ec
+              use_password: true
+            '''))
+
+    def test_should_write_json_timing_report(self):
+        self.run_certificate_builder(
+            '--backend', 'openssl', '--timings', self.path('timings.json'),
+            self.path('certs.yaml'), input='secret\n')
+
+        with open(self.path('timings.json')) as f:
+            report = json.load(f)
+        stages = {row['name']: row for row in report['summary']
+                  if row['kind'] == 'stage'}
+        self.assertTrue({'parse', 'config', 'private_key', 'request',
+                         'self_signed', 'ca_signed'} <= set(stages))
+        self.assertEqual(stages['private_key']['count'], 2)
+        self.assertLessEqual(stages['private_key']['p50'],
+                             stages['private_key']['max'])
+        self.assertGreater(stages['private_key']['bytes_written'], 0)
+        self.assertGreater(stages['private_key']['child_cpu'], 0)
+        commands = {row['name'] for row in report['summary']
+                    if row['kind'] == 'command'}
+        self.assertEqual(commands, {'genpkey', 'req', 'x509'})
+        command_lines = [' '.join(record['command'])
+                         for record in report['commands']]
+        self.assertIn('-passin fd:', ' '.join(command_lines))
+        self.assertNotIn('secret', ' '.join(command_lines))
+
+    def test_should_count_bytes_of_rewritten_files(self):
+        self.run_certificate_builder(self.path('certs.yaml'),
+                                     input='secret\n')
+
+        self.run_certificate_builder(
+            '--backend', 'openssl', '--timings', self.path('timings.json'),
+            self.path('certs.yaml'), input='secret\n')
+
+        with open(self.path('timings.json')) as f:
+            report = json.load(f)
+        stages = {row['name']: row for row in report['summary']
+                  if row['kind'] == 'stage'}
+        for stage in ('config', 'private_key', 'self_signed', 'ca_signed'):
+            self.assertGreater(stages[stage]['bytes_written'], 0, stage)
+
+    def test_should_write_csv_timing_report(self):
+        self.run_certificate_builder(
+            '--timings', self.path('timings.csv'), self.path('certs.yaml'),
+            input='secret\n')
+
+        with open(self.path('timings.csv'), newline='') as f:
+            rows = list(csv.DictReader(f))
+        self.assertIn(('stage', 'private_key', '2'),
+                      [(row['kind'], row['name'], row['count'])
+                       for row in rows])
+
+    def test_should_write_profile(self):
+        self.run_certificate_builder(
+            '--profile', self.path('profile'), self.path('certs.yaml'),
+            input='secret\n')
+
+        stats = pstats.Stats(self.path('profile'))
+        self.assertIn('build_certificate',
+                      {name for _, _, name in stats.stats})
+
+
+class RenewalTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for gen-ssl renew.'''
+    def given_inventory(self, ca_days=3650, ca_cn='test-ca'):
+        self.given_file_content('certs.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              CN: {ca_cn}
+              key_type: ec
+              expiration_days: {ca_days}
+            - basename: short
+              CN: short
+              ca: ca
+              key_type: ec
+              expiration_days: 10
+            - basename: long
+              CN: long
+              ca: ca
+              key_type: ec
+              expiration_days: 365
+            ''').format(ca_days=ca_days, ca_cn=ca_cn))
+
+    def renew(self, *args) -> list:
+        '''Run gen-ssl renew and return the basenames it renewed.'''
+        completed = self.run_certificate_builder(
+            'renew', self.path('certs.yaml'), *args)
+        return [os.path.basename(line.split(': ')[1])
+                for line in completed.stdout.splitlines()]
+
+    def test_should_renew_expiring_certificates(self):
+        self.given_inventory()
+        self.run_certificate_builder(self.path('certs.yaml'))
+        long_cert = self.get_file_content('long.cert')
+        short_cert = self.get_file_content('short.cert')
+
+        self.assertEqual(self.renew('--within', '9d'), [])
+        self.assertEqual(self.renew('--within', '30d'), ['short'])
+
+        self.assertNotEqual(self.get_file_content('short.cert'), short_cert)
+        self.assertEqual(self.get_file_content('long.cert'), long_cert)
+        self.assertEqual(self.renew('--within', '9d'), [])
+
+    def test_should_renew_certificates_of_renewed_ca(self):
+        self.given_inventory(ca_days=20)
+        self.run_certificate_builder(self.path('certs.yaml'))
+
+        self.assertEqual(self.renew('--within', '5d'), [])
+        self.assertEqual(self.renew('--within', '30d', '--dry-run'),
+                         ['ca', 'short', 'long'])
+        self.assertEqual(self.renew('--within', '30d'),
+                         ['ca', 'short', 'long'])
+        self.assertEqual(self.renew('--within', '5d'), [])
+
+    def test_should_renew_certificates_of_reissued_ca(self):
+        self.given_inventory()
+        self.run_certificate_builder(self.path('certs.yaml'))
+        self.given_file_content('ca.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              CN: new-test-ca
+              key_type: ec
+            '''))
+        self.run_certificate_builder(self.path('ca.yaml'))
+
+        self.assertEqual(self.renew('--within', '1d'), ['short', 'long'])
+        self.assertIn('"not_after"',
+                      self.get_file_content('.gen-ssl-index.json'))
+
+    def test_should_renew_missing_certificates(self):
+        self.given_inventory()
+
+        self.assertEqual(self.renew(), ['ca', 'short', 'long'])
+        self.assertIn('-----BEGIN CERTIFICATE-----',
+                      self.get_file_content('long.cert'))
+
+
+class OutputWriterTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for --atomic and the output bundles.'''
+
+    def setUp(self):
+        super().setUp()
+        self.given_file_content('certs.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              CN: test-ca
+              key_type: ec
+            - basename: www
+              CN: www.example.com
+              ca: ca
+              key_type: ec
+            '''))
+
+    def assert_no_staging_dirs(self):
+        self.assertEqual(
+            [name for name in os.listdir(self.path())
+             if name.startswith('.gen-ssl-staging-')], [])
+
+    def test_should_move_staged_files_into_place(self):
+        self.run_certificate_builder('--atomic', '--sync-batch', '1',
+                                     self.path('certs.yaml'))
+
+        self.assert_no_staging_dirs()
+        self.assertEqual(sorted(os.listdir(self.path())), [
+            'ca.cert', 'ca.cnf', 'ca.key', 'ca.srl', 'certs.yaml',
+            'www.cert', 'www.cnf', 'www.csr', 'www.key'])
+        subprocess.run(
+            ['openssl', 'verify', '-CAfile', self.path('ca.cert'),
+             self.path('www.cert')],
+            stdout=subprocess.PIPE, check=True)
+
+    def test_should_write_fullchain_and_pkcs12_bundles(self):
+        self.run_certificate_builder('--fullchain', '--pkcs12',
+                                     self.path('certs.yaml'))
+
+        fullchain = self.get_file_content('www.fullchain.pem')
+        self.assertEqual(fullchain.count('BEGIN CERTIFICATE'), 2)
+        self.assertTrue(fullchain.startswith(self.get_file_content(
+            'www.cert')))
+        info = subprocess.run(
+            ['openssl', 'pkcs12', '-info', '-nokeys', '-passin', 'pass:',
+             '-in', self.path('www.p12')],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+            universal_newlines=True).stdout
+        self.assertEqual(info.count('BEGIN CERTIFICATE'), 2)
+        self.assertEqual(os.stat(self.path('www.p12')).st_mode & 0o777,
+                         0o600)
+        self.assert_no_staging_dirs()
+
+    def test_should_collect_outputs_in_an_archive(self):
+        for archive in ('out.tar.gz', 'out.zip'):
+            self.run_certificate_builder('--archive', self.path(archive),
+                                         self.path('certs.yaml'))
+
+        with tarfile.open(self.path('out.tar.gz')) as tar:
+            self.assertEqual(sorted(tar.getnames()), [
+                'ca.cert', 'ca.cnf', 'ca.key',
+                'www.cert', 'www.cnf', 'www.csr', 'www.key'])
+            self.assertEqual(tar.getmember('www.key').mode, 0o600)
+        with zipfile.ZipFile(self.path('out.zip')) as archive:
+            self.assertIn('www.cert', archive.namelist())
+
+    def test_should_leave_nothing_behind_for_failed_certificates(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            - basename: www
+              CN: www.example.com
+              ca: missing
+            '''))
+
+        self.run_certificate_builder('--atomic', self.path('certs.yaml'),
+                                     expected_returncode=1)
+
+        self.assertEqual(os.listdir(self.path()), ['certs.yaml'])
+
+    def test_should_sync_only_the_output_filesystem(self):
+        staging_dir = tempfile.mkdtemp(
+            prefix=output.OutputWriter.STAGING_PREFIX, dir=self.path())
+        with open(os.path.join(staging_dir, 'www.cert'), 'w') as f:
+            f.write('certificate')
+        writer = output.OutputWriter()
+        writer.pending.append((staging_dir, self.path(), ['www.cert']))
+
+        with mock.patch('os.sync') as sync, \
+                mock.patch.object(output, '_libc_syncfs',
+                                  return_value=None), \
+                mock.patch('os.fsync', wraps=os.fsync) as fsync:
+            writer.flush()
+
+        sync.assert_not_called()
+        # The staged file without syncfs(), then its directory.
+        self.assertEqual(fsync.call_count, 2)
+        self.assertEqual(self.get_file_content('www.cert'), 'certificate')
+        self.assert_no_staging_dirs()
+
+
+class PlanTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for gen-ssl plan.'''
+
+    def given_inventory(self, extra=''):
+        self.given_file_content('certs.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              CN: test-ca
+              key_type: ec
+            - basename: www
+              CN: www.example.com
+              ca: ca
+              key_type: ec
+            ''') + dedent(extra))
+
+    def plan(self, *args, expected_returncode=0):
+        return self.run_certificate_builder(
+            'plan', self.path('certs.yaml'), *args,
+            expected_returncode=expected_returncode)
+
+    def test_should_report_problems_without_building_anything(self):
+        self.given_inventory('''\
+            - basename: typo
+              CN: typo
+              key-sise: 4096
+            - basename: orphan
+              ca: missing
+            - basename: early
+              ca: late
+            - basename: late
+              type: ca
+              ca: early
+            - basename: www
+              key_size: big
+            ''')
+
+        completed = self.plan(expected_returncode=1)
+
+        errors = completed.stderr.splitlines()
+        self.assertIn("unknown key 'key-sise'", errors[0])
+        self.assertIn('key_size should be of type int, not str', errors[1])
+        self.assertIn('CA missing is neither described nor in', errors[2])
+        self.assertIn('CA late has to be described before', errors[3])
+        self.assertIn('early is not a CA', errors[4])
+        self.assertEqual(
+            errors[5], 'error: CAs sign each other in a cycle: '
+                       '%s -> %s -> %s' % (self.path('early'),
+                                           self.path('late'),
+                                           self.path('early')))
+        self.assertEqual(os.listdir(self.path()), ['certs.yaml'])
+
+    def test_should_accept_quoted_numbers_and_report_unknown_types(self):
+        self.given_inventory('''\
+            - basename: api
+              CN: api.example.com
+              ca: ca
+              key_size: '4096'
+              expiration-days: '365'
+            - basename: other-ca
+              type: CA
+              CN: other-ca
+            - basename: bad
+              key_size: '4k'
+            ''')
+
+        completed = self.plan(expected_returncode=1)
+
+        errors = completed.stderr.splitlines()
+        self.assertEqual(len(errors), 2, completed.stderr)
+        self.assertIn("unknown type 'CA'", errors[0])
+        self.assertIn('key_size should be of type int, not str', errors[1])
+
+    def test_should_report_new_changed_and_up_to_date_certificates(self):
+        self.given_inventory()
+        self.run_certificate_builder('--incremental',
+                                     self.path('certs.yaml'))
+        self.given_inventory('''\
+            - basename: api
+              CN: api.example.com
+              ca: ca
+            ''')
+
+        completed = self.plan('--verbose')
+
+        self.assertEqual(completed.stdout.splitlines()[-1],
+                         '3 certificates: 1 new, 0 changed, 2 up to date')
+        self.assertIn('new        %s' % self.path('api'), completed.stdout)
+
+        self.given_file_content('certs.yaml', self.get_file_content(
+            'certs.yaml').replace('CN: test-ca', 'CN: other-ca'))
+
+        completed = self.plan()
+
+        self.assertEqual(completed.stdout.splitlines(), [
+            'changed    %s' % self.path('ca'),
+            'changed    %s' % self.path('www'),
+            'new        %s' % self.path('api'),
+            '3 certificates: 1 new, 2 changed, 0 up to date'])
+
+    def test_should_estimate_the_run_time_from_benchmark_results(self):
+        self.given_inventory('''\
+            - basename: node-{1..100}
+              CN: node-{1..100}
+              ca: ca
+            ''')
+        results = [
+            dict(name='config', median=0.0),
+            dict(name='keygen', backend='openssl', algorithm='ec-prime256v1',
+                 median=60.0),
+            dict(name='request', backend='openssl', median=0.25),
+            dict(name='self_signed', backend='openssl', median=0.5),
+            dict(name='ca_signed', backend='openssl', median=0.25),
+        ]
+        self.given_file_content('costs.json', json.dumps(dict(
+            environment={}, results=results)))
+
+        completed = self.plan('--costs', self.path('costs.json'),
+                              '--backend', 'openssl', '-j', '2')
+
+        # Two EC certificates at a minute each and 100 RSA ones that only
+        # cost their signing, as RSA key generation wasn't measured.
+        self.assertIn('with the openssl backend and 2 jobs: 1m 26s for the '
+                      '102 outdated certificates', completed.stdout)
+        self.assertIn('no benchmark results for keygen openssl rsa-2048',
+                      completed.stderr)
+
+
+@unittest.skipUnless(cryptography, 'cryptography is not installed')
+class VerifyTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for gen-ssl verify.'''
+
+    def setUp(self):
+        super().setUp()
+        self.given_file_content('certs.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              CN: test-ca
+              key_type: ec
+            - basename: www
+              CN: www.example.com
+              ca: ca
+              key_type: ec
+              subject_alt_names: [www.example.com, example.com]
+            - basename: api
+              CN: api.example.com
+              ca: ca
+              expiration_days: 30
+            '''))
+        self.run_certificate_builder(self.path('certs.yaml'))
+
+    def verify(self, *args, expected_returncode=0):
+        completed = self.run_certificate_builder(
+            'verify', self.path('certs.yaml'), '--report',
+            self.path('report.json'), *args,
+            expected_returncode=expected_returncode)
+        with open(self.path('report.json')) as f:
+            return completed, json.load(f)
+
+    def test_should_pass_certificates_that_match_their_descriptions(self):
+        completed, report = self.verify('-j', '2', '--verbose')
+
+        self.assertEqual(completed.stdout.splitlines()[-1],
+                         'verified 3 certificates: 3 passed, 0 failed')
+        self.assertEqual((report['passed'], report['failed']), (3, 0))
+        self.assertEqual(
+            [result['certificate'] for result in report['certificates']],
+            [self.path('ca'), self.path('www'), self.path('api')])
+        for result in report['certificates']:
+            self.assertEqual(set(result['checks'].values()), {True})
+
+    def test_should_report_the_checks_that_fail(self):
+        shutil.copy(self.path('www.key'), self.path('ca.key'))
+        self.given_file_content('certs.yaml', self.get_file_content(
+            'certs.yaml').replace('example.com]', 'example.org]'))
+
+        completed, report = self.verify('--within', '60d',
+                                        expected_returncode=1)
+
+        self.assertEqual(completed.stdout.splitlines()[-1],
+                         'verified 3 certificates: 0 passed, 3 failed')
+        checks = {result['certificate']: result['checks']
+                  for result in report['certificates']}
+        self.assertFalse(checks[self.path('ca')]['key'])
+        self.assertTrue(checks[self.path('ca')]['chain'])
+        self.assertFalse(checks[self.path('www')]['subject_alt_names'])
+        self.assertTrue(checks[self.path('www')]['chain'])
+        self.assertFalse(checks[self.path('api')]['expiry'])
+        self.assertTrue(checks[self.path('api')]['key'])
+        self.assertIn('subject_alt_names: www.example.com, example.com, '
+                      'expected www.example.com, example.org',
+                      completed.stdout)
+
+    def test_should_fail_certificates_not_signed_by_their_ca(self):
+        os.mkdir(self.path('other'))
+        self.given_file_content('other/ca.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              CN: test-ca
+              key_type: ec
+            '''))
+        self.run_certificate_builder(self.path('other', 'ca.yaml'))
+        shutil.copy(self.path('other', 'ca.cert'), self.path('ca.cert'))
+
+        completed, report = self.verify(expected_returncode=1)
+
+        failed = [result['certificate'] for result in report['certificates']
+                  if not result['checks']['chain']]
+        self.assertEqual(failed, [self.path('www'), self.path('api')])
+        self.assertIn('FAIL %s' % self.path('ca'), completed.stdout)
+
+
+class WatchTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for gen-ssl watch.'''
+    def setUp(self):
+        super().setUp()
+        os.mkdir(self.path('pki'))
+        self.given_file_content('pki/certs.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              CN: test-ca
+              key_type: ec
+            - basename: www
+              CN: www.example.com
+              ca: ca
+              key_type: ec
+            - basename: db
+              CN: db.example.com
+              ca: ca
+              key_type: ec
+            '''))
+        self.run_certificate_builder(self.path('pki', 'certs.yaml'))
+        self.watcher = None
+
+    def tearDown(self):
+        if self.watcher is not None:
+            self.watcher.terminate()
+            self.watcher.wait()
+            self.watcher.stdout.close()
+        super().tearDown()
+
+    def start_watch(self, *args):
+        self.watcher = subprocess.Popen(
+            [sys.executable, '-m', 'ssl_certificate_builder', 'watch',
+             self.path('pki'), '--debounce', '0.2'] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True)
+        # Unblock readline() if the watcher never reports.
+        timer = threading.Timer(30, self.watcher.kill)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertEqual(self.watcher.stdout.readline(),
+                         'watching %s: 3 certificates\n' % self.path('pki'))
+
+    def wait_for_rebuild(self) -> str:
+        '''Return the list of rebuilt certificates of the next rebuild.'''
+        line = self.watcher.stdout.readline()
+        self.assertTrue(line.startswith('rebuilding: '), line)
+        self.assertRegex(self.watcher.stdout.readline(),
+                         r'^rebuilt \d+ certificates, 0 failed$')
+        return line[len('rebuilding: '):].strip()
+
+    def edit(self, old, new):
+        content = self.get_file_content('pki/certs.yaml')
+        self.given_file_content('pki/certs.yaml', content.replace(old, new))
+
+    def check_rebuilds_only_changed_entries(self):
+        ca_cert = self.get_file_content('pki/ca.cert')
+        db_cert = self.get_file_content('pki/db.cert')
+
+        self.edit('CN: www.example.com', 'CN: www.example.org')
+        # A burst of edits is rebuilt once.
+        self.edit('- basename: db', dedent('''\
+            - basename: api
+              CN: api.example.com
+              ca: ca
+              key_type: ec
+            - basename: db'''))
+
+        self.assertEqual(self.wait_for_rebuild(), ', '.join(
+            [self.path('pki', 'www'), self.path('pki', 'api')]))
+        self.assertEqual(self.get_file_content('pki/ca.cert'), ca_cert)
+        self.assertEqual(self.get_file_content('pki/db.cert'), db_cert)
+        self.assertIn('CN = www.example.org', subprocess.run(
+            ['openssl', 'x509', '-noout', '-subject',
+             '-in', self.path('pki', 'www.cert')],
+            stdout=subprocess.PIPE, check=True,
+            universal_newlines=True).stdout)
+
+        self.edit('CN: test-ca', 'CN: other-ca')
+
+        self.assertEqual(self.wait_for_rebuild(), ', '.join(
+            self.path('pki', name) for name in ('ca', 'www', 'api', 'db')))
+        subprocess.run(
+            ['openssl', 'verify', '-CAfile', self.path('pki', 'ca.cert'),
+             self.path('pki', 'db.cert')],
+            stdout=subprocess.PIPE, check=True)
+
+    def test_should_rebuild_changed_entries_with_inotify(self):
+        self.start_watch()
+        self.check_rebuilds_only_changed_entries()
+
+    def test_should_rebuild_changed_entries_when_polling(self):
+        self.start_watch('--poll', '0.05')
+        self.check_rebuilds_only_changed_entries()
+
+
+class StartupTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Tests that keep the startup of gen-ssl cheap.'''
+
+    def test_should_not_import_heavy_modules_at_startup(self):
+        completed = subprocess.run(
+            [sys.executable, '-c', dedent('''\
+                import sys
+                import ssl_certificate_builder.__main__
+                print(sorted(name.split('.')[0] for name in sys.modules))
+                ''')],
+            stdout=subprocess.PIPE, check=True, universal_newlines=True)
+
+        loaded = completed.stdout
+        for name in ('jinja2', 'yaml', 'cryptography', 'http', 'asyncio',
+                     'ctypes', 'tarfile', 'zipfile', 'pstats',
+                     'concurrent'):
+            self.assertNotIn("'%s'" % name, loaded)
+
+    def test_should_render_config_files_exactly(self):
+        cert_info = CertificateInfo(
+            'www', C='DE', CN='www.example.com', ca='ca', key_type='ec',
+            subject_alt_names=['www.example.com', 'example.com'])
+        ca_info = CertificateInfo('ca', O='gen-ssl', is_ca=True,
+                                  key_type='ed25519')
+
+        self.assertEqual(cert_info.get_config_file(), dedent('''\
+            extensions=v3_extensions
+
+            [req]
+            req_extensions=v3_extensions
+            x509_extensions=v3_extensions
+            distinguished_name=req_distinguished_name
+            prompt=no
+            default_md=sha256
+
+            [req_distinguished_name]
+            C=DE
+
+
+
+
+            CN=www.example.com
+
+            [v3_extensions]
+            basicConstraints=CA:false
+            keyUsage=digitalSignature, nonRepudiation
+            subjectAltName=@alt_names
+
+            [alt_names]
+            DNS.1=www.example.com
+            DNS.2=example.com
+            '''))
+        self.assertEqual(ca_info.get_config_file(), dedent('''\
+            extensions=v3_extensions
+
+            [req]
+            req_extensions=v3_extensions
+            x509_extensions=v3_extensions
+            distinguished_name=req_distinguished_name
+            prompt=no
+
+
+            [req_distinguished_name]
+
+
+
+            O=gen-ssl
+
+
+
+            [v3_extensions]
+            basicConstraints=CA:true
+            subjectKeyIdentifier=hash
+            authorityKeyIdentifier=keyid:always, issuer
+            '''))
+
+
+class ShardingTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for --shard and gen-ssl merge.'''
+    SHARDS = 3
+
+    def setUp(self):
+        super().setUp()
+        self.given_file_content('certs.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              CN: test-ca
+              key_type: ec
+            - basename: node-{01..12}
+              CN: node-{01..12}
+              ca: ca
+              key_type: ec
+            '''))
+        self.basenames = ['node-%02d' % index for index in range(1, 13)]
+
+    def build_shards(self, *args):
+        '''Issue the CA, then build every shard in its own process.'''
+        self.run_certificate_builder('--cas-only', self.path('certs.yaml'))
+        processes = [
+            subprocess.Popen(
+                [sys.executable, '-m', 'ssl_certificate_builder',
+                 '--shard', '%d/%d' % (index, self.SHARDS),
+                 '--output-dir', self.path('shard-%d' % index),
+                 *args, self.path('certs.yaml')],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for index in range(self.SHARDS)]
+        for process in processes:
+            self.assertEqual(process.wait(timeout=30), 0)
+
+    def merge(self, expected_returncode=0):
+        return self.run_certificate_builder(
+            'merge', self.path('certs.yaml'),
+            *['--shard-dir=' + self.path('shard-%d' % index)
+              for index in range(self.SHARDS)],
+            expected_returncode=expected_returncode)
+
+    def test_should_build_disjoint_shards_and_merge_them(self):
+        self.build_shards()
+
+        self.assertEqual(sorted(os.listdir(self.path())),
+                         ['ca.cert', 'ca.cnf', 'ca.key', 'certs.yaml']
+                         + ['shard-%d' % index
+                            for index in range(self.SHARDS)])
+        per_shard = [
+            {name for name in os.listdir(self.path('shard-%d' % index))
+             if name.endswith('.cert')}
+            for index in range(self.SHARDS)]
+        self.assertEqual(sum(map(len, per_shard)), len(self.basenames))
+        self.assertEqual(set.union(*per_shard),
+                         {name + '.cert' for name in self.basenames})
+
+        self.merge()
+
+        serials = set()
+        for basename in self.basenames:
+            subprocess.run(
+                ['openssl', 'verify', '-CAfile', self.path('ca.cert'),
+                 self.path(basename + '.cert')],
+                stdout=subprocess.PIPE, check=True)
+            serials.add(subprocess.run(
+                ['openssl', 'x509', '-noout', '-serial',
+                 '-in', self.path(basename + '.cert')],
+                stdout=subprocess.PIPE, check=True,
+                universal_newlines=True).stdout)
+        self.assertEqual(len(serials), len(self.basenames))
+
+    def test_should_merge_bundles_with_their_certificates(self):
+        self.build_shards('--fullchain', '--pkcs12')
+
+        self.merge()
+
+        names = os.listdir(self.path())
+        for basename in self.basenames:
+            self.assertIn(basename + '.fullchain.pem', names)
+            self.assertIn(basename + '.p12', names)
+        for index in range(self.SHARDS):
+            self.assertEqual(
+                sorted(os.listdir(self.path('shard-%d' % index))),
+                ['.gen-ssl-shard.json', 'ca.srl'])
+
+    def test_should_refuse_incomplete_or_overlapping_shards(self):
+        self.build_shards()
+        shard_0 = os.listdir(self.path('shard-0'))
+        missing = next(name for name in shard_0 if name.endswith('.cert'))
+        os.remove(self.path('shard-0', missing))
+        extra = next(name for name in os.listdir(self.path('shard-1'))
+                     if name.endswith('.key'))
+        shutil.copy(self.path('shard-1', extra), self.path('shard-2'))
+
+        completed = self.merge(expected_returncode=1)
+
+        self.assertIn('%s: missing from its shard' % missing,
+                      completed.stderr)
+        self.assertIn('%s: not an output of this shard'
+                      % os.path.join(self.path('shard-2'), extra),
+                      completed.stderr)
+        self.assertFalse(any(name.startswith('node-')
+                             for name in os.listdir(self.path())))
+
+    def test_should_refuse_missing_shard_directory(self):
+        self.build_shards()
+        shutil.rmtree(self.path('shard-1'))
+        os.mkdir(self.path('shard-1'))
+
+        completed = self.merge(expected_returncode=1)
+
+        self.assertIn('not a shard output directory', completed.stderr)
+
+    def test_should_find_cas_next_to_a_bare_description_file_name(self):
+        package_dir = os.path.dirname(os.path.dirname(aio.__file__))
+        kwargs = dict(cwd=self.path(), env=dict(
+            os.environ, PYTHONPATH=os.pathsep.join(
+                [package_dir, os.environ.get('PYTHONPATH', '')])))
+        self.run_certificate_builder('--cas-only', 'certs.yaml', **kwargs)
+
+        self.run_certificate_builder('--shard', '0/%d' % self.SHARDS,
+                                     '--output-dir', 'shard-0', 'certs.yaml',
+                                     **kwargs)
+
+        leaves = [name for name in os.listdir(self.path('shard-0'))
+                  if name.endswith('.cert')]
+        self.assertTrue(leaves)
+        self.assertNotIn('ca.cert', os.listdir(self.path('shard-0')))
+        if cryptography is not None:
+            completed = self.run_certificate_builder(
+                'verify', '-v', '--output-dir', 'shard-0', 'certs.yaml',
+                expected_returncode=1, **kwargs)
+            self.assertNotIn("can't read the CA certificate",
+                             completed.stdout)
+            for name in leaves:
+                self.assertIn('ok   %s\n' % name[:-len('.cert')],
+                              completed.stdout)
+
+    def test_should_keep_cas_next_to_the_description_with_output_dir(self):
+        self.run_certificate_builder('--cas-only', '--output-dir',
+                                     self.path('cas'),
+                                     self.path('certs.yaml'))
+        self.run_certificate_builder('--shard', '1/%d' % self.SHARDS,
+                                     '--output-dir', self.path('shard-1'),
+                                     self.path('certs.yaml'))
+
+        self.assertIn('ca.cert', os.listdir(self.path()))
+        self.assertNotIn('ca.cert', os.listdir(self.path('cas')))
+        leaves = [name for name in os.listdir(self.path('shard-1'))
+                  if name.endswith('.cert')]
+        self.assertTrue(leaves)
+        for name in leaves:
+            subprocess.run(
+                ['openssl', 'verify', '-CAfile', self.path('ca.cert'),
+                 self.path('shard-1', name)],
+                stdout=subprocess.PIPE, check=True)
+
+
+class ServerTest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Integration tests for gen-ssl serve and gen-ssl request.'''
+    def setUp(self):
+        super().setUp()
+        os.mkdir(self.path('ca'))
+        shutil.copy(os.path.join(DATA_DIR, 'ca.cert'), self.path('ca'))
+        shutil.copy(os.path.join(DATA_DIR, 'ca.key'), self.path('ca'))
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.terminate()
+            self.server.wait()
+            self.server.stdout.close()
+        super().tearDown()
+
+    def start_server(self, *args) -> str:
+        '''Start gen-ssl serve on the CA directory and return its address.
+        '''
+        self.server = subprocess.Popen(
+            [sys.executable, '-m', 'ssl_certificate_builder', 'serve',
+             self.path('ca')] + list(args),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True)
+        line = self.server.stdout.readline()
+        self.assertTrue(line.startswith('listening on '), line)
+        return line.split(' ', 2)[2].strip()
+
+    def verify(self, filename: str) -> str:
+        '''Verify a certificate in the workspace against the test CA.'''
+        return subprocess.run(
+            ['openssl', 'verify', '-CAfile', self.path('ca', 'ca.cert'),
+             filename],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True).stdout
+
+    def test_should_issue_certificates_over_http(self):
+        address = self.start_server('--port', '0')
+        self.given_file_content('certs.jsonl', ''.join(
+            '{"basename": "cert-%d", "CN": "cert-%d", "ca": "ca", '
+            '"key_type": "ec"}\n' % (index, index) for index in range(3)))
+
+        self.run_certificate_builder('request', address,
+                                     self.path('certs.jsonl'))
+
+        for index in range(3):
+            self.assertIn('OK', self.verify(self.path('cert-%d.cert' % index)))
+            self.assertIn('BEGIN EC PRIVATE KEY',
+                          self.get_file_content('cert-%d.key' % index))
+        self.assertFalse(os.path.exists(self.path('ca', 'cert-0.cert')))
+
+    def test_should_sign_request_over_unix_socket(self):
+        address = self.start_server('--socket', self.path('gen-ssl.sock'))
+        subprocess.run(
+            ['openssl', 'req', '-new', '-newkey', 'ec',
+             '-pkeyopt', 'ec_paramgen_curve:prime256v1', '-nodes',
+             '-subj', '/CN=from-csr', '-keyout', self.path('csr.key'),
+             '-out', self.path('csr.pem')],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+        completed = self.run_certificate_builder(
+            'request', address, '--csr', self.path('csr.pem'), '--ca', 'ca',
+            '--san', 'from-csr.example.com')
+
+        self.given_file_content('signed.cert', completed.stdout)
+        self.assertIn('OK', self.verify(self.path('signed.cert')))
+        text = subprocess.run(
+            ['openssl', 'x509', '-noout', '-text',
+             '-in', self.path('signed.cert')],
+            stdout=subprocess.PIPE, check=True,
+            universal_newlines=True).stdout
+        self.assertIn('CN=from-csr', text.replace(' = ', '='))
+        self.assertIn('DNS:from-csr.example.com', text)
+
+    def test_should_reject_requests_with_invalid_signatures(self):
+        subprocess.run(
+            ['openssl', 'req', '-new', '-newkey', 'ec',
+             '-pkeyopt', 'ec_paramgen_curve:prime256v1', '-nodes',
+             '-subj', '/CN=forged', '-keyout', self.path('csr.key'),
+             '-outform', 'DER', '-out', self.path('csr.der')],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        with open(self.path('csr.der'), 'rb') as f:
+            der = bytearray(f.read())
+        # The signature comes last.
+        der[-1] ^= 0xff
+        self.given_file_content('csr.pem', ssl.DER_cert_to_PEM_cert(
+            bytes(der)).replace('CERTIFICATE', 'CERTIFICATE REQUEST'))
+
+        for backend in ('cryptography', 'openssl'):
+            if backend == 'cryptography' and cryptography is None:
+                continue
+            with self.subTest(backend=backend):
+                if self.server is not None:
+                    self.server.terminate()
+                    self.server.wait()
+                    self.server.stdout.close()
+                address = self.start_server('--port', '0',
+                                            '--backend', backend)
+
+                completed = self.run_certificate_builder(
+                    'request', address, '--csr', self.path('csr.pem'),
+                    '--ca', 'ca', expected_returncode=1)
+
+                self.assertNotIn('BEGIN CERTIFICATE', completed.stdout)
+                if backend == 'cryptography':
+                    self.assertIn('400', completed.stderr)
+                    self.assertIn('signature of the certificate request',
+                                  completed.stderr)
+
+    def test_should_sign_with_a_renewed_ca(self):
+        address = self.start_server('--port', '0')
+        self.given_file_content('certs.jsonl',
+                                '{"basename": "cert", "CN": "cert", '
+                                '"ca": "ca", "key_type": "ec"}\n')
+        self.run_certificate_builder('request', address,
+                                     self.path('certs.jsonl'))
+        self.given_file_content('ca/renewed.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              CN: renewed-ca
+              key_type: ec
+            '''))
+        self.run_certificate_builder(self.path('ca', 'renewed.yaml'))
+
+        self.run_certificate_builder('request', address,
+                                     self.path('certs.jsonl'))
+
+        self.assertIn('OK', self.verify(self.path('cert.cert')))
+        self.assertIn('CN=renewed-ca', subprocess.run(
+            ['openssl', 'x509', '-noout', '-issuer',
+             '-in', self.path('cert.cert')],
+            stdout=subprocess.PIPE, check=True,
+            universal_newlines=True).stdout.replace(' = ', '='))
+        self.assertEqual(os.stat(self.path('cert.key')).st_mode & 0o777,
+                         0o600)
+
+    def test_should_reject_values_that_rewrite_the_config(self):
+        address = self.start_server('--port', '0', '--backend', 'openssl')
+        injection = ('x\n[v3_extensions]\nbasicConstraints=critical,CA:true'
+                     '\nkeyUsage=keyCertSign')
+        self.given_file_content('certs.jsonl', ''.join(
+            json.dumps(dict(entry, basename=basename, ca='ca')) + '\n'
+            for basename, entry in (
+                ('san', dict(CN='leaf', subject_alt_names=[injection])),
+                ('cn', dict(CN=injection)),
+                ('section', dict(CN='leaf', O='[v3_extensions]')),
+                ('variable', dict(CN='${ENV::HOME}')))))
+        subprocess.run(
+            ['openssl', 'req', '-new', '-newkey', 'ec',
+             '-pkeyopt', 'ec_paramgen_curve:prime256v1', '-nodes',
+             '-subj', '/CN=from-csr', '-keyout', self.path('csr.key'),
+             '-out', self.path('csr.pem')],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+        completed = self.run_certificate_builder(
+            'request', address, self.path('certs.jsonl'),
+            expected_returncode=1)
+        signed = self.run_certificate_builder(
+            'request', address, '--csr', self.path('csr.pem'), '--ca', 'ca',
+            '--san', injection, expected_returncode=1)
+
+        for response in (completed, signed):
+            self.assertIn('400', response.stderr)
+            self.assertNotIn('BEGIN CERTIFICATE', response.stdout)
+        self.assertIn('may not contain', completed.stderr)
+        self.assertEqual(sorted(name for name in os.listdir(self.path())
+                                if name.endswith('.cert')), [])
+
+    def test_should_reject_unknown_ca(self):
+        address = self.start_server('--port', '0')
+        self.given_file_content('certs.yaml', dedent('''\
+            - basename: cert
+              CN: cert
+              ca: ../elsewhere
+            '''))
+
+        completed = self.run_certificate_builder(
+            'request', address, self.path('certs.yaml'),
+            expected_returncode=1)
+
+        self.assertIn('400', completed.stderr)
+        self.assertIn('unknown CA', completed.stderr)
+        self.assertFalse(os.path.exists(self.path('cert.cert')))
+
+
+class AsyncAPITest(IntegrationBaseTestCase, unittest.TestCase):
+    '''Tests for the asyncio API.'''
+    def setUp(self):
+        super().setUp()
+        shutil.copy(os.path.join(DATA_DIR, 'ca.cert'), self.path())
+        shutil.copy(os.path.join(DATA_DIR, 'ca.key'), self.path())
+
+    def test_should_stream_results_as_certificates_finish(self):
+        cert_infos = [
+            (self.path(), CertificateInfo('root', CN='root', is_ca=True,
+                                          key_type='ec')),
+            (self.path(), CertificateInfo('leaf', CN='leaf', ca='root',
+                                          key_type='ec')),
+            (self.path(), CertificateInfo('orphan', CN='orphan',
+                                          ca='missing', key_type='ec')),
+            (self.path(), CertificateInfo('other', CN='other', ca='ca',
+                                          key_type='ec')),
+        ]
+
+        async def collect():
+            return [(builder.cert_info.basename, error)
+                    async for builder, error in aio.generate_certificates(
+                        cert_infos, jobs=2)]
+
+        results = dict(asyncio.run(collect()))
+
+        self.assertEqual(set(results), {'root', 'leaf', 'orphan', 'other'})
+        self.assertIsNone(results['root'])
+        self.assertIsNone(results['leaf'])
+        self.assertIsNone(results['other'])
+        self.assertIsInstance(results['orphan'],
+                              subprocess.CalledProcessError)
+        self.assertFalse(os.path.exists(self.path('orphan.key')))
+        self.assertFalse(os.path.exists(self.path('orphan.csr')))
+        verified = subprocess.run(
+            ['openssl', 'verify', '-CAfile', self.path('root.cert'),
+             self.path('leaf.cert')],
+            stdout=subprocess.PIPE, universal_newlines=True).stdout
+        self.assertIn('OK', verified)
+
+    def test_should_skip_certificates_of_failed_ca(self):
+        cert_infos = [
+            (self.path(), CertificateInfo('root', CN='root', is_ca=True,
+                                          ca='missing', key_type='ec')),
+            (self.path(), CertificateInfo('leaf', CN='leaf', ca='root',
+                                          key_type='ec')),
+        ]
+
+        async def collect():
+            return dict([(builder.cert_info.basename, error)
+                         async for builder, error
+                         in aio.generate_certificates(cert_infos)])
+
+        results = asyncio.run(collect())
+
+        self.assertIsInstance(results['leaf'], DependencyFailed)
+        self.assertFalse(os.path.exists(self.path('leaf.key')))
+
+    def test_should_remove_partial_outputs_when_cancelled(self):
+        builder = aio.AsyncCertificateBuilder(
+            CertificateInfo('slow', CN='slow', key_size=8192),
+            base_dir=self.path())
+
+        async def cancel_during_keygen():
+            task = asyncio.ensure_future(builder.generate_full_certificate())
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        start = time.monotonic()
+        asyncio.run(cancel_during_keygen())
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(sorted(os.listdir(self.path())),
+                         ['ca.cert', 'ca.key'])
+
+
+class BackendTestMixin:
+    '''Tests that every backend has to pass.
+
+    Subclasses set BACKEND to the --backend value.'''
+    BACKEND = None
+    WRITES_REQUEST = True
+
+    def get_certificate_text(self, basename: str) -> str:
+        '''Get the openssl text dump of a certificate in the workspace.'''
+        return subprocess.run(
+            ['openssl', 'x509', '-noout', '-text',
+             '-in', self.path(basename + '.cert')],
+            stdout=subprocess.PIPE, check=True,
+            universal_newlines=True).stdout
+
+    def test_should_create_certificate_chain(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            ---
+            - basename: ca
+              type: ca
+              O: gen-ssl
+              CN: test-ca
+            - basename: cert
+              C: DE
+              O: gen-ssl
+              CN: test-cert
+              ca: ca
+              subject_alt_names:
+                - test-cert
+                - alt-1
+            '''))
+
+        self.run_certificate_builder(
+            '--backend', self.BACKEND, self.path('certs.yaml'))
+
+        subprocess.run(
+            ['openssl', 'verify', '-CAfile', self.path('ca.cert'),
+             self.path('cert.cert')],
+            stdout=subprocess.PIPE, check=True)
+        ca = self.get_certificate_text('ca')
+        self.assertIn('CA:TRUE', ca)
+        self.assertIn('X509v3 Subject Key Identifier', ca)
+        self.assertIn('X509v3 Authority Key Identifier', ca)
+        cert = self.get_certificate_text('cert')
+        self.assertRegex(cert, r'Subject: C ?= ?DE, O ?= ?gen-ssl, '
+                               r'CN ?= ?test-cert')
+        self.assertIn('CA:FALSE', cert)
+        self.assertIn('Digital Signature, Non Repudiation, '
+                      'Key Encipherment', cert)
+        self.assertIn('DNS:test-cert, DNS:alt-1', cert)
+        self.assertEqual(os.path.exists(self.path('cert.csr')),
+                         self.WRITES_REQUEST)
+
+    def test_should_share_config_files_between_similar_certificates(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              O: gen-ssl
+              CN: test-ca
+              key_type: ec
+            - basename: node-{1..6}
+              O: gen-ssl
+              CN: node-{1..6}
+              ca: ca
+              key_type: ec
+              subject_alt_names:
+                - node-{1..6}.example.com
+                - node-{1..6}
+            '''))
+
+        for args in [('--shared-config',),
+                     ('--shared-config', '--no-intermediates',
+                      '--batch-sign', '-j', '3'),
+                     ('--no-intermediates',)]:
+            with self.subTest(args=args):
+                self.run_certificate_builder(
+                    '--backend', self.BACKEND, *args,
+                    self.path('certs.yaml'))
+
+                for index in range(1, 7):
+                    subprocess.run(
+                        ['openssl', 'verify', '-CAfile', self.path('ca.cert'),
+                         self.path('node-%d.cert' % index)],
+                        stdout=subprocess.PIPE, check=True)
+                    cert = self.get_certificate_text('node-%d' % index)
+                    self.assertRegex(cert, r'Subject: O ?= ?gen-ssl, '
+                                           r'CN ?= ?node-%d\n' % index)
+                    self.assertIn('DNS:node-%d.example.com, DNS:node-%d'
+                                  % (index, index), cert)
+                self.assertIn('CA:TRUE', self.get_certificate_text('ca'))
+                names = os.listdir(self.path())
+                if '--no-intermediates' in args:
+                    self.assertEqual(
+                        [name for name in names
+                         if name.endswith(('.cnf', '.csr'))
+                         or name.startswith('.gen-ssl-configs')], [])
+                else:
+                    # One config for the CA and one for all leaves.
+                    self.assertEqual(len(os.listdir(
+                        self.path('.gen-ssl-configs'))), 2)
+                    self.assertNotIn('node-1.cnf', names)
+                    shutil.rmtree(self.path('.gen-ssl-configs'))
+
+    def test_should_sign_with_existing_ca(self):
+        self.given_file_content('cert.yaml', dedent('''\
+            ---
+            - basename: cert
+              CN: test-cert
+              ca: ca
+            '''))
+        shutil.copy(os.path.join(DATA_DIR, 'ca.cert'), self.path())
+        shutil.copy(os.path.join(DATA_DIR, 'ca.key'), self.path())
+
+        self.run_certificate_builder(
+            '--backend', self.BACKEND, self.path('cert.yaml'))
+
+        subprocess.run(
+            ['openssl', 'verify', '-CAfile', self.path('ca.cert'),
+             self.path('cert.cert')],
+            stdout=subprocess.PIPE, check=True)
+
+    def test_should_reuse_matching_private_key(self):
+        entry = dedent('''\
+            - basename: cert
+              CN: test-cert
+              key_type: ec
+              curve: {curve}
+              expiration_days: {days}
+            - basename: pinned
+              CN: pinned
+              key_type: rsa
+              key_size: 1024
+              reuse-key: true
+              expiration_days: {days}
+            ''')
+        self.given_file_content('cert.yaml', entry.format(
+            curve='prime256v1', days=10))
+        self.run_certificate_builder(
+            '--backend', self.BACKEND, self.path('cert.yaml'))
+        key = self.get_file_content('cert.key')
+        pinned_key = self.get_file_content('pinned.key')
+        cert = self.get_file_content('cert.cert')
+
+        self.given_file_content('cert.yaml', entry.format(
+            curve='prime256v1', days=20))
+        completed = self.run_certificate_builder(
+            '--backend', self.BACKEND, '--reuse-key',
+            self.path('cert.yaml'))
+
+        self.assertIn('reused 2 existing private keys', completed.stdout)
+        self.assertEqual(self.get_file_content('cert.key'), key)
+        self.assertNotEqual(self.get_file_content('cert.cert'), cert)
+        self.assertIn('OK', subprocess.run(
+            ['openssl', 'verify', '-CAfile', self.path('cert.cert'),
+             self.path('cert.cert')],
+            stdout=subprocess.PIPE, universal_newlines=True).stdout)
+
+        self.given_file_content('cert.yaml', entry.format(
+            curve='secp384r1', days=20))
+        completed = self.run_certificate_builder(
+            '--backend', self.BACKEND, self.path('cert.yaml'))
+
+        self.assertIn('reused 1 existing private keys', completed.stdout)
+        self.assertNotEqual(self.get_file_content('cert.key'), key)
+        self.assertEqual(self.get_file_content('pinned.key'), pinned_key)
+        self.assertIn('NIST CURVE: P-384', subprocess.run(
+            ['openssl', 'pkey', '-noout', '-text',
+             '-in', self.path('cert.key')],
+            stdout=subprocess.PIPE, universal_newlines=True).stdout)
+
+    def test_should_use_encrypted_ca_unattended(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              CN: test-ca
+              key_type: ec
+              use_password: true
+            - basename: cert-{1..4}
+              CN: cert-{1..4}
+              ca: ca
+              key_type: ec
+              use_password: true
+            '''))
+
+        self.run_certificate_builder(
+            '--backend', self.BACKEND, '--jobs', '4',
+            '--password-source', 'env:GEN_SSL_TEST_PASSWORD',
+            self.path('certs.yaml'), stdin=subprocess.DEVNULL,
+            env=dict(os.environ, GEN_SSL_TEST_PASSWORD='env-password'))
+
+        for basename in ('ca', 'cert-1', 'cert-4'):
+            subprocess.run(
+                ['openssl', 'pkey', '-noout', '-in',
+                 self.path(basename + '.key'), '-passin', 'pass:env-password'],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        subprocess.run(
+            ['openssl', 'verify', '-CAfile', self.path('ca.cert'),
+             self.path('cert-3.cert')],
+            stdout=subprocess.PIPE, check=True)
+
+    def test_should_write_private_keys_for_owner_only(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            ---
+            - basename: ca
+              type: ca
+              CN: test-ca
+            - basename: cert
+              CN: test-cert
+              ca: ca
+            '''))
+
+        self.run_certificate_builder(
+            '--backend', self.BACKEND, self.path('certs.yaml'))
+
+        for basename in ('ca', 'cert'):
+            self.assertEqual(
+                os.stat(self.path(basename + '.key')).st_mode & 0o777,
+                0o600)
+
+    def test_should_encrypt_private_key(self):
+        self.given_file_content('cert.yaml', dedent('''\
+            ---
+            - basename: cert
+              CN: test-cert
+              use_password: true
+            '''))
+
+        self.run_certificate_builder(
+            '--backend', self.BACKEND, self.path('cert.yaml'),
+            input='key-password\n', universal_newlines=True)
+
+        subprocess.run(
+            ['openssl', 'pkey', '-noout', '-in', self.path('cert.key'),
+             '-passin', 'pass:key-password'],
+            check=True)
+        self.assertIn('ENCRYPTED', self.get_file_content('cert.key'))
+
+    def test_should_create_ec_and_ed25519_certificates(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            ---
+            - basename: ca
+              type: ca
+              CN: test-ca
+              key-type: ed25519
+            - basename: ec-cert
+              CN: ec-cert
+              ca: ca
+              key-type: ec
+              curve: secp384r1
+            - basename: ec-ca
+              type: ca
+              CN: ec-ca
+              key-type: ec
+            - basename: rsa-cert
+              CN: rsa-cert
+              ca: ec-ca
+              key_size: 1024
+            '''))
+
+        self.run_certificate_builder(
+            '--backend', self.BACKEND, self.path('certs.yaml'))
+
+        for ca, cert in (('ca', 'ec-cert'), ('ec-ca', 'rsa-cert')):
+            subprocess.run(
+                ['openssl', 'verify', '-CAfile', self.path(ca + '.cert'),
+                 self.path(cert + '.cert')],
+                stdout=subprocess.PIPE, check=True)
+        self.assertIn('ED25519', self.get_certificate_text('ca'))
+        ec_cert = self.get_certificate_text('ec-cert')
+        self.assertIn('ASN1 OID: secp384r1', ec_cert)
+        self.assertIn('Digital Signature, Non Repudiation\n', ec_cert)
+        self.assertIn('ecdsa-with-SHA256',
+                      self.get_certificate_text('rsa-cert'))
+        self.assertIn('default_md=sha384',
+                      self.get_file_content('ec-cert.cnf'))
+        self.assertNotIn('default_md', self.get_file_content('ca.cnf'))
+
+    def test_should_sign_with_the_digest_of_the_ca_key(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            - basename: ca
+              type: ca
+              CN: test-ca
+              key-type: ec
+              curve: secp521r1
+            - basename: leaf
+              CN: leaf
+              ca: ca
+              key-type: ec
+            - basename: ed-ca
+              type: ca
+              CN: ed-ca
+              key-type: ed25519
+            - basename: ed-leaf
+              CN: ed-leaf
+              ca: ed-ca
+              key-type: ec
+            '''))
+
+        for args in [(), ('--batch-sign',)]:
+            with self.subTest(args=args):
+                self.run_certificate_builder(
+                    '--backend', self.BACKEND, *args,
+                    self.path('certs.yaml'))
+
+                self.assertIn('Signature Algorithm: ecdsa-with-SHA512',
+                              self.get_certificate_text('leaf'))
+                self.assertIn('Signature Algorithm: ED25519',
+                              self.get_certificate_text('ed-leaf'))
+
+    def test_should_batch_sign_certificates(self):
+        self.given_file_content('certs.yaml', dedent('''\
+            ---
+            - basename: ca
+              type: ca
+              CN: test-ca
+            - basename: cert-1
+              C: DE
+              CN: cert-1
+              ca: ca
+              key_size: 1024
+              subject_alt_names: [cert-1]
+            - basename: cert-2
+              CN: cert-2
+              ca: ca
+              key_size: 1024
+              expiration_days: 30
+            - basename: cert-3
+              CN: cert-3
+              ca: ca
+              key_size: 1024
+            '''))
+
+        self.run_certificate_builder(
+            '--backend', self.BACKEND, '--batch-sign', '--jobs', '2',
+            self.path('certs.yaml'))
+
+        subprocess.run(
+            ['openssl', 'verify', '-CAfile', self.path('ca.cert'),
+             self.path('cert-1.cert'), self.path('cert-2.cert'),
+             self.path('cert-3.cert')],
+            stdout=subprocess.PIPE, check=True)
+        cert = self.get_certificate_text('cert-1')
+        self.assertRegex(cert, r'Subject: C ?= ?DE, CN ?= ?cert-1')
+        self.assertIn('CA:FALSE', cert)
+        self.assertIn('DNS:cert-1', cert)
+        serials = {self.get_certificate_text(basename).split(
+                       'Serial Number:')[1].split('Signature')[0]
+                   for basename in ('cert-1', 'cert-2', 'cert-3')}
+        self.assertEqual(len(serials), 3)
+
+
+class OpenSSLBackendTest(BackendTestMixin, IntegrationBaseTestCase,
+                         unittest.TestCase):
+    '''Tests for the openssl command line backend.'''
+    BACKEND = 'openssl'
+
+
+class OpenSSLPipelineBackendTest(BackendTestMixin, IntegrationBaseTestCase,
+                                 unittest.TestCase):
+    '''Tests for the pipelined openssl command line backend.'''
+    BACKEND = 'openssl-pipe'
+    WRITES_REQUEST = False
+
+    def test_should_use_pooled_key(self):
+        self.run_certificate_builder(
+            'pool', 'fill', '--pool', self.path('pool'), '--key-size', '1024',
+            '--size', '2', '--backend', self.BACKEND)
+        self.given_file_content('certs.yaml', dedent('''\
+            ---
+            - basename: ca
+              type: ca
+              CN: ca
+              key_size: 1024
+            - basename: cert
+              CN: cert
+              ca: ca
+              key_size: 1024
+            '''))
+
+        self.run_certificate_builder(
+            '--backend', self.BACKEND, '--key-pool', self.path('pool'),
+            self.path('certs.yaml'))
+
+        self.assertEqual(sorted(os.listdir(self.path('pool', 'rsa-1024'))),
+                         ['.claimed', '.tmp'])
+        subprocess.run(
+            ['openssl', 'verify', '-CAfile', self.path('ca.cert'),
+             self.path('cert.cert')],
+            stdout=subprocess.PIPE, check=True)
+
+
+@unittest.skipUnless(cryptography, 'cryptography is not installed')
+class CryptographyBackendTest(BackendTestMixin, IntegrationBaseTestCase,
+                              unittest.TestCase):
+    '''Tests for the in-process cryptography backend.'''
+    BACKEND = 'cryptography'
+
+    def test_should_make_existing_key_files_private(self):
+        self.given_file_content('cert.yaml', dedent('''\
+            ---
+            - basename: cert
+              CN: test-cert
+            '''))
+        self.given_file_content('cert.key', '')
+        os.chmod(self.path('cert.key'), 0o644)
+
+        self.run_certificate_builder(
+            '--backend', self.BACKEND, self.path('cert.yaml'))
+
+        self.assertEqual(os.stat(self.path('cert.key')).st_mode & 0o777,
+                         0o600)
+        self.assertIn('PRIVATE KEY', self.get_file_content('cert.key'))
+
+
 if __name__ == '__main__':
     unittest.main()